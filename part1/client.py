@@ -1,5 +1,24 @@
+import os
+import sys
+import time
+
+# the retransmit timer is shared by part1 and part2
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from protocol.rtt import RttEstimator  # noqa: E402
+
+
 class Client:
-    def __init__(self, server_address, default_port, byte_align=4):
+    def __init__(
+        self,
+        server_address,
+        default_port,
+        byte_align=4,
+        window=1,
+        batch=64,
+        nodelay=False,
+        cork=False,
+    ):
         self._server_address = server_address
         self._port = default_port
         self._read_size = 1024
@@ -7,6 +26,14 @@ class Client:
         self._p_secret = 0
         self._step = 1
         self._student_id = 246
+        self._window = window
+        self._batch = batch
+        self._nodelay = nodelay
+        self._cork = cork
+        self._rtt = RttEstimator()
+        # time each stage finished at, and why the session stopped early
+        self._stage_times = {"start": time.monotonic()}
+        self._failure = None
 
     def getSecret(self) -> int:
         return self._p_secret
@@ -29,6 +56,33 @@ class Client:
     def getByteAlign(self) -> int:
         return self._byte_align
 
+    def getWindow(self) -> int:
+        return self._window
+
+    def getBatch(self) -> int:
+        return self._batch
+
+    def getNodelay(self) -> bool:
+        return self._nodelay
+
+    def getCork(self) -> bool:
+        return self._cork
+
+    def getRttEstimator(self):
+        return self._rtt
+
+    def getStageTimes(self) -> dict:
+        return self._stage_times
+
+    def getFailure(self):
+        return self._failure
+
+    def markStage(self, stage: str) -> None:
+        self._stage_times[stage] = time.monotonic()
+
+    def setFailure(self, reason: str) -> None:
+        self._failure = reason
+
     def setSecret(self, secret: int):
         self._p_secret = secret
 
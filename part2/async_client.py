@@ -0,0 +1,10 @@
+import os
+import sys
+
+# the async client is shared by part1 and part2
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from protocol.async_client import main, run_session, run_sessions  # noqa: E402, F401
+
+if __name__ == "__main__":
+    main("localhost")
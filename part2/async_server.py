@@ -0,0 +1,316 @@
+import asyncio
+import time
+from metrics import writeSnapshot
+from run_server import exportMetrics, writeProfiles
+from server import Server
+from server_session import (
+    BINDING_TCP,
+    BINDING_UDP,
+    STAGE_B,
+    STAGE_D,
+    STAGES,
+    ServerSession,
+    perform,
+)
+
+
+class StageAProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server, loop: asyncio.AbstractEventLoop) -> None:
+        """Datagram protocol listening for client inital Stage A requests.
+
+        Args:
+            server (Server): Server object.
+            loop (asyncio.AbstractEventLoop): Event loop driving every session.
+        """
+        self._server = server
+        self._loop = loop
+        self._sessions = set()
+        self._idle_timer = None
+        self.transport = None
+        self.done = loop.create_future()
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        self.resetIdleTimer()
+
+    def datagram_received(self, data, addr) -> None:
+        self.resetIdleTimer()
+        rate_limiter = self._server.getRateLimiter()
+        if rate_limiter is not None and not rate_limiter.allow(addr[0]):
+            self._server.addStat("requests_rate_limited")
+            return
+        # tasks are cheap, but past the session limit every session would slow down
+        max_sessions = self._server.getMaxSessions()
+        if max_sessions > 0 and len(self._sessions) >= max_sessions:
+            self._server.addStat("sessions_rejected")
+            return
+        # every session runs as a task on the same event loop
+        session = self._loop.create_task(stageA(self._server, self.transport, data, addr))
+        self._sessions.add(session)
+        session.add_done_callback(self._sessions.discard)
+
+    def resetIdleTimer(self) -> None:
+        """Restart 30 second timer that shuts the server down when no requests arrive."""
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        self._idle_timer = self._loop.call_later(30, self.idleTimeout)
+
+    def idleTimeout(self) -> None:
+        self._server.getLogger().info("server_idle", seconds=30)
+        self.transport.close()
+        if not self.done.done():
+            self.done.set_result(None)
+
+    def getSessions(self) -> set:
+        return self._sessions
+
+
+class StageBProtocol(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        """Datagram protocol that queues client Stage B packets for a single session."""
+        self.transport = None
+        self.queue = asyncio.Queue()
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data, addr) -> None:
+        self.queue.put_nowait((data, addr))
+
+
+def start(server_address="localhost", default_port=12235, server=None) -> None:
+    """Start function that serves every client session from a single asyncio event loop.
+
+    Args:
+        server_address (str, optional): Server address. Defaults to 'localhost'.
+        default_port (int, optional): Port that server should listen on. Defaults to 12235.
+        server (Server, optional): Already configured server object. Created from
+            server_address and default_port when None. Defaults to None.
+    """
+    if server is None:
+        server = Server(server_address, default_port)
+    asyncio.run(serve(server))
+
+
+async def serve(server) -> None:
+    """Coroutine that listens for client requests until the server goes idle.
+
+    Args:
+        server (Server): Server object.
+    """
+    loop = asyncio.get_running_loop()
+    profiler = server.getProfiler()
+    if profiler is not None:
+        # coroutines interleave, so only the session's own protocol handling is
+        # profiled, the time spent waiting on the loop is not
+        profiler.instrument(ServerSession, STAGES)
+        profiler.start()
+    server.getPortAllocator().warm()
+    log = server.getLogger()
+    log.start()
+    exportMetrics(server)
+    log.info("server_started", address=server.getAddress(), port=server.getPort())
+
+    _, protocol = await loop.create_datagram_endpoint(
+        lambda: StageAProtocol(server, loop),
+        local_addr=(server.getAddress(), server.getPort()),
+        reuse_port=server.getReusePort(),
+    )
+    await protocol.done
+
+    # let in flight sessions finish before exiting
+    sessions = protocol.getSessions()
+    if sessions:
+        await asyncio.gather(*sessions, return_exceptions=True)
+    log.info("server_stopped", **server.getStats())
+    writeProfiles(server)
+    log.close()
+    if server.getMetricsFile():
+        writeSnapshot(server.getMetrics(), server.getMetricsFile())
+
+
+async def stageA(server, transport, message, client_address) -> None:
+    """Handles server logic for project 1 on the event loop.
+
+    Protocol decisions are made by a ServerSession, this only moves bytes and ports.
+
+    Args:
+        server (Server): Server object.
+        transport (asyncio.DatagramTransport): Transport bound to the Stage A port.
+        message (bytes): Inital byte message from client.
+        client_address (_RetAddress): Client return address.
+    """
+    started = time.monotonic()
+    log = server.getLogger()
+    log.debug("request", "A", client=client_address)
+    server.addStat("bytes_in", len(message))
+    session = ServerSession(server, client_address[0])
+
+    def send(data: bytes) -> None:
+        transport.sendto(data, client_address)
+
+    if not perform(server, session.feed(message), send):
+        return
+    if session.getState() == BINDING_TCP:
+        # a resumed session skips straight to Stage C
+        log.debug("session_resumed", "C", client=client_address)
+        await listenStageC(server, session, send)
+        return
+    elif session.getState() != BINDING_UDP:
+        # a resent resume request only needed its reply again
+        return
+
+    # bind Stage B endpoint before telling the client about it
+    try:
+        udp_port, udp_socket = server.getPortAllocator().acquireUdp()
+    except OSError as e:
+        log.error("no_port", "B", error=e)
+        session.fail("stage_b_no_port")
+        return
+    # the transport closes its own duplicate so the allocator can recycle the socket
+    loop = asyncio.get_running_loop()
+    udp_transport, udp_protocol = await loop.create_datagram_endpoint(
+        StageBProtocol, sock=udp_socket.dup()
+    )
+
+    log.debug("response", "A", client=client_address, num=session.getNum(), port=udp_port)
+    perform(server, session.bound(udp_port), send)
+    server.observeStage("A", time.monotonic() - started)
+
+    try:
+        await stageB(server, session, udp_transport, udp_protocol)
+    finally:
+        udp_transport.close()
+        server.getPortAllocator().release(udp_port, udp_socket)
+
+
+async def stageB(server, session, udp_transport, udp_protocol) -> None:
+    """Server logic for Stage B on the event loop.
+
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session state machine, in Stage B.
+        udp_transport (asyncio.DatagramTransport): Transport bound to the Stage B port.
+        udp_protocol (StageBProtocol): Protocol queueing client Stage B packets.
+    """
+    started = time.monotonic()
+    client_address = None
+
+    def send(data: bytes) -> None:
+        udp_transport.sendto(data, client_address)
+
+    while session.getState() == STAGE_B:
+        # server closes the session if it hears nothing for 3 seconds
+        try:
+            response, client_address = await asyncio.wait_for(
+                udp_protocol.queue.get(), server.getStageTimeout()
+            )
+        except asyncio.TimeoutError:
+            session.timeout()
+            server.getLogger().info("stage_timeout", "B", num=session.getNum())
+            return
+        server.addStat("bytes_in", len(response))
+        if not perform(server, session.feed(response), send):
+            return
+    server.observeStage("B", time.monotonic() - started)
+
+    server.getLogger().debug("received", "B", client=client_address, num=session.getNum())
+    await listenStageC(server, session, send)
+
+
+async def listenStageC(server, session, send) -> None:
+    """Listen on a TCP port for Stage C and announce it with the Stage B response.
+
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session state machine, waiting for its TCP port.
+        send (callable): Sends bytes to the client's datagram address.
+    """
+    # start listening on the TCP port before announcing it
+    loop = asyncio.get_running_loop()
+    connected = loop.create_future()
+
+    def onConnect(reader, writer) -> None:
+        if connected.done():
+            writer.close()
+        else:
+            connected.set_result((reader, writer))
+
+    try:
+        tcp_port, tcp_socket = server.getPortAllocator().acquireTcp()
+    except OSError as e:
+        server.getLogger().error("no_port", "C", error=e)
+        session.fail("stage_c_no_port")
+        return
+    tcp_server = await asyncio.start_server(onConnect, sock=tcp_socket.dup())
+
+    perform(server, session.bound(tcp_port), send)
+
+    try:
+        await stageC(server, session, connected)
+    finally:
+        tcp_server.close()
+        server.getPortAllocator().release(tcp_port, tcp_socket)
+
+
+async def stageC(server, session, connected: asyncio.Future) -> None:
+    """Server logic for Stage C on the event loop.
+
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session state machine, in Stage C.
+        connected (asyncio.Future): Resolves to the client stream pair once it connects.
+    """
+    started = time.monotonic()
+    try:
+        reader, writer = await asyncio.wait_for(connected, server.getStageTimeout())
+    except asyncio.TimeoutError:
+        session.timeout()
+        server.getLogger().info("stage_timeout", "C")
+        return
+
+    server.getLogger().debug("connected", "C", client=writer.get_extra_info("peername"))
+    perform(server, session.connected(), writer.write)
+    server.observeStage("C", time.monotonic() - started)
+
+    try:
+        await stageD(server, session, reader, writer)
+    finally:
+        writer.close()
+
+
+async def stageD(server, session, reader, writer) -> None:
+    """Server logic for Stage D on the event loop.
+
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session state machine, in Stage D.
+        reader (asyncio.StreamReader): Client stream connected in Stage C.
+        writer (asyncio.StreamWriter): Client stream connected in Stage C.
+    """
+    started = time.monotonic()
+    while session.getState() == STAGE_D:
+        # the session cuts the stream into messages, hand it whatever arrived
+        try:
+            data = await asyncio.wait_for(
+                reader.read(server.getStageDBufferSize()), server.getStageTimeout()
+            )
+        except asyncio.TimeoutError:
+            session.timeout()
+            server.getLogger().info("stage_timeout", "D")
+            return
+        if not data:
+            server.getLogger().info("closed_early", "D", acked=session.getReceived())
+            session.fail("stage_d_closed")
+            return
+        server.addStat("bytes_in", len(data))
+        if not perform(server, session.feed(data), writer.write):
+            return
+    server.observeStage("D", time.monotonic() - started)
+
+    server.getLogger().debug("completed", "D")
+    await writer.drain()
+
+
+if __name__ == "__main__":
+    start()
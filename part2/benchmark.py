@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+import sys
+import threading
+import run_client
+from server import Server
+from transport import LoopbackTransport
+
+STAGES = ("A", "B", "C", "D")
+
+
+def runSession(server_address: str, port: int, window: int, transport=None) -> dict:
+    """Run one full client session and record how long each stage took.
+
+    Args:
+        server_address (str): Server address.
+        port (int): Stage A port.
+        window (int): Stage B packets kept in flight at once.
+        transport (LoopbackTransport, optional): In-process network the server runs
+            on, real sockets when None. Defaults to None.
+
+    Returns:
+        dict: Stage durations in seconds, retransmits and failure reason, None on success.
+    """
+    client = None
+    failure = None
+    try:
+        client = run_client.start(
+            server_address=server_address, port=port, window=window, transport=transport
+        )
+        failure = client.getFailure()
+    except Exception as e:
+        failure = type(e).__name__
+
+    stages = {}
+    retransmits = 0
+    if client is not None:
+        times = client.getStageTimes()
+        previous = times["start"]
+        for stage in STAGES:
+            if stage not in times:
+                break
+            stages[stage] = times[stage] - previous
+            previous = times[stage]
+        retransmits = client.getRttEstimator().getRetransmits()
+        if failure is None and "D" not in times:
+            failure = "incomplete"
+    return {"stages": stages, "retransmits": retransmits, "failure": failure}
+
+
+async def runSessions(
+    server_address: str,
+    port: int,
+    concurrency: int,
+    ramp_up: float,
+    duration: float,
+    window: int,
+    transport=None,
+) -> list:
+    """Keep concurrency sessions running until duration runs out.
+
+    Sessions are blocking client code, so each one runs on its own executor thread
+    while the event loop paces session starts during ramp-up.
+
+    Args:
+        server_address (str): Server address.
+        port (int): Stage A port.
+        concurrency (int): Sessions kept running at once by this process.
+        ramp_up (float): Seconds over which the sessions are started.
+        duration (float): Seconds after which no new sessions start.
+        window (int): Stage B packets kept in flight at once.
+        transport (LoopbackTransport, optional): In-process network the server runs
+            on, real sockets when None. Defaults to None.
+
+    Returns:
+        list: Result of every session run by this process.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    results = []
+
+    async def loopSessions(delay: float) -> None:
+        await asyncio.sleep(delay)
+        while loop.time() < deadline:
+            results.append(
+                await loop.run_in_executor(
+                    None, runSession, server_address, port, window, transport
+                )
+            )
+
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(concurrency))
+    await asyncio.gather(
+        *(loopSessions(ramp_up * i / concurrency) for i in range(concurrency))
+    )
+    return results
+
+
+def runProcess(args: tuple) -> list:
+    """Process pool entry point, runs one event loop worth of sessions.
+
+    Args:
+        args (tuple): Arguments for runSessions.
+
+    Returns:
+        list: Result of every session run by this process.
+    """
+    # the client logs every step, keep that out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return asyncio.run(runSessions(*args))
+
+
+def percentile(values: list, p: float):
+    """Nearest rank percentile.
+
+    Args:
+        values (list): Sorted values.
+        p (float): Percentile between 0 and 100.
+
+    Returns:
+        float: Value at percentile p, None when values is empty.
+    """
+    if not values:
+        return None
+    rank = max(int(-(-p * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+def report(results: list, elapsed: float) -> dict:
+    """Summarize session results.
+
+    Args:
+        results (list): Results from runSession.
+        elapsed (float): Seconds the benchmark ran for.
+
+    Returns:
+        dict: Throughput, per-stage latency percentiles, retransmits and failures.
+    """
+    completed = [result for result in results if result["failure"] is None]
+    failures = {}
+    for result in results:
+        if result["failure"] is not None:
+            failures[result["failure"]] = failures.get(result["failure"], 0) + 1
+
+    latency = {}
+    for stage in STAGES + ("total",):
+        if stage == "total":
+            values = sorted(sum(result["stages"].values()) for result in completed)
+        else:
+            values = sorted(
+                result["stages"][stage] for result in results if stage in result["stages"]
+            )
+        latency[stage] = {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+
+    return {
+        "sessions": len(results),
+        "completed": len(completed),
+        "elapsed": elapsed,
+        "sessions_per_second": len(completed) / elapsed if elapsed else 0,
+        "latency": latency,
+        "retransmits": sum(result["retransmits"] for result in results),
+        "failures": failures,
+    }
+
+
+def serveLocal(server_address: str, port: int, mode: str, window: int) -> None:
+    """Server process entry point used when the benchmark starts its own server.
+
+    Args:
+        server_address (str): Server address.
+        port (int): Stage A port.
+        mode (str): Server backend, "thread" or "async".
+        window (int): Stage B packets a client may have in flight.
+    """
+    # only problems are logged, to stderr so the report on stdout stays JSON
+    server = Server(
+        server_address, port, stage_b_window=window, log_level="warning", log_stream=sys.stderr
+    )
+    if mode == "async":
+        import async_server
+
+        async_server.start(server=server)
+    else:
+        import run_server
+
+        run_server.start(server=server)
+
+
+def benchmark(
+    server_address="localhost",
+    port=12235,
+    sessions=16,
+    processes=2,
+    ramp_up=1.0,
+    duration=10.0,
+    window=1,
+    local_server=True,
+    server_mode="thread",
+    transport="kernel",
+) -> dict:
+    """Load the server with concurrent sessions and report how it held up.
+
+    Args:
+        server_address (str, optional): Server address. Defaults to "localhost".
+        port (int, optional): Stage A port. Defaults to 12235.
+        sessions (int, optional): Sessions kept running at once across every process. Defaults to 16.
+        processes (int, optional): Client processes, each running its own event loop. Defaults to 2.
+        ramp_up (float, optional): Seconds over which sessions are started. Defaults to 1.0.
+        duration (float, optional): Seconds after which no new sessions start. Defaults to 10.0.
+        window (int, optional): Stage B packets kept in flight at once. Defaults to 1.
+        local_server (bool, optional): Start a server in a child process first. Defaults to True.
+        server_mode (str, optional): Backend of the local server, "thread" or "async". Defaults to "thread".
+        transport (str, optional): "kernel" for real sockets, or "loopback" to run the
+            thread server and every session in this process on an in-memory network,
+            without syscalls or ports. processes is ignored with "loopback". Defaults
+            to "kernel".
+
+    Returns:
+        dict: Benchmark report.
+    """
+    if transport == "loopback":
+        if server_mode != "thread" or not local_server:
+            raise ValueError("The loopback transport only runs a local thread server.")
+        return benchmarkLoopback(server_address, port, sessions, ramp_up, duration, window)
+
+    context = multiprocessing.get_context("fork")
+    server_process = None
+    if local_server:
+        server_process = context.Process(
+            target=serveLocal,
+            args=(server_address, port, server_mode, window),
+            daemon=True,
+        )
+        server_process.start()
+        # give the server a moment to bind the Stage A port
+        time.sleep(0.5)
+
+    # split the sessions between processes as evenly as possible
+    shares = [sessions // processes + (i < sessions % processes) for i in range(processes)]
+    jobs = [
+        (server_address, port, share, ramp_up, duration, window)
+        for share in shares
+        if share > 0
+    ]
+
+    started = time.monotonic()
+    try:
+        with context.Pool(len(jobs)) as pool:
+            results = [result for batch in pool.map(runProcess, jobs) for result in batch]
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.join()
+    return report(results, time.monotonic() - started)
+
+
+def benchmarkLoopback(
+    server_address: str,
+    port: int,
+    sessions: int,
+    ramp_up: float,
+    duration: float,
+    window: int,
+) -> dict:
+    """Run the thread server and the sessions in this process over a LoopbackTransport.
+
+    Args:
+        server_address (str): Server address, only a name on the in-memory network.
+        port (int): Stage A port, only a name on the in-memory network.
+        sessions (int): Sessions kept running at once.
+        ramp_up (float): Seconds over which sessions are started.
+        duration (float): Seconds after which no new sessions start.
+        window (int): Stage B packets kept in flight at once.
+
+    Returns:
+        dict: Benchmark report.
+    """
+    import run_server
+
+    network = LoopbackTransport()
+    # the server thread outlives this call, so its log gets a stream of its own
+    # instead of the stdout redirected below
+    server = Server(
+        server_address,
+        port,
+        stage_b_window=window,
+        transport=network,
+        log_level="warning",
+        log_stream=sys.stderr,
+    )
+    # the server thread shuts itself down once idle, a daemon never holds up exit
+    threading.Thread(target=run_server.start, kwargs={"server": server}, daemon=True).start()
+    started = time.monotonic()
+    # the client logs every step, every session has ended once runSessions returns
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = asyncio.run(
+            runSessions(server_address, port, sessions, ramp_up, duration, window, network)
+        )
+    elapsed = time.monotonic() - started
+    return report(results, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run concurrent client sessions against a server and report throughput and latency as JSON."
+    )
+    parser.add_argument("--address", default="localhost", help="Server address.")
+    parser.add_argument("--port", type=int, default=12235, help="Stage A port.")
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent sessions.")
+    parser.add_argument("--processes", type=int, default=2, help="Client processes.")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="Seconds to start every session.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to keep starting sessions.")
+    parser.add_argument("--window", type=int, default=1, help="Stage B window for client and local server.")
+    parser.add_argument(
+        "--no-server",
+        action="store_true",
+        help="Benchmark an already running server instead of starting one.",
+    )
+    parser.add_argument(
+        "--server-mode",
+        choices=["thread", "async"],
+        default="thread",
+        help="Backend of the local server.",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=["kernel", "loopback"],
+        default="kernel",
+        help="Real sockets, or an in-memory network with the server in this process.",
+    )
+    parser.add_argument("--output", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    result = benchmark(
+        server_address=args.address,
+        port=args.port,
+        sessions=args.sessions,
+        processes=args.processes,
+        ramp_up=args.ramp_up,
+        duration=args.duration,
+        window=args.window,
+        local_server=not args.no_server,
+        server_mode=args.server_mode,
+        transport=args.transport,
+    )
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
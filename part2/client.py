@@ -1,12 +1,48 @@
+import os
+import sys
+import time
+from transport import KernelTransport
+
+# the retransmit timer is shared by part1 and part2
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from protocol.rtt import RttEstimator  # noqa: E402
+
+
 class Client:
-    def __init__(self, server_address, default_port, byte_align=4):
+    def __init__(
+        self,
+        server_address,
+        default_port,
+        byte_align=4,
+        window=1,
+        batch=64,
+        nodelay=False,
+        cork=False,
+        transport=None,
+    ):
         self._server_address = server_address
         self._port = default_port
+        # Stage A port, resume requests go there too
+        self._stage_a_port = default_port
         self._read_size = 1024
         self._byte_align = byte_align
         self._p_secret = 0
         self._step = 1
         self._student_id = 246
+        self._window = window
+        self._batch = batch
+        self._nodelay = nodelay
+        self._cork = cork
+        # creates the sockets, real ones unless a benchmark passes a loopback network
+        self._transport = transport or KernelTransport()
+        self._rtt = RttEstimator()
+        # time each stage finished at, and why the session stopped early
+        self._stage_times = {"start": time.monotonic()}
+        self._failure = None
+        # token the server issued with the Stage B response and the secret it came with
+        self._resume_token = None
+        self._resume_secret = None
 
     def getSecret(self) -> int:
         return self._p_secret
@@ -20,6 +56,9 @@ class Client:
     def getPort(self) -> int:
         return self._port
 
+    def getStageAPort(self) -> int:
+        return self._stage_a_port
+
     def getServerAddress(self) -> str:
         return self._server_address
 
@@ -29,6 +68,46 @@ class Client:
     def getByteAlign(self) -> int:
         return self._byte_align
 
+    def getWindow(self) -> int:
+        return self._window
+
+    def getBatch(self) -> int:
+        return self._batch
+
+    def getNodelay(self) -> bool:
+        return self._nodelay
+
+    def getCork(self) -> bool:
+        return self._cork
+
+    def getTransport(self):
+        return self._transport
+
+    def getRttEstimator(self):
+        return self._rtt
+
+    def getStageTimes(self) -> dict:
+        return self._stage_times
+
+    def getFailure(self):
+        return self._failure
+
+    def getResumeToken(self):
+        return self._resume_token
+
+    def getResumeSecret(self):
+        return self._resume_secret
+
+    def setResumeToken(self, token: int, secret: int) -> None:
+        self._resume_token = token
+        self._resume_secret = secret
+
+    def markStage(self, stage: str) -> None:
+        self._stage_times[stage] = time.monotonic()
+
+    def setFailure(self, reason: str) -> None:
+        self._failure = reason
+
     def setSecret(self, secret: int):
         self._p_secret = secret
 
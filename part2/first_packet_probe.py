@@ -0,0 +1,130 @@
+import argparse
+import socket
+import threading
+from header import ACK, HEADER_SIZE, Header, StageAResponse, StageBResponse
+
+STUDENT_ID = 246
+
+
+def probeSession(server_address: str, port: int, results: dict, lock: threading.Lock) -> None:
+    """Run one session far enough to see whether the first Stage B packet and the
+    Stage C connect reached an open port.
+
+    UDP sockets are connected so an ICMP port unreachable for a packet that arrived
+    before the server bound the port surfaces as ConnectionRefusedError.
+
+    Args:
+        server_address (str): Server address.
+        port (int): Stage A port.
+        results (dict): Counters shared between probe threads, updated in place.
+        lock (threading.Lock): Lock guarding results.
+    """
+
+    def count(name: str) -> None:
+        with lock:
+            results[name] = results.get(name, 0) + 1
+
+    # stage A
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.settimeout(5)
+    payload = b"hello world\0"
+    udp_socket.sendto(
+        Header(len(payload), 0, 1, STUDENT_ID).getBytes() + payload,
+        (server_address, port),
+    )
+    try:
+        response = udp_socket.recv(1024)
+    except socket.timeout:
+        count("stage_a_timeouts")
+        return
+    finally:
+        udp_socket.close()
+    num, length, udp_port, secret = StageAResponse.unpackFrom(response).fields()
+
+    # stage B, send the first packet the moment we learn the port
+    stage_b_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    stage_b_socket.connect((server_address, udp_port))
+    stage_b_socket.settimeout(0.5)
+    message = bytearray(HEADER_SIZE + ACK.size + length + (4 - length % 4) % 4)
+    Header(length + 4, secret, 1, STUDENT_ID).packInto(message)
+
+    ack = 0
+    first = True
+    while ack < num:
+        ACK.pack_into(message, HEADER_SIZE, ack)
+        stage_b_socket.send(message)
+        try:
+            stage_b_socket.recv(1024)
+        except socket.timeout:
+            first = False
+            continue
+        except ConnectionRefusedError:
+            if first:
+                count("stage_b_first_refused")
+            first = False
+            continue
+        first = False
+        ack = ack + 1
+    count("stage_b_sessions")
+
+    try:
+        response = stage_b_socket.recv(1024)
+    except (socket.timeout, ConnectionRefusedError):
+        count("stage_b_timeouts")
+        return
+    finally:
+        stage_b_socket.close()
+    tcp_port, _ = StageBResponse.unpackFrom(response).fields()
+
+    # stage C, connect the moment we learn the port
+    tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        tcp_socket.connect((server_address, tcp_port))
+    except ConnectionRefusedError:
+        count("stage_c_refused")
+    finally:
+        tcp_socket.close()
+    count("stage_c_sessions")
+
+
+def probe(server_address="localhost", port=12235, sessions=20) -> dict:
+    """Measure how often a client's first Stage B packet or Stage C connect is refused.
+
+    Args:
+        server_address (str, optional): Server address. Defaults to "localhost".
+        port (int, optional): Stage A port. Defaults to 12235.
+        sessions (int, optional): Number of concurrent probe sessions. Defaults to 20.
+
+    Returns:
+        dict: Counters of probe outcomes.
+    """
+    results = {}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=probeSession, args=(server_address, port, results, lock))
+        for _ in range(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure lost first packets against a running server on loopback."
+    )
+    parser.add_argument("--address", default="localhost", help="Server address.")
+    parser.add_argument("--port", type=int, default=12235, help="Stage A port.")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent sessions.")
+    args = parser.parse_args()
+
+    results = probe(args.address, args.port, args.sessions)
+    stage_b = results.get("stage_b_sessions", 0)
+    stage_c = results.get("stage_c_sessions", 0)
+    print(results)
+    if stage_b:
+        print(f"Stage B first packet refused: {results.get('stage_b_first_refused', 0) / stage_b:.1%}")
+    if stage_c:
+        print(f"Stage C connect refused: {results.get('stage_c_refused', 0) / stage_c:.1%}")
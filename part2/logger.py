@@ -0,0 +1,196 @@
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+NAMES = {value: name for name, value in LEVELS.items()}
+
+# most payload bytes kept by dump
+DUMP_LIMIT = 32
+
+
+class Payload:
+    __slots__ = ("head", "size")
+
+    def __init__(self, head: bytes, size: int) -> None:
+        self.head = head
+        self.size = size
+
+    def __str__(self) -> str:
+        if self.size > len(self.head):
+            return f"{self.head.hex()}...({self.size}B)"
+        return self.head.hex()
+
+
+def dump(payload, limit=DUMP_LIMIT) -> Payload:
+    """Keep the start of a payload for a log record, however big the payload is.
+
+    Only limit bytes are copied, so the record does not hold on to the receive
+    buffer and is formatted by the writer thread.
+
+    Args:
+        payload (bytes | memoryview): Payload to log.
+        limit (int, optional): Most bytes kept. Defaults to DUMP_LIMIT.
+
+    Returns:
+        Payload: Truncated payload, written as hex with the full size.
+    """
+    return Payload(bytes(payload[:limit]), len(payload))
+
+
+def parseStageLevels(text: str) -> dict:
+    """Parse per-stage levels like "B=debug,D=warning".
+
+    Args:
+        text (str): Comma separated stage=level pairs, may be empty.
+
+    Returns:
+        dict: Stage name to level name.
+    """
+    levels = {}
+    for pair in filter(None, text.split(",")):
+        stage, _, level = pair.partition("=")
+        if level not in LEVELS:
+            raise ValueError(f"Unknown log level {level!r} for stage {stage!r}")
+        levels[stage.strip().upper()] = level
+    return levels
+
+
+class Logger:
+    def __init__(self, level="info", stage_levels=None, queue_size=10000, stream=None) -> None:
+        """Leveled, structured log written by a background thread.
+
+        Calls only check the level and queue a record, formatting and writing happen
+        on the writer thread, so sessions never wait on each other for stdout. When
+        the bounded queue is full the record is dropped and counted instead of
+        blocking the session.
+
+        Args:
+            level (str, optional): Lowest level written. Defaults to "info".
+            stage_levels (dict, optional): Stage name to the lowest level written for
+                records of that stage, overriding level. Defaults to None.
+            queue_size (int, optional): Most records waiting for the writer. Defaults to 10000.
+            stream (file, optional): Where records are written. Defaults to sys.stdout.
+        """
+        self._level = LEVELS[level]
+        self._stage_levels = {
+            stage: LEVELS[name] for stage, name in (stage_levels or {}).items()
+        }
+        # calls below every configured level return before anything else
+        self._min_level = min([self._level] + list(self._stage_levels.values()))
+        self._queue = queue.Queue(queue_size)
+        self._stream = stream or sys.stdout
+        self._dropped = 0
+        self._thread = None
+
+    def getLevel(self) -> int:
+        return self._level
+
+    def getDropped(self) -> int:
+        return self._dropped
+
+    def isEnabled(self, level: int, stage=None) -> bool:
+        """Check whether a record would be written, to skip building costly fields.
+
+        Args:
+            level (int): Record level.
+            stage (str, optional): Record stage. Defaults to None.
+
+        Returns:
+            bool: True if a record of that level and stage is written.
+        """
+        return level >= self._stage_levels.get(stage, self._level)
+
+    def log(self, level: int, event: str, stage=None, **fields) -> None:
+        """Queue a record for the writer thread.
+
+        Args:
+            level (int): Record level.
+            event (str): Short name of what happened, like stage_timeout.
+            stage (str, optional): Session stage the record belongs to. Defaults to None.
+            **fields: Values written as key=value after the event.
+        """
+        if level < self._min_level or level < self._stage_levels.get(stage, self._level):
+            return
+        try:
+            self._queue.put_nowait((time.time(), level, stage, event, fields))
+        except queue.Full:
+            # counted without a lock, a lost increment only undercounts drops
+            self._dropped = self._dropped + 1
+
+    def debug(self, event: str, stage=None, **fields) -> None:
+        # most calls are debug records nobody asked for, skip the extra call
+        if self._min_level <= DEBUG:
+            self.log(DEBUG, event, stage, **fields)
+
+    def info(self, event: str, stage=None, **fields) -> None:
+        self.log(INFO, event, stage, **fields)
+
+    def warning(self, event: str, stage=None, **fields) -> None:
+        self.log(WARNING, event, stage, **fields)
+
+    def error(self, event: str, stage=None, **fields) -> None:
+        self.log(ERROR, event, stage, **fields)
+
+    def start(self) -> None:
+        """Start the writer thread, records queued before are written once it runs."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self) -> None:
+        while True:
+            records = [self._queue.get()]
+            # write everything already waiting with one write call
+            while len(records) < 1024:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._stream.write("".join(self.format(record) for record in records if record))
+            self._stream.flush()
+            if None in records:
+                return
+
+    def format(self, record: tuple) -> str:
+        """Format a record as one logfmt line.
+
+        Args:
+            record (tuple): (time, level, stage, event, fields) record.
+
+        Returns:
+            str: Line ending in a newline.
+        """
+        timestamp, level, stage, event, fields = record
+        clock = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        line = f"time={clock}.{int(timestamp % 1 * 1000):03d} level={NAMES[level]}"
+        if stage is not None:
+            line = f"{line} stage={stage}"
+        line = f"{line} event={event}"
+        for key, value in fields.items():
+            if isinstance(value, tuple):
+                # socket addresses read better as host:port
+                value = ":".join(str(part) for part in value)
+            value = str(value)
+            if " " in value or not value:
+                value = f'"{value}"'
+            line = f"{line} {key}={value}"
+        return line + "\n"
+
+    def close(self) -> None:
+        """Write every queued record and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._dropped:
+            self._stream.write(f"level=warning event=log_dropped records={self._dropped}\n")
+            self._stream.flush()
@@ -0,0 +1,213 @@
+import bisect
+import http.server
+import json
+import os
+import threading
+import time
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS, max_shards=256) -> None:
+        """Counters and latency histograms shared by every session thread.
+
+        Each thread updates a shard of its own, so recording never takes a lock or
+        contends with other threads. Snapshots add the shards up. Shards of threads
+        that have exited are folded into one retired shard, so a thread per session
+        does not grow the list of shards forever.
+
+        Args:
+            buckets (tuple, optional): Sorted histogram bucket upper bounds. Defaults to BUCKETS.
+            max_shards (int, optional): Shards kept before those of exited threads are
+                folded, snapshots fold them too. Defaults to 256.
+        """
+        self._buckets = buckets
+        self._max_shards = max_shards
+        self._local = threading.local()
+        # (thread, counters, histograms) for every thread that recorded something
+        self._shards = []
+        self._retired = ({}, {})
+        # only taken to add a shard and to read them all, never to record
+        self._lock = threading.Lock()
+
+    def getBuckets(self) -> tuple:
+        return self._buckets
+
+    def shard(self) -> tuple:
+        """Returns the calling thread's (counters, histograms) shard."""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = ({}, {})
+            self._local.shard = shard
+            with self._lock:
+                if len(self._shards) >= self._max_shards:
+                    self.retire()
+                self._shards.append((threading.current_thread(), shard[0], shard[1]))
+        return shard
+
+    def count(self, name: str, amount=1) -> None:
+        """Add to a counter.
+
+        Args:
+            name (str): Counter name.
+            amount (int, optional): Amount to add. Defaults to 1.
+        """
+        counters = self.shard()[0]
+        counters[name] = counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float) -> None:
+        """Record one value in a histogram.
+
+        Args:
+            name (str): Histogram name.
+            value (float): Observed value, seconds for latencies.
+        """
+        histograms = self.shard()[1]
+        histogram = histograms.get(name)
+        if histogram is None:
+            # one count per bucket, the unbounded bucket, then the sum of values
+            histogram = histograms[name] = [0] * (len(self._buckets) + 2)
+        histogram[bisect.bisect_left(self._buckets, value)] += 1
+        histogram[-1] += value
+
+    def retire(self) -> None:
+        """Fold shards of threads that exited into the retired shard. Callers hold the lock."""
+        live = []
+        for thread, counters, histograms in self._shards:
+            if thread.is_alive():
+                live.append((thread, counters, histograms))
+            else:
+                merge(self._retired, (counters, histograms))
+        self._shards = live
+
+    def snapshot(self) -> dict:
+        """Add up every shard.
+
+        Returns:
+            dict: {"counters": name to value, "histograms": name to bucket counts, the
+                unbounded bucket last, followed by the sum of values}.
+        """
+        with self._lock:
+            self.retire()
+            total = ({}, {})
+            merge(total, self._retired)
+            for _, counters, histograms in self._shards:
+                # copies are taken in one step, the owning thread may keep recording
+                merge(total, (dict(counters), dict(histograms)))
+        return {"counters": total[0], "histograms": total[1]}
+
+    def render(self, prefix="project1") -> str:
+        """Format a snapshot in the Prometheus text format.
+
+        Args:
+            prefix (str, optional): Prepended to every metric name. Defaults to "project1".
+
+        Returns:
+            str: One metric per line.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.append(f"{prefix}_{name} {value}")
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            cumulative = 0
+            for bound, count in zip(self._buckets + ("+Inf",), histogram):
+                cumulative = cumulative + count
+                lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{prefix}_{name}_sum {histogram[-1]:.6f}")
+            lines.append(f"{prefix}_{name}_count {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def merge(total: tuple, shard: tuple) -> None:
+    """Add a (counters, histograms) shard into total, in place.
+
+    Args:
+        total (tuple): (counters, histograms) to add into.
+        shard (tuple): (counters, histograms) to add.
+    """
+    counters, histograms = total
+    for name, value in shard[0].items():
+        counters[name] = counters.get(name, 0) + value
+    for name, histogram in shard[1].items():
+        into = histograms.get(name)
+        if into is None:
+            histograms[name] = list(histogram)
+        else:
+            for index, value in enumerate(histogram):
+                into[index] = into[index] + value
+
+
+def serveText(metrics: Metrics, address: str, port: int):
+    """Serve the metrics in the Prometheus text format over HTTP from a daemon thread.
+
+    Args:
+        metrics (Metrics): Metrics to serve.
+        address (str): Address to listen on, keep it local.
+        port (int): Port to listen on.
+
+    Returns:
+        http.server.ThreadingHTTPServer: Running HTTP server.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            # scrapes would flood the server output
+            pass
+
+    httpd = http.server.ThreadingHTTPServer((address, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def writeSnapshots(metrics: Metrics, path: str, interval=5.0) -> threading.Thread:
+    """Write a JSON snapshot to path every interval seconds from a daemon thread.
+
+    The file is replaced in one step, so a reader never sees half a snapshot.
+
+    Args:
+        metrics (Metrics): Metrics to write.
+        path (str): Snapshot file.
+        interval (float, optional): Seconds between snapshots. Defaults to 5.0.
+
+    Returns:
+        threading.Thread: Writer thread.
+    """
+
+    def run() -> None:
+        while True:
+            time.sleep(interval)
+            writeSnapshot(metrics, path)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def writeSnapshot(metrics: Metrics, path: str) -> None:
+    """Write one JSON snapshot of the metrics to path.
+
+    Args:
+        metrics (Metrics): Metrics to write.
+        path (str): Snapshot file.
+    """
+    snapshot = metrics.snapshot()
+    snapshot["time"] = time.time()
+    snapshot["buckets"] = list(metrics.getBuckets())
+    partial = f"{path}.tmp"
+    with open(partial, "w") as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(partial, path)
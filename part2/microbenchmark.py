@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+import timeit
+import run_client
+import server_session
+from header import ACK, HEADER_SIZE, Header
+from server import Server
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbenchmark_baseline.json")
+
+
+def cases() -> dict:
+    """Build the per-packet calls to time, each already holding valid inputs.
+
+    Returns:
+        dict: Case name to zero argument callable.
+    """
+    server = Server("localhost", 0)
+    byte_align = server.getByteAlign()
+    student_id = server.getId()
+
+    # Stage B packet as sent by the client, lengths match the largest the server picks
+    length = 128
+    stage_b = bytearray(HEADER_SIZE + ACK.size + server_session.calculateAligndLength(byte_align, length))
+    Header(length + 4, 1234, 1, student_id).packInto(stage_b)
+    ACK.pack_into(stage_b, HEADER_SIZE, 7)
+    stage_b = bytes(stage_b)
+
+    char = b"x"
+    stage_d = Header(length, 4321, 1, student_id).getBytes() + char * server_session.calculateAligndLength(
+        byte_align, length
+    )
+
+    # one block of a bulk Stage D payload, as run with --max-length
+    bulk = memoryview(char * server_session.PAYLOAD_BLOCK_SIZE)
+
+    header = Header(length, 4321, 1, student_id)
+    hello = b"hello world\0"
+
+    # session in Stage B that already acknowledged packet 0, so feeding packet 0
+    # again runs the whole receive path without changing its state
+    session = server_session.ServerSession(server)
+    session.feed(Header(len(hello), 0, 1, student_id).getBytes() + hello)
+    session.bound(50000)
+    duplicate = bytearray(
+        HEADER_SIZE + ACK.size + server_session.calculateAligndLength(byte_align, session.getLength())
+    )
+    Header(session.getLength() + 4, session.getSecret(), 1, student_id).packInto(duplicate)
+    duplicate = bytes(duplicate)
+    while not session.feed(duplicate):
+        pass
+
+    return {
+        "calculateAligndLength": lambda: server_session.calculateAligndLength(byte_align, 33),
+        "alignString": lambda: run_client.alignString(byte_align, hello),
+        "Header.getBytes": header.getBytes,
+        "validateHeader": lambda: server_session.validateHeader(server, student_id, 1),
+        "validateStageB": lambda: server_session.validateStageB(server, stage_b, length, 1234),
+        "validateStageD": lambda: server_session.validateStageD(server, stage_d, 4321, length, char),
+        "ServerSession.feed": lambda: session.feed(duplicate),
+        "matchesPayload 64KB": lambda: server_session.matchesPayload(bulk, char),
+    }
+
+
+def measure(number=20000, repeat=7) -> dict:
+    """Time every case.
+
+    The fastest of several repeats is kept, slower repeats only measure noise from
+    the rest of the machine. Repeats go round every case in turn, so a busy stretch
+    of a few seconds slows one repeat of each case instead of all of one case.
+
+    Args:
+        number (int, optional): Calls per repeat. Defaults to 20000.
+        repeat (int, optional): Repeats per case. Defaults to 7.
+
+    Returns:
+        dict: Case name to nanoseconds per call.
+    """
+    timers = {name: timeit.Timer(case) for name, case in cases().items()}
+    best = {}
+    for _ in range(repeat):
+        for name, timer in timers.items():
+            elapsed = timer.timeit(number)
+            best[name] = min(best.get(name, elapsed), elapsed)
+    return {name: elapsed / number * 1e9 for name, elapsed in best.items()}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Find cases that got slower than the baseline allows.
+
+    Args:
+        results (dict): Case name to nanoseconds per call.
+        baseline (dict): Saved case name to nanoseconds per call.
+        threshold (float): Allowed slowdown in percent.
+
+    Returns:
+        list: Names of cases that regressed.
+    """
+    regressed = []
+    for name, ns in results.items():
+        if name not in baseline:
+            continue
+        change = (ns - baseline[name]) / baseline[name] * 100
+        status = "ok"
+        if change > threshold:
+            status = "REGRESSED"
+            regressed.append(name)
+        print(f"{name:24} {ns:10.1f} ns  baseline {baseline[name]:10.1f} ns  {change:+6.1f}%  {status}")
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the per-packet helpers and compare them against a saved baseline."
+    )
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline.")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline file.")
+    parser.add_argument(
+        "--threshold", type=float, default=25.0, help="Percent slowdown that counts as a regression."
+    )
+    parser.add_argument("--number", type=int, default=20000, help="Calls per repeat.")
+    parser.add_argument("--repeat", type=int, default=7, help="Repeats per case.")
+    args = parser.parse_args()
+
+    results = measure(args.number, args.repeat)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        for name, ns in results.items():
+            print(f"{name:24} {ns:10.1f} ns")
+        print(f"Saved baseline to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save first.")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressed = compare(results, baseline, args.threshold)
+    if regressed:
+        print(f"{len(regressed)} case(s) more than {args.threshold}% slower than baseline.")
+        sys.exit(1)
@@ -0,0 +1,78 @@
+import collections
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int, max_sources=65536) -> None:
+        """Token bucket per client host, for Stage A requests.
+
+        Buckets live in an ordered table with the most recently seen host last. A bucket
+        left alone long enough to refill completely is the same as no bucket, so stale
+        entries are popped off the front as new requests come in, and the least
+        recently seen host is evicted once max_sources hosts are tracked.
+
+        Args:
+            rate (float): Requests per second each host may send on average.
+            burst (int): Requests a host may send back to back.
+            max_sources (int, optional): Most hosts tracked at once. Defaults to 65536.
+        """
+        self._rate = rate
+        self._burst = burst
+        self._max_sources = max_sources
+        # seconds for an empty bucket to fill up again
+        self._refill = burst / rate
+        # host to [tokens, time of last request]
+        self._buckets = collections.OrderedDict()
+
+    def getRate(self) -> float:
+        return self._rate
+
+    def getBurst(self) -> int:
+        return self._burst
+
+    def getSources(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, host: str, now=None) -> bool:
+        """Take a token from the host's bucket.
+
+        Not thread safe, call it from the thread reading the Stage A port.
+
+        Args:
+            host (str): Client host address.
+            now (float, optional): Current time.monotonic(), read when None. Defaults to None.
+
+        Returns:
+            bool: True if the request may be served.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            if len(self._buckets) >= self._max_sources:
+                self._buckets.popitem(last=False)
+            bucket = [self._burst, now]
+            self._buckets[host] = bucket
+        else:
+            self._buckets.move_to_end(host)
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            return False
+        bucket[0] = bucket[0] - 1
+        return True
+
+    def expire(self, now: float) -> None:
+        """Drop buckets that have refilled completely since their host was last seen.
+
+        Args:
+            now (float): Current time.monotonic().
+        """
+        while self._buckets:
+            host, (_, last) = next(iter(self._buckets.items()))
+            if now - last < self._refill:
+                return
+            del self._buckets[host]
@@ -0,0 +1,598 @@
+import argparse
+import concurrent.futures
+import json
+import math
+import socket
+import sys
+import threading
+import time
+from header import (
+    ACK,
+    HEADER,
+    HEADER_SIZE,
+    ErrorReply,
+    Header,
+    ResumeToken,
+    StageAResponse,
+    StageBResponse,
+    StageCResponse,
+    StageDFinal,
+    alignedLength,
+)
+from benchmark import STAGES, percentile, report
+from session_trace import ACCEPT, CONNECT, RECV, SEND, TCP, UDP, readTrace
+from transport import KernelTransport, LoopbackTransport
+
+# Stage A request every client sends, header then "hello world\0"
+STAGE_A_LENGTH = 12
+BYTE_ALIGN = 4
+# seconds to wait for a reply once the recorded resends have run out
+RESEND_TIMEOUT = 0.5
+MAX_RESENDS = 4
+# seconds a Stage B packet waits for its ack before the next send at max speed
+MAX_SPEED_RETRANSMIT = 0.01
+# consecutive Stage B sends without an ack before giving up, like the client
+MAX_TIMEOUTS = 100
+# seconds to wait for the Stage B, C and D responses, like the client
+RESPONSE_TIMEOUT = 5
+
+
+class SessionPlan:
+    __slots__ = (
+        "start",
+        "request",
+        "a_sends",
+        "a_reply",
+        "b_sends",
+        "b_reply",
+        "c_connect",
+        "c_reply",
+        "d_segments",
+        "d_reply",
+        "end",
+    )
+
+    def __init__(self, start: float, request: bytes) -> None:
+        """What one recorded session did and when, in seconds on the trace clock.
+
+        Args:
+            start (float): Time of the first Stage A request.
+            request (bytes): Stage A request as it was sent.
+        """
+        self.start = start
+        self.request = request
+        self.a_sends = [start]
+        self.a_reply = None
+        # send time of every Stage B packet, retransmits included
+        self.b_sends = []
+        self.b_reply = None
+        self.c_connect = None
+        self.c_reply = None
+        # (time, bytes) of every Stage D send
+        self.d_segments = []
+        self.d_reply = None
+        self.end = start
+
+    def getReached(self):
+        """Returns the last stage the recording completed, None when not even A."""
+        for stage, reply in zip(
+            reversed(STAGES), (self.d_reply, self.c_reply, self.b_reply, self.a_reply)
+        ):
+            if reply is not None:
+                return stage
+        return None
+
+
+def orient(role: str, record):
+    """Tell which way a record went and which end is the client.
+
+    Returns:
+        (bool, tuple, tuple): Whether it went from client to server, the client's
+            (host, port) and the server's (host, port).
+    """
+    if role == "client":
+        return record.event in (SEND, CONNECT), record.local, record.remote
+    return record.event in (RECV, ACCEPT), record.remote, record.local
+
+
+def loadSessions(paths: list) -> list:
+    """Rebuild the sessions recorded in one or more traces.
+
+    Messages are matched to sessions by the protocol, not by socket: a Stage A request
+    starts a session, its response announces the Stage B port and secret, Stage B
+    packets carry that secret, and the Stage B response announces the TCP port.
+    Traces are put on one clock by the wall time they started at, so the traces of
+    several workers or clients replay together. Do not mix the client and server
+    traces of the same run, every session would be replayed twice. Resumed sessions
+    are left out.
+
+    Args:
+        paths (list): Trace files.
+
+    Returns:
+        list: SessionPlan of every session, by start time.
+    """
+    traces = [readTrace(path) for path in paths]
+    first = min(started for _, started, _ in traces)
+    sessions = []
+    for role, started, records in traces:
+        shift = started - first
+        # UDP or TCP client (host, port) to its session
+        endpoints = {}
+        # Stage B (port, secret) and TCP port to the session announced it
+        stage_b = {}
+        stage_c = {}
+        for record in records:
+            upstream, client, server = orient(role, record)
+            at = record.time + shift
+            if record.kind == UDP and record.event in (SEND, RECV):
+                if len(record.payload) < HEADER_SIZE:
+                    continue
+                payload_len, secret, step, _ = HEADER.unpack_from(record.payload)
+                if upstream:
+                    if ResumeToken.isResume(record.payload):
+                        continue
+                    if secret == 0 and step == 1 and payload_len == STAGE_A_LENGTH:
+                        session = endpoints.get((UDP, client))
+                        if session is not None and session.a_reply is None:
+                            session.a_sends.append(at)
+                        elif record.size == len(record.payload):
+                            session = SessionPlan(at, bytes(record.payload))
+                            sessions.append(session)
+                            endpoints[(UDP, client)] = session
+                        continue
+                    session = stage_b.get((server[1], secret))
+                    if session is None:
+                        continue
+                    session.b_sends.append(at)
+                    endpoints[(UDP, client)] = session
+                else:
+                    session = endpoints.get((UDP, client))
+                    if session is None or ErrorReply.isError(record.payload):
+                        continue
+                    if payload_len == StageAResponse.getSize() and session.a_reply is None:
+                        session.a_reply = at
+                        response = StageAResponse.unpackFrom(record.payload)
+                        stage_b[(response.udp_port, response.secret)] = session
+                    elif payload_len == StageBResponse.getSize() and session.b_reply is None:
+                        session.b_reply = at
+                        stage_c[StageBResponse.unpackFrom(record.payload).tcp_port] = session
+                    else:
+                        continue
+            elif record.kind == TCP:
+                if record.event in (CONNECT, ACCEPT):
+                    session = stage_c.pop(server[1], None)
+                    if session is None:
+                        continue
+                    session.c_connect = at
+                    endpoints[(TCP, client)] = session
+                    continue
+                session = endpoints.get((TCP, client))
+                if session is None or record.event not in (SEND, RECV):
+                    continue
+                if upstream:
+                    session.d_segments.append((at, record.size))
+                elif len(record.payload) >= HEADER_SIZE:
+                    if ErrorReply.isError(record.payload):
+                        continue
+                    payload_len = HEADER.unpack_from(record.payload)[0]
+                    if payload_len == StageCResponse.getSize() and session.c_reply is None:
+                        session.c_reply = at
+                    elif payload_len == StageDFinal.getSize() and session.c_reply is not None:
+                        session.d_reply = at
+                    else:
+                        continue
+            else:
+                continue
+            session.end = max(session.end, at)
+    sessions.sort(key=lambda session: session.start)
+    return sessions
+
+
+def peakSessions(sessions: list) -> int:
+    """Returns the most recorded sessions that were in progress at once."""
+    events = sorted(
+        [(session.start, 1) for session in sessions]
+        + [(session.end, -1) for session in sessions]
+    )
+    peak = 0
+    running = 0
+    for _, change in events:
+        running = running + change
+        peak = max(peak, running)
+    return peak
+
+
+def waitUntil(deadline: float) -> None:
+    remaining = deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+def receive(sock, deadline: float, size=1024):
+    """Returns what arrives on sock before deadline, None when nothing does."""
+    # a zero timeout would make the socket non-blocking instead
+    sock.settimeout(max(deadline - time.monotonic(), 0.0001))
+    try:
+        return sock.recv(size)
+    except socket.timeout:
+        return None
+
+
+class Replay:
+    def __init__(self, plan: SessionPlan, address: tuple, speed: float, transport) -> None:
+        """Replays one recorded session against a live server.
+
+        Ports, secrets and lengths come from the live server, so only the Stage A
+        request is sent as recorded. What is kept is the timing, scaled by speed: when
+        the client resent Stage A, when it sent each Stage B packet, how long it waited
+        before connecting, and how it split the Stage D stream into sends and when.
+        Each stage is scheduled from the moment the previous stage finished in the
+        replay. Stage B packets go out at the recorded send times, each one is the
+        lowest packet the live server has not acked yet. At max speed there is no
+        waiting, a packet goes out as soon as the previous one was acked.
+
+        Args:
+            plan (SessionPlan): Recorded session.
+            address (tuple): Server (host, port) of Stage A.
+            speed (float): Speed up over the recorded timing, math.inf for max speed.
+            transport (KernelTransport | LoopbackTransport): Creates the sockets.
+        """
+        self._plan = plan
+        self._address = address
+        self._speed = speed
+        self._transport = transport
+        # student id of the recorded client, for the headers built live
+        self._id = HEADER.unpack_from(plan.request)[3]
+        self._times = {}
+        self._retransmits = 0
+        self._stage_a = None
+        self._stage_b = None
+        self._stage_c = None
+        self._tcp = None
+
+    def scale(self, seconds: float) -> float:
+        return seconds / self._speed
+
+    def run(self) -> dict:
+        """Replay the session as far as the recording goes.
+
+        Returns:
+            dict: Stage durations in seconds, retransmits and failure reason, None on
+                success, like benchmark.runSession.
+        """
+        reached = self._plan.getReached()
+        self._times["start"] = time.monotonic()
+        failure = None
+        try:
+            stages = (self.stageA, self.stageB, self.stageC, self.stageD)
+            for stage, replay in zip(STAGES, stages):
+                if reached is None:
+                    failure = f"trace_ends_in_stage_{stage.lower()}"
+                    break
+                failure = replay()
+                if failure is not None:
+                    break
+                self._times[stage] = time.monotonic()
+                if stage == reached and stage != "D":
+                    failure = f"trace_ends_after_stage_{stage.lower()}"
+                    break
+        except OSError as e:
+            failure = type(e).__name__
+
+        stages = {}
+        previous = self._times["start"]
+        for stage in STAGES:
+            if stage not in self._times:
+                break
+            stages[stage] = self._times[stage] - previous
+            previous = self._times[stage]
+        return {"stages": stages, "retransmits": self._retransmits, "failure": failure}
+
+    def stageA(self):
+        plan = self._plan
+        sock = self._transport.udp()
+        started = time.monotonic()
+        resends = 0
+        while True:
+            sock.sendto(plan.request, self._address)
+            # resend when the recorded client did, then on a timeout of our own
+            if self._speed != math.inf and resends + 1 < len(plan.a_sends):
+                deadline = started + self.scale(plan.a_sends[resends + 1] - plan.start)
+            else:
+                deadline = time.monotonic() + RESEND_TIMEOUT
+            response = receive(sock, deadline)
+            if response is not None:
+                break
+            resends = resends + 1
+            self._retransmits = self._retransmits + 1
+            if resends >= len(plan.a_sends) + MAX_RESENDS:
+                sock.close()
+                return "stage_a_timeout"
+        sock.close()
+        if ErrorReply.isError(response):
+            return ErrorReply.unpackFrom(response).getReason()
+        self._stage_a = StageAResponse.unpackFrom(response)
+        return None
+
+    def slot(self, index: int) -> float:
+        """Seconds after Stage A finished the Stage B send with this index goes out.
+
+        Sends past the recorded ones keep the recorded average pace.
+        """
+        plan = self._plan
+        offsets = [sent - plan.a_reply for sent in plan.b_sends] or [0.0]
+        if index < len(offsets):
+            return self.scale(offsets[index])
+        gap = RESEND_TIMEOUT
+        if len(offsets) > 1:
+            gap = (offsets[-1] - offsets[0]) / (len(offsets) - 1)
+        return self.scale(offsets[-1] + gap * (index - len(offsets) + 1))
+
+    def stageB(self):
+        num, length, udp_port, secret = self._stage_a.fields()
+        sock = self._transport.udp()
+        address = (self._address[0], udp_port)
+        message = bytearray(HEADER_SIZE + ACK.size + alignedLength(BYTE_ALIGN, length))
+        Header(length + 4, secret, 1, self._id).packInto(message)
+        started = time.monotonic()
+        base = 0
+        sent = set()
+        sends = 0
+        timeouts = 0
+        response = None
+        try:
+            while base < num:
+                ACK.pack_into(message, HEADER_SIZE, base)
+                sock.sendto(message, address)
+                if base in sent:
+                    self._retransmits = self._retransmits + 1
+                sent.add(base)
+                sends = sends + 1
+                packet = base
+                if self._speed == math.inf:
+                    deadline = time.monotonic() + MAX_SPEED_RETRANSMIT
+                else:
+                    deadline = started + self.slot(sends)
+                # at max speed the next packet goes out as soon as this one is acked,
+                # otherwise at its recorded time
+                while base < num and (self._speed != math.inf or base == packet):
+                    reply = receive(sock, deadline)
+                    if reply is None:
+                        break
+                    if ErrorReply.isError(reply):
+                        return ErrorReply.unpackFrom(reply).getReason()
+                    payload_len = HEADER.unpack_from(reply)[0]
+                    if payload_len == StageBResponse.getSize():
+                        response = reply
+                    elif payload_len == ACK.size:
+                        if ACK.unpack_from(reply, HEADER_SIZE)[0] == base:
+                            base = base + 1
+                if base == packet:
+                    timeouts = timeouts + 1
+                    if timeouts == MAX_TIMEOUTS:
+                        return "stage_b_timeout"
+                else:
+                    timeouts = 0
+
+            deadline = time.monotonic() + RESPONSE_TIMEOUT
+            while response is None:
+                reply = receive(sock, deadline)
+                if reply is None:
+                    return "stage_b_no_response"
+                if ErrorReply.isError(reply):
+                    return ErrorReply.unpackFrom(reply).getReason()
+                if HEADER.unpack_from(reply)[0] == StageBResponse.getSize():
+                    response = reply
+        finally:
+            sock.close()
+        self._stage_b = StageBResponse.unpackFrom(response)
+        return None
+
+    def stageC(self):
+        plan = self._plan
+        # the recorded client's pause between Stages B and C
+        waitUntil(time.monotonic() + self.scale(plan.c_connect - plan.b_reply))
+        sock = self._transport.tcp()
+        self._tcp = sock
+        sock.settimeout(RESPONSE_TIMEOUT)
+        try:
+            sock.connect((self._address[0], self._stage_b.tcp_port))
+        except OSError:
+            sock.close()
+            return "stage_c_connect"
+        response = receive(sock, time.monotonic() + RESPONSE_TIMEOUT)
+        if response is None:
+            sock.close()
+            return "stage_c_no_response"
+        if ErrorReply.isError(response):
+            sock.close()
+            return ErrorReply.unpackFrom(response).getReason()
+        self._stage_c = StageCResponse.unpackFrom(response)
+        return None
+
+    def stageD(self):
+        plan = self._plan
+        sock = self._tcp
+        num2, length2, secret, char = self._stage_c.fields()
+        header = Header(length2, secret, 1, self._id)
+        stream = (header.getBytes() + char * alignedLength(BYTE_ALIGN, length2)) * num2
+        try:
+            if self._speed == math.inf or not plan.d_segments:
+                sock.sendall(stream)
+            else:
+                # split the live stream the way the recorded one was, by share of bytes
+                started = time.monotonic()
+                recorded = sum(size for _, size in plan.d_segments)
+                view = memoryview(stream)
+                cut = 0
+                total = 0
+                for at, size in plan.d_segments:
+                    total = total + size
+                    end = len(stream) * total // recorded
+                    waitUntil(started + self.scale(at - plan.c_reply))
+                    sock.sendall(view[cut:end])
+                    cut = end
+            response = receive(sock, time.monotonic() + RESPONSE_TIMEOUT)
+        except OSError:
+            return "stage_d_send"
+        finally:
+            sock.close()
+        if response is None:
+            return "stage_d_no_response"
+        if ErrorReply.isError(response):
+            return ErrorReply.unpackFrom(response).getReason()
+        return None
+
+
+def replay(
+    sessions: list,
+    server_address="localhost",
+    port=12235,
+    speed=1.0,
+    concurrency=0,
+    transport=None,
+) -> dict:
+    """Replay recorded sessions against a server and report how it held up.
+
+    Sessions start at their recorded offsets from the first one, scaled by speed.
+
+    Args:
+        sessions (list): SessionPlan of every session, from loadSessions.
+        server_address (str, optional): Server address. Defaults to "localhost".
+        port (int, optional): Stage A port. Defaults to 12235.
+        speed (float, optional): Speed up over the recorded timing, math.inf to send
+            everything as fast as the server answers. Defaults to 1.0.
+        concurrency (int, optional): Sessions replayed at once. Sessions that would
+            overlap more than this start late. The most sessions the recording had in
+            progress at once when 0. Defaults to 0.
+        transport (KernelTransport | LoopbackTransport, optional): Creates the
+            sockets. Real sockets when None. Defaults to None.
+
+    Returns:
+        dict: Report like the benchmark's, with how late sessions started.
+    """
+    transport = transport or KernelTransport()
+    if not sessions:
+        return report([], 0)
+    concurrency = concurrency or peakSessions(sessions)
+    first = sessions[0].start
+    address = (server_address, port)
+    started = time.monotonic()
+
+    def run(plan: SessionPlan) -> dict:
+        due = started + (plan.start - first) / speed
+        waitUntil(due)
+        lag = time.monotonic() - due
+        result = Replay(plan, address, speed, transport).run()
+        result["lag"] = lag
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(run, sessions))
+    summary = report(results, time.monotonic() - started)
+    lags = sorted(result["lag"] for result in results)
+    summary["start_lag"] = {
+        "p50": percentile(lags, 50),
+        "p99": percentile(lags, 99),
+        "max": lags[-1],
+    }
+    summary["recorded"] = {
+        "sessions": len(sessions),
+        "elapsed": max(session.end for session in sessions) - first,
+        "peak_sessions": peakSessions(sessions),
+    }
+    summary["speed"] = "max" if speed == math.inf else speed
+    summary["concurrency"] = concurrency
+    return summary
+
+
+def replayLoopback(sessions: list, speed: float, concurrency=0, max_length=128) -> dict:
+    """Replay against a thread server started in this process over a LoopbackTransport.
+
+    Args:
+        sessions (list): SessionPlan of every session.
+        speed (float): Speed up over the recorded timing, math.inf for max speed.
+        concurrency (int, optional): Sessions replayed at once, 0 for the recorded
+            peak. Defaults to 0.
+        max_length (int, optional): Largest Stage B and D length the server hands
+            out. Defaults to 128.
+
+    Returns:
+        dict: Replay report.
+    """
+    import run_server
+    from server import Server
+
+    network = LoopbackTransport()
+    # only problems are logged, to stderr so the report on stdout stays JSON
+    server = Server(
+        "localhost",
+        12235,
+        max_length=max_length,
+        transport=network,
+        log_level="warning",
+        log_stream=sys.stderr,
+    )
+    # the server thread shuts itself down once idle, a daemon never holds up exit
+    threading.Thread(target=run_server.start, kwargs={"server": server}, daemon=True).start()
+    # a request sent before the Stage A port is bound would be lost
+    while network.lookup(socket.SOCK_DGRAM, ("localhost", 12235)) is None:
+        time.sleep(0.001)
+    return replay(sessions, "localhost", 12235, speed, concurrency, network)
+
+
+def parseSpeed(text: str) -> float:
+    if text == "max":
+        return math.inf
+    speed = float(text)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or max")
+    return speed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay sessions recorded with --trace against a server and report throughput and latency as JSON."
+    )
+    parser.add_argument("traces", nargs="+", metavar="TRACE", help="Trace files to replay together.")
+    parser.add_argument("--address", default="localhost", help="Server address.")
+    parser.add_argument("--port", type=int, default=12235, help="Stage A port.")
+    parser.add_argument(
+        "--speed",
+        type=parseSpeed,
+        default=1.0,
+        help="Speed up over the recorded timing, like 10, or max to send as fast as the server answers.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=0,
+        help="Sessions replayed at once, the recorded peak when 0.",
+    )
+    parser.add_argument(
+        "--loopback",
+        action="store_true",
+        help="Replay against a thread server in this process on an in-memory network.",
+    )
+    parser.add_argument(
+        "--max-length",
+        type=int,
+        default=128,
+        help="Largest Stage B and D length handed out by the --loopback server.",
+    )
+    parser.add_argument("--output", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    sessions = loadSessions(args.traces)
+    if args.loopback:
+        result = replayLoopback(sessions, args.speed, args.concurrency, args.max_length)
+    else:
+        result = replay(
+            sessions, args.address, args.port, args.speed, args.concurrency
+        )
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
@@ -1,10 +1,64 @@
+import argparse
+import os
 import socket
-import struct
-from header import Header
+import sys
+import time
+from header import (
+    ACK,
+    HEADER,
+    HEADER_SIZE,
+    ErrorReply,
+    Header,
+    ResumeToken,
+    StageAResponse,
+    StageBResponse,
+    StageCResponse,
+    StageDFinal,
+    alignedLength,
+    calculateAligndLength,
+)
 from client import Client
-
-
-def start(server_address="localhost", port=12235) -> None:
+from protocol.profiler import Profiler
+from session_trace import TraceWriter, TracingTransport
+from transport import KernelTransport
+
+# failures after Stage B that a resumption token can recover from
+RESUMABLE = (
+    "stage_c_connect",
+    "stage_c_no_response",
+    "stage_d_send",
+    "stage_d_no_response",
+)
+
+# stage functions replaced by profiled wrappers in --profile mode, to their stage
+STAGES = {
+    "stageA": "A",
+    "stageB": "B",
+    "resume": "resume",
+    "stageC": "C",
+    "stageD": "D",
+}
+
+
+# most buffers one sendmsg call takes, more fail with EMSGSIZE
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+
+def start(
+    server_address="localhost",
+    port=12235,
+    window=1,
+    batch=64,
+    nodelay=False,
+    cork=False,
+    resumes=2,
+    transport=None,
+) -> Client:
     """Driver function that creates an instance of client and
     sends requests to server for project 1.
 
@@ -12,42 +66,73 @@ def start(server_address="localhost", port=12235) -> None:
         server_address (str, optional): Server address where client will send requests to. Defaults to "localhost".
         port (int, optional): Port to make intial request to server. Defaults to 12235.
         threading (bool, optional): Used when testing multithreading. Defaults to False.
+        window (int, optional): Stage B packets kept in flight at once. Defaults to 1.
+        batch (int, optional): Most Stage D messages handed to one send call. Defaults to 64.
+        nodelay (bool, optional): Set TCP_NODELAY on the Stage C/D socket. Defaults to False.
+        cork (bool, optional): Cork the Stage D socket while sending so the kernel
+            only sends full segments. Linux only. Defaults to False.
+        resumes (int, optional): Most times to resume at Stage C after Stage C or D
+            failed, when the server issued a resumption token. Defaults to 2.
+        transport (KernelTransport | LoopbackTransport, optional): Creates the
+            client's sockets. Real sockets when None. Defaults to None.
+
+    Returns:
+        Client: Client after the session, with stage times and any failure reason.
     """
     # create instance of client
-    client = Client(server_address, port)
+    client = Client(
+        server_address,
+        port,
+        window=window,
+        batch=batch,
+        nodelay=nodelay,
+        cork=cork,
+        transport=transport,
+    )
 
     # Move to stage A and down to later stages.
     stageA(client)
+
+    # pick the session up again at Stage C instead of redoing every Stage B round trip
+    while (
+        resumes > 0
+        and client.getFailure() in RESUMABLE
+        and client.getResumeToken() is not None
+    ):
+        resumes = resumes - 1
+        resume(client)
     # print("Finished all Client request.")
+    return client
 
 
-def calculateAligndLength(byte_align: int, length: int) -> int:
-    """Function that calucates the correct byte alignement needed.
+def alignString(byte_align: int, s: str) -> bytes:
+    """Function that aligns string with correct byte alignment.
 
     Args:
-        byte_align (int): Byte alignment
-        length (int): Length to align
+        s (str): String to align.
 
     Returns:
-        int: The new length after alignment.
+        bytes: new string with correct padding appended.
     """
-
-    return length + ((byte_align - length % byte_align) % byte_align)
+    return s + bytes(alignedLength(byte_align, len(s)) - len(s))
 
 
-def alignString(byte_align: int, s: str) -> bytes:
-    """Function that aligns string with correct byte alignment.
+def serverError(client, response) -> bool:
+    """Check whether the server rejected our last message, and record why.
 
     Args:
-        s (str): String to align.
+        client (Client): Client object.
+        response (bytes): Message received from the server.
 
     Returns:
-        bytes: new string with correct padding appended.
+        bool: True if response is an error reply and the session should stop.
     """
-    length = len(s)
-    padding = (byte_align - length % byte_align) % byte_align
-    format_str = f"{length}s{padding}x"
-    return struct.pack(format_str, s)
+    if not ErrorReply.isError(response):
+        return False
+    reason = ErrorReply.unpackFrom(response).getReason()
+    print(f"Server rejected our message: {reason}")
+    client.setFailure(reason)
+    return True
 
 
 def stageA(client) -> None:
@@ -58,8 +143,8 @@ def stageA(client) -> None:
 
     """
     # create a UDP socket to make intial request.
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.settimeout(5)
+    udp_socket = client.getTransport().udp()
+    rtt = client.getRttEstimator()
 
     # create stage A payload.
     payload = alignString(client.getByteAlign(), "hello world\0".encode())
@@ -67,17 +152,39 @@ def stageA(client) -> None:
 
     message = header.getBytes() + payload
     print("Sending message to server for stage A.")
-    udp_socket.sendto(message, (client.getServerAddress(), client.getPort()))
 
-    # try to read from server
-    try:
-        response = udp_socket.recv(client.getReadSize())
-    except socket.timeout:
-        print("Client socket timed out in stage A...")
+    # resend with a doubled timeout each time the server does not answer
+    MAX_RETRANSMITS = 4
+    retransmits = 0
+    while True:
+        sent = time.monotonic()
+        udp_socket.sendto(message, (client.getServerAddress(), client.getPort()))
+        udp_socket.settimeout(rtt.getRto())
+
+        # try to read from server
+        try:
+            response = udp_socket.recv(client.getReadSize())
+            break
+        except socket.timeout:
+            rtt.backoff()
+            retransmits = retransmits + 1
+            if retransmits > MAX_RETRANSMITS:
+                print("Client socket timed out in stage A...")
+                client.setFailure("stage_a_timeout")
+                return
+
+    if serverError(client, response):
+        udp_socket.close()
         return
 
+    # only a reply to a packet sent once is a trustworthy round trip
+    if retransmits == 0:
+        rtt.sample(time.monotonic() - sent)
+    else:
+        rtt.clearBackoff()
+
     # unpack server response minus the header
-    num, length, udp_port, secret = struct.unpack(">IIII", response[12:])
+    num, length, udp_port, secret = StageAResponse.unpackFrom(response).fields()
 
     # save necessary data
     client.setSecret(secret)
@@ -85,6 +192,7 @@ def stageA(client) -> None:
 
     # close no longer needed UDP socket.
     udp_socket.close()
+    client.markStage("A")
 
     print(f"Stage A secret is {secret}\n")
 
@@ -95,59 +203,189 @@ def stageA(client) -> None:
 def stageB(client, stageA_response) -> None:
     """Client logic for Stage B.
 
+    Keeps up to client.getWindow() packets in flight. Each packet has its own
+    retransmit timer, set from the client's round trip estimate, and only packets
+    that were not acknowledged are resent.
+    A window of 1 is plain stop-and-wait.
+
     Args:
         stageA_response ((int, int)): Stage A response containing num and length information.
     """
 
     num, length = stageA_response
 
-    # create a UDP socket to listen on new port number received from
-    # server in Stage A. Set socket timer to .5 sec
-    upd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    upd_socket.settimeout(0.5)
-    port = client.getPort()
+    # create a UDP socket to send to the new port number received from
+    # server in Stage A. Each packet is resent once the retransmit timer goes off
+    upd_socket = client.getTransport().udp()
+    rtt = client.getRttEstimator()
+    address = (client.getServerAddress(), client.getPort())
 
     # get aligned payload length.
     aligned_payload_len = calculateAligndLength(client.getByteAlign(), length)
 
-    # create header and payload message for Stage B.
+    # create header and payload message for Stage B once, only the ack number
+    # after the header changes between packets
     header = Header(length + 4, client.getSecret(), client.getStep(), client.getId())
-    payload = b"\0" * aligned_payload_len
+    message = bytearray(HEADER_SIZE + ACK.size + aligned_payload_len)
+    header.packInto(message)
+
+    # lowest packet not acknowledged yet and next packet never sent
+    base = 0
+    next_ack = 0
+    # send time of every packet waiting for an ack
+    in_flight = {}
+    # packets that were resent, their acks are not used as round trip samples
+    resent = set()
+    acked = set()
+    window = client.getWindow()
 
-    ack = 0
     # set a max timeout attempts when sending messages to server.
     MAX_TIMEOUTS = 100
     # send num packets to the server on udp_port
     print(f"Sending {num} messages to server for stage B...")
-    while ack < num:
-        message = header.getBytes() + struct.pack(">I", ack) + payload
-        upd_socket.sendto(message, (client.getServerAddress(), port))
-
-        # resend if timeout
+    while base < num:
+        # fill the window with packets never sent before
+        while next_ack < num and next_ack < base + window:
+            ACK.pack_into(message, HEADER_SIZE, next_ack)
+            upd_socket.sendto(message, address)
+            in_flight[next_ack] = time.monotonic()
+            next_ack = next_ack + 1
+
+        # wait until the oldest unacknowledged packet is due for a resend
+        remaining = min(in_flight.values()) + rtt.getRto() - time.monotonic()
         try:
-            upd_socket.recv(client.getReadSize())
+            if remaining <= 0:
+                raise socket.timeout
+            upd_socket.settimeout(remaining)
+            response = upd_socket.recv(client.getReadSize())
         except socket.timeout:
             MAX_TIMEOUTS = MAX_TIMEOUTS - 1
             if MAX_TIMEOUTS == 0:
                 print("Client socket timed out 100 times in Stage B, check server...")
+                client.setFailure("stage_b_timeout")
                 return
-            continue
 
-        # successfully got a response
-        ack = ack + 1
+            # resend only the packets whose timer went off
+            now = time.monotonic()
+            rto = rtt.getRto()
+            rtt.backoff()
+            for ack, sent in in_flight.items():
+                if now - sent >= rto:
+                    ACK.pack_into(message, HEADER_SIZE, ack)
+                    upd_socket.sendto(message, address)
+                    in_flight[ack] = now
+                    resent.add(ack)
+            continue
 
-    print("Done sending messages for stage B...")
+        # successfully got a response, ack number follows the header
+        if serverError(client, response):
+            upd_socket.close()
+            return
+        if len(response) < HEADER_SIZE + ACK.size:
+            continue
+        (ack,) = ACK.unpack_from(response, HEADER_SIZE)
+        sent = in_flight.pop(ack, None)
+        if sent is None:
+            continue
+        if ack not in resent:
+            rtt.sample(time.monotonic() - sent)
+        else:
+            rtt.clearBackoff()
+        acked.add(ack)
+        while base in acked:
+            acked.remove(base)
+            base = base + 1
+
+    print(
+        f"Done sending messages for stage B, {rtt.getRetransmits()} timeouts so far, RTO {rtt.getRto():.3f}s..."
+    )
     # get new message from server containing Stage B secret.
-    response = upd_socket.recv(client.getReadSize())
+    # skip acks for packets that were resent after the server acknowledged them
+    upd_socket.settimeout(5)
+    while True:
+        try:
+            response = upd_socket.recv(client.getReadSize())
+        except socket.timeout:
+            print("Did not hear back from server in stage B...")
+            client.setFailure("stage_b_no_response")
+            return
+        if serverError(client, response):
+            upd_socket.close()
+            return
+        payload_len, _, _, _ = HEADER.unpack_from(response)
+        if payload_len == StageBResponse.getSize():
+            break
 
     # unpack message minus header
-    tcp_port, secret = struct.unpack(">II", response[len(header.getBytes()) :])
+    tcp_port, secret = StageBResponse.unpackFrom(response).fields()
 
     client.setPort(tcp_port)
     client.setSecret(secret)
+    saveResumeToken(client, response)
 
     print(f"Stage B secret is {secret}\n")
     upd_socket.close()
+    client.markStage("B")
+    stageC(client)
+
+
+def saveResumeToken(client, response) -> None:
+    """Keep the resumption token that may follow the Stage B response payload.
+
+    Args:
+        client (Client): Client object.
+        response (bytes): Stage B response.
+    """
+    offset = HEADER_SIZE + StageBResponse.getSize()
+    if len(response) < offset + ResumeToken.getSize():
+        return
+    token = ResumeToken.unpackFrom(response, offset).token
+    client.setResumeToken(token, StageBResponse.unpackFrom(response).secret)
+
+
+def resume(client) -> None:
+    """Ask the server for a new Stage C port with the resumption token, then redo
+    Stages C and D.
+
+    Args:
+        client (Client): Client object, after Stage C or D failed.
+    """
+    print(f"Resuming at stage C after {client.getFailure()}...")
+    udp_socket = client.getTransport().udp()
+    rtt = client.getRttEstimator()
+    header = Header(
+        ResumeToken.getSize(), client.getResumeSecret(), ResumeToken.STEP, client.getId()
+    )
+    message = header.getBytes() + ResumeToken(client.getResumeToken(), 2).getBytes()
+    # the token can only be used once, the server sends a new one
+    client.setResumeToken(None, None)
+
+    MAX_RETRANSMITS = 4
+    retransmits = 0
+    while True:
+        udp_socket.sendto(message, (client.getServerAddress(), client.getStageAPort()))
+        udp_socket.settimeout(rtt.getRto())
+        try:
+            response = udp_socket.recv(client.getReadSize())
+            break
+        except socket.timeout:
+            rtt.backoff()
+            retransmits = retransmits + 1
+            if retransmits > MAX_RETRANSMITS:
+                print("Client socket timed out resuming the session...")
+                udp_socket.close()
+                return
+    udp_socket.close()
+    if retransmits:
+        rtt.clearBackoff()
+    if serverError(client, response):
+        return
+
+    tcp_port, secret = StageBResponse.unpackFrom(response).fields()
+    client.setPort(tcp_port)
+    client.setSecret(secret)
+    client.setFailure(None)
+    saveResumeToken(client, response)
     stageC(client)
 
 
@@ -160,8 +398,10 @@ def stageC(client) -> None:
 
     # create a TCP socket that will make a connection to the server socket
     # on port number received in Stage B
-    tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tcp_socket = client.getTransport().tcp()
     tcp_socket.settimeout(5)
+    if client.getNodelay():
+        tcp_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     # create a connection on the tcp port
     try:
         print(f"Connecting to TCP port {client.getPort()} in stage C...")
@@ -170,6 +410,7 @@ def stageC(client) -> None:
     except socket.error as e:
         print("Client socket could not connect in Stage C.")
         print(e)
+        client.setFailure("stage_c_connect")
         return
 
     # listen for response from server
@@ -177,17 +418,60 @@ def stageC(client) -> None:
         response = tcp_socket.recv(client.getReadSize())
     except socket.timeout:
         print("Did not hear back from server in stage C...")
+        client.setFailure("stage_c_no_response")
         return
 
     # unpack response minus header.
-    num2, length2, secret, c = struct.unpack(">IIIc", response[12:25])
+    num2, length2, secret, c = StageCResponse.unpackFrom(response).fields()
 
     print(f"Stage C secret is {secret}\n")
 
     client.setSecret(secret)
+    client.markStage("C")
     stageD(client, tcp_socket, (num2, length2, c))
 
 
+def sendRepeated(tcp_socket, message: bytes, count: int, batch: int) -> int:
+    """Send the same message count times using as few send calls as possible.
+
+    Each sendmsg call gets up to batch references to the one message buffer, so
+    nothing is copied on our side. Short writes resume from the exact byte where
+    the kernel stopped. Falls back to sendall over a joined buffer where sendmsg
+    is not available.
+
+    Args:
+        tcp_socket (socket.socket): Connected TCP socket.
+        message (bytes): Message to repeat.
+        count (int): Number of times to send message.
+        batch (int): Most messages handed to one send call, capped at IOV_MAX.
+
+    Returns:
+        int: Number of send calls made.
+    """
+    batch = max(1, min(batch, IOV_MAX))
+    total = len(message) * count
+    calls = 0
+    if not hasattr(tcp_socket, "sendmsg"):
+        for sent in range(0, count, batch):
+            tcp_socket.sendall(message * min(batch, count - sent))
+            calls = calls + 1
+        return calls
+
+    view = memoryview(message)
+    offset = 0
+    while offset < total:
+        # finish the message a short write stopped in, then whole messages
+        start = offset % len(message)
+        buffers = [view[start:]]
+        queued = len(message) - start
+        while len(buffers) < batch and offset + queued < total:
+            buffers.append(view)
+            queued = queued + len(message)
+        offset = offset + tcp_socket.sendmsg(buffers)
+        calls = calls + 1
+    return calls
+
+
 def stageD(client, tcp_socket, stageC_response) -> None:
     """Client logic for Stage D.
 
@@ -207,23 +491,113 @@ def stageD(client, tcp_socket, stageC_response) -> None:
     message = header.getBytes() + payload
 
     print(f"Sending {num} number of packets to server in stage D...")
-    for _ in range(num):
-        tcp_socket.send(message)
+    cork = client.getCork() and hasattr(socket, "TCP_CORK")
+    if cork:
+        tcp_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    try:
+        sendRepeated(tcp_socket, message, num, client.getBatch())
+    except OSError as e:
+        # the server resets the connection if it rejects a message we are still sending
+        print(f"Connection lost while sending in stage D: {e}")
+        client.setFailure("stage_d_send")
+        tcp_socket.close()
+        return
+    if cork:
+        # uncorking flushes whatever is left in a partial segment
+        tcp_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
 
     # get response from server
     try:
         response = tcp_socket.recv(client.getReadSize())
     except socket.timeout:
         print("Did not hear back from server in stage D...")
+        client.setFailure("stage_d_no_response")
+        return
+    if serverError(client, response):
+        tcp_socket.close()
         return
 
     # get secret from stage D
-    _, _, _, _, secret = struct.unpack(">IIHHI", response)
+    secret = StageDFinal.unpackFrom(response).secret
     print(f"Stage D secret is {secret}\n")
 
     client.setSecret(secret)
     tcp_socket.close()
+    client.markStage("D")
 
 
 if __name__ == "__main__":
-    start()
+    parser = argparse.ArgumentParser(description="CSE 461 Project 1 client.")
+    parser.add_argument("--address", default="localhost", help="Server address.")
+    parser.add_argument("--port", type=int, default=12235, help="Stage A port.")
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=1,
+        help="Stage B packets kept in flight at once, the server must accept the same window.",
+    )
+    parser.add_argument(
+        "--batch", type=int, default=64, help="Most Stage D messages per send call."
+    )
+    parser.add_argument(
+        "--nodelay", action="store_true", help="Set TCP_NODELAY for Stages C and D."
+    )
+    parser.add_argument(
+        "--cork", action="store_true", help="Cork the socket while sending Stage D."
+    )
+    parser.add_argument(
+        "--resumes",
+        type=int,
+        default=2,
+        help="Most times to resume at Stage C after a Stage C or D failure.",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        default=None,
+        help="Profile every stage and write the profiles to DIR when the session ends.",
+    )
+    parser.add_argument(
+        "--profile-allocations",
+        action="store_true",
+        help="With --profile, also report the lines allocating the most in each stage.",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        default=None,
+        help="Record every datagram and segment of the session to FILE for replay.py.",
+    )
+    args = parser.parse_args()
+    if not 1 <= args.batch <= IOV_MAX:
+        parser.error(f"--batch must be between 1 and {IOV_MAX}, the most buffers per sendmsg")
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile, args.profile_allocations)
+        profiler.instrument(sys.modules[__name__], STAGES)
+        profiler.start()
+
+    transport = None
+    trace = None
+    if args.trace:
+        trace = TraceWriter(args.trace, "client")
+        transport = TracingTransport(KernelTransport(), trace)
+
+    start(
+        server_address=args.address,
+        port=args.port,
+        window=args.window,
+        batch=args.batch,
+        nodelay=args.nodelay,
+        cork=args.cork,
+        resumes=args.resumes,
+        transport=transport,
+    )
+
+    if trace is not None:
+        trace.close()
+        print(f"Wrote {trace.getRecords()} trace records to {args.trace}")
+    if profiler is not None:
+        written = profiler.close()
+        print(f"Wrote {len(written)} profile files to {args.profile}")
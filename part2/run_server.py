@@ -1,36 +1,116 @@
+import argparse
+import queue
 import socket
-import struct
-import random
+import sys
 import threading
+import time
 from server import Server
-from header import Header
-
-
-def start(server_address="localhost", default_port=12235) -> None:
+from logger import LEVELS, parseStageLevels
+from metrics import serveText, writeSnapshot, writeSnapshots
+from server_session import (
+    BINDING_TCP,
+    BINDING_UDP,
+    FAIL,
+    SEND,
+    STAGE_B,
+    STAGE_D,
+    ServerSession,
+    perform,
+)
+from stage_b_mux import StageBMux
+
+# stage functions replaced by profiled wrappers in --profile mode, to their stage
+STAGES = {
+    "stageA": "A",
+    "resume": "resume",
+    "stageB": "B",
+    "stageC": "C",
+    "stageD": "D",
+}
+
+
+def start(server_address="localhost", default_port=12235, server=None) -> None:
     """Start function that creates server object that will handle client requests.
 
     Args:
         server_address (str, optional): Server address. Defaults to 'localhost'.
         default_port (int, optional): Port that server should listen on. Defaults to 12235.
+        server (Server, optional): Already configured server object. Created from
+            server_address and default_port when None. Defaults to None.
     """
 
     # create server object
-    server = Server(server_address, default_port)
+    if server is None:
+        server = Server(server_address, default_port)
+
+    if server.getStageBSockets() > 0:
+        server.setStageBMux(
+            StageBMux(
+                server.getAddress(),
+                server.getStageBSockets(),
+                server.getReadSize(),
+                server.getTransport(),
+                server,
+            )
+        )
 
-    print("Server setup...")
-    print("Listening for client requests...")
+    profiler = server.getProfiler()
+    if profiler is not None:
+        # stages call each other by name, so swapping the module functions profiles
+        # every stage, and without --profile nothing on the session path changes
+        profiler.instrument(sys.modules[__name__], STAGES)
+        profiler.start()
+
+    server.getPortAllocator().warm()
+    # one thread enforces every session's stage deadlines
+    server.getTimerWheel().start()
+    log = server.getLogger()
+    log.start()
+    exportMetrics(server)
+    log.info("server_started", address=server.getAddress(), port=server.getPort())
 
     # this socket will listen for client inital request and
     # create a thread once it receives a request
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server_socket.bind((server_address, default_port))
+    server_socket = server.getTransport().udp()
+    if server.getReusePort():
+        # let the kernel spread inital requests across worker processes
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((server.getAddress(), server.getPort()))
+
+    # with a session limit a fixed pool of threads serves queued requests, and
+    # requests that find every slot and queue place taken are dropped right away
+    requests = None
+    admitted = None
+    pool = []
+    if server.getMaxSessions() > 0:
+        requests = queue.Queue()
+        admitted = threading.BoundedSemaphore(
+            server.getMaxSessions() + server.getSessionQueue()
+        )
+        for _ in range(server.getMaxSessions()):
+            handler = threading.Thread(target=serveRequests, args=(server, requests, admitted))
+            handler.start()
+            pool.append(handler)
+
+    rate_limiter = server.getRateLimiter()
 
     # wait for new requests, terminate after timer goes off.
+    # the timeout applies to each recvfrom, so it never needs to be set again
     server_socket.settimeout(30)
 
     while True:
         try:
             message, client_address = server_socket.recvfrom(server.getReadSize())
+            # turn away noisy hosts before their request costs a thread or a port
+            if rate_limiter is not None and not rate_limiter.allow(client_address[0]):
+                server.addStat("requests_rate_limited")
+                continue
+            if requests is not None:
+                if admitted.acquire(blocking=False):
+                    requests.put((time.monotonic(), message, client_address))
+                else:
+                    server.addStat("sessions_rejected")
+                continue
             client_handler = threading.Thread(
                 target=stageA,
                 args=(
@@ -40,337 +120,590 @@ def start(server_address="localhost", default_port=12235) -> None:
                 ),
             )
             client_handler.start()
-            server_socket.settimeout(30)
         except socket.timeout:
-            print("Have not received client request for 30 seconds..")
-            print("Shutting down.")
+            log.info("server_idle", seconds=30)
             server_socket.close()
+            for _ in pool:
+                requests.put(None)
+            for handler in pool:
+                handler.join()
+            log.info("server_stopped", **server.getStats())
+            writeProfiles(server)
+            closeTrace(server)
+            log.close()
+            if server.getMetricsFile():
+                writeSnapshot(server.getMetrics(), server.getMetricsFile())
             exit()
 
 
-def validateHeader(server, id: int, step: int) -> bool:
-    """Function to validate student id and step in client header.
+def exportMetrics(server) -> None:
+    """Start serving the metrics on a local port and writing snapshots, as configured.
 
     Args:
-        server (Server): server object to check id and step on
-        id (int): client student to validate
-        step (int): client step to validate
+        server (Server): Server object.
+    """
+    if server.getMetricsPort() > 0:
+        serveText(server.getMetrics(), "localhost", server.getMetricsPort())
+    if server.getMetricsFile():
+        writeSnapshots(server.getMetrics(), server.getMetricsFile())
 
-    Returns:
-        bool: returns True if stduent id and step match expected values
+
+def writeProfiles(server) -> None:
+    """Write the stage profiles, when profiling.
+
+    Args:
+        server (Server): Server object.
+    """
+    profiler = server.getProfiler()
+    if profiler is not None:
+        written = profiler.close()
+        server.getLogger().info(
+            "profiles_written", directory=profiler.getDirectory(), files=len(written)
+        )
+
+
+def closeTrace(server) -> None:
+    """Flush and close the trace, when recording one.
+
+    Args:
+        server (Server): Server object.
     """
+    trace = server.getTrace()
+    if trace is not None:
+        trace.close()
+        server.getLogger().info(
+            "trace_written", file=trace.getPath(), records=trace.getRecords()
+        )
+
 
-    if server.getId() != id:
-        print(f"Mismatch student ID, got {id} expected {server.getId()}.")
-        return False
-    # client always sends a header with step == 1
-    elif step != 1:
-        print("Wrong client step number.")
-        return False
-    return True
+def serveRequests(server, requests: queue.Queue, admitted: threading.Semaphore) -> None:
+    """Session pool thread, serves queued Stage A requests one at a time.
+
+    Args:
+        server (Server): Server object.
+        requests (queue.Queue): Queued (time received, message, client address) requests,
+            None tells the thread to exit.
+        admitted (threading.Semaphore): Session slot taken by the listener for every
+            queued request, released once the request is done with.
+    """
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        received, message, client_address = request
+        try:
+            # the client resent a request this old, serving it would start a session
+            # nobody waits for while newer requests queue behind it
+            if time.monotonic() - received > server.getQueueTimeout():
+                server.addStat("sessions_expired")
+                continue
+            stageA(server, message, client_address)
+        except Exception as e:
+            server.getLogger().error("session_error", client=client_address, error=e)
+        finally:
+            admitted.release()
 
 
-def calculateAligndLength(byte_align: int, length: int) -> int:
-    """Function that calucates the correct byte alignement needed.
+def watch(server, sock):
+    """Start the idle deadline for a session stage blocked on sock.
+
+    Stage sockets block without a timeout of their own. If the client stays silent for
+    the stage timeout, the shared timer wheel shuts sock down, which wakes the blocked
+    call with an empty read or an OSError.
 
     Args:
-        byte_align (int): Byte alignment
-        length (int): Length to align
+        server (Server): Server object.
+        sock (socket.socket | StageBSession): Socket the stage reads from.
 
     Returns:
-        int: The new length after alignment.
+        Deadline: Touch it on every packet, cancel it when the stage is done.
     """
 
-    return length + ((byte_align - length % byte_align) % byte_align)
+    def expire() -> None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # unconnected UDP sockets still wake up, but report ENOTCONN
+            pass
 
+    return server.getTimerWheel().watch(server.getStageTimeout(), expire)
 
-def stageA(server, message, client_address) -> None:
-    """Handles server logic for project 1
+
+def reply(server, actions: list, client_address) -> bool:
+    """Send the replies to a request heard on the Stage A port from a new UDP socket.
 
     Args:
         server (Server): Server object.
-        message (bytes): Inital byte message from client.
+        actions (list): Actions returned by ServerSession.
         client_address (_RetAddress): Client return address.
+
+    Returns:
+        bool: False if the session failed.
     """
+    udp_socket = server.getTransport().udp()
+    try:
+        return perform(server, actions, lambda data: udp_socket.sendto(data, client_address))
+    finally:
+        udp_socket.close()
 
-    # unpack client inital message.
-    header_length = 12
-    payload_len, p_secret, step, student_id = struct.unpack(
-        ">IIHH", message[:header_length]
-    )
-    client_payload = message[header_length : header_length + payload_len]
 
-    print("Validating client response for Stage A.")
-    hello_world = "hello world\0"
-    aligned_payload_len = calculateAligndLength(server.getByteAlign(), len(hello_world))
+def stageA(server, message, client_address) -> None:
+    """Handles server logic for project 1
 
-    if not validateHeader(server, student_id, step):
-        print("Invalid header in StageA...")
-        return
-    elif client_payload != hello_world.encode():
-        print(
-            f"Wrong payload for stage A, was {client_payload.decode()} but expected {hello_world}..."
-        )
-        return
-    elif len(message) != header_length + aligned_payload_len:
-        print(
-            f"Message length mismatch, was {len(message)} but expected {header_length + aligned_payload_len}..."
-        )
+    Protocol decisions are made by a ServerSession, the stage functions only move bytes
+    between it and the sockets.
+
+    Args:
+        server (Server): Server object.
+        message (bytes): Inital byte message from client.
+        client_address (_RetAddress): Client return address.
+    """
+    started = time.monotonic()
+    log = server.getLogger()
+    log.debug("request", "A", client=client_address)
+    server.addStat("bytes_in", len(message))
+    session = ServerSession(server, client_address[0])
+    actions = session.feed(message)
+    if session.getState() == BINDING_TCP:
+        resume(server, session, client_address)
         return
-    # stage A secret is always 0
-    elif p_secret != 0:
-        print("Secret mismatch in Stage A...")
+    elif session.getState() != BINDING_UDP:
+        # tell the client right away instead of letting it time out, or resend the
+        # reply to a resume request the client sent again
+        reply(server, actions, client_address)
         return
 
-    # passed validations
-    print("Validation complete. Sending server response.\n")
+    mux = server.getStageBMux()
+    secret = None
+    try:
+        if mux is not None:
+            # share a pooled Stage B socket, the secret tells sessions apart
+            stage_b_socket = mux.register()
+            udp_port = stage_b_socket.getPort()
+            secret = stage_b_socket.getSecret()
+        else:
+            # bind before sending the port so the first Stage B packet never hits a closed port
+            udp_port, stage_b_socket = server.getPortAllocator().acquireUdp()
+    except OSError as e:
+        log.error("no_port", "B", error=e)
+        session.fail("stage_b_no_port")
+        return
 
-    # create header to send to client
-    # payload length to send contains num, length, udp_port, and secret
-    # step in stageA is 0, increments onward
-    header = Header(16, p_secret, step=0, student_id=student_id)
+    try:
+        log.debug(
+            "response",
+            "A",
+            client=client_address,
+            num=session.getNum(),
+            length=session.getLength(),
+            port=udp_port,
+        )
+        reply(server, session.bound(udp_port, secret), client_address)
+        server.observeStage("A", time.monotonic() - started)
+        stageB(server, session, stage_b_socket)
+    finally:
+        # give the Stage B socket back even if the session failed
+        if mux is not None:
+            stage_b_socket.close()
+        else:
+            server.getPortAllocator().release(udp_port, stage_b_socket)
 
-    # generate random packet to send to client
-    num = random.randint(8, 32)
-    length = random.randint(32, 128)
-    udp_port = random.randint(server.getLowerPort(), server.getUpperPort())
-    secret = random.randint(1, 10000)
 
-    response_payload = struct.pack(">IIII", num, length, udp_port, secret)
-    response_message = header.getBytes() + response_payload
+def resume(server, session, client_address) -> None:
+    """Pick a session up again at Stage C, skipping Stages A and B.
 
-    # create socket to send message to client and close socket after
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.sendto(response_message, client_address)
-    udp_socket.close()
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session that accepted a resume request, waiting for
+            its TCP port.
+        client_address (_RetAddress): Client return address.
+    """
+    server.getLogger().debug("session_resumed", "C", client=client_address)
+    udp_socket = server.getTransport().udp()
+    try:
+        listener = bindStageC(
+            server, session, lambda data: udp_socket.sendto(data, client_address)
+        )
+    finally:
+        udp_socket.close()
+    if listener is None:
+        return
 
-    # only move onto stage B if passed all validations
-    stageB(server, response_payload)
+    tcp_port, tcp_socket = listener
+    try:
+        stageC(server, session, tcp_socket)
+    finally:
+        server.getPortAllocator().release(tcp_port, tcp_socket)
 
 
-def stageB(server, message) -> None:
+def stageB(server, session, udp_socket) -> None:
     """Server logic for Stage B.
 
     Args:
         server (Server): Server object.
-        message (bytes): Byte payload sent to client in stage A.
+        session (ServerSession): Session state machine, in Stage B.
+        udp_socket (socket.socket | StageBSession): Socket bound to the UDP port given
+            to client. Released by the caller once the session ends.
     """
-    # unpack message sent to client in stage A minus header
-    num, length, udp_port, secretB = struct.unpack(">IIII", message)
-
-    # create a socket at udp_port given to client
+    started = time.monotonic()
     # server should close any socket connection if it fails to receive any
     # message from client for more than 3 seconds
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.bind((server.getAddress(), udp_port))
-    udp_socket.settimeout(3)
-
-    print(f"Listening for {num} messages from client in StageB...")
-    ack = 0
-    header_length = 16
-    expected_length = header_length + calculateAligndLength(
-        server.getByteAlign(), length
-    )
-    while ack < num:
-        # listen for client response
-        try:
-            response, client_address = udp_socket.recvfrom(server.getReadSize())
-        except socket.timeout:
-            print("Server timed out in Stage B. Try Again...")
+    deadline = watch(server, udp_socket)
+    client_address = None
+    try:
+        client_address = receiveStageB(server, session, udp_socket, deadline)
+    finally:
+        if deadline.cancel():
+            # a shut down socket is no use to the next session
             udp_socket.close()
-            return
+    if client_address is None:
+        return
+    elif deadline.expired():
+        # every packet arrived, but too late to answer on the shut down socket
+        session.fail("stage_b_timeout")
+        return
 
-        # get header info plus client ack number
-        payload_length, p_secret, step, student_id, ack_num = struct.unpack(
-            ">IIHHI", response[:header_length]
-        )
-        # get payload of zeros of length payload_length
-        payload = response[header_length : header_length + payload_length - 4]
-        # construct expected payload
-        expected_payload = b"\0" * length
-
-        # validate response
-        if not validateHeader(server, student_id, step):
-            print("Invalid header in StageB...")
-            return
-        elif p_secret != secretB:
-            print("Incorrent secret from previous stage...")
-            return
-        elif len(response) != expected_length:
-            print(
-                f"Message length mismatch, expected {expected_length} but got {len(response)} in Stage B..."
-            )
-            return
-        elif length + 4 != payload_length:
-            print(
-                f"Payload length mismatch, expected {length + 4} but got {payload_length}"
-            )
-            return
-        elif expected_payload != payload:
-            print(
-                f"Payload mismatch in Stage B. Expected \n{expected_payload}\n but got \n{payload}\n"
-            )
-            return
-        elif ack < ack_num:
-            print(
-                "Received a message with a higher acknowledge number then expected..."
-            )
-            return
-        elif ack > ack_num:
-            # received an old message, continue and listen for a new message
-            continue
+    server.getLogger().debug("received", "B", client=client_address, num=session.getNum())
 
-        # valided response, send ack message to client to get next message
-        # server randomly decides to send an ack packet to client
-        if random.randint(0, 1):
-            # server decided to send an ack packet
-            message = struct.pack(">IIHHI", 4, p_secret, 1, student_id, ack)
-            udp_socket.sendto(message, client_address)
+    # the allocator hands the TCP socket out already listening, so a client
+    # connecting right after our message is never refused
+    listener = bindStageC(server, session, lambda data: udp_socket.sendto(data, client_address))
+    if listener is None:
+        return
+    server.observeStage("B", time.monotonic() - started)
 
-            # increment ack number and listen for next message
-            ack = ack + 1
+    tcp_port, tcp_socket = listener
+    try:
+        stageC(server, session, tcp_socket)
+    finally:
+        server.getPortAllocator().release(tcp_port, tcp_socket)
 
-    print(f"Received {num} messages from client in Stage B.")
-    print("Sending server response.\n")
 
-    # build message for stage C
-    tcp_port = random.randint(server.getLowerPort(), server.getUpperPort())
-    secretC = random.randint(1, 10000)
+def receiveStageB(server, session, udp_socket, deadline):
+    """Feed every Stage B packet to the session and send the acks it decides on.
 
-    header = Header(8, p_secret, step=1, student_id=server.getId())
-    message = header.getBytes() + struct.pack(">II", tcp_port, secretC)
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session state machine, in Stage B.
+        udp_socket (socket.socket | StageBSession): Socket bound to the Stage B port.
+        deadline (Deadline): Stage B idle deadline.
 
-    # setup TCP socket for stageC
-    tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    tcp_socket.bind((server.getAddress(), tcp_port))
-    tcp_socket.settimeout(3)
+    Returns:
+        _RetAddress | None: Client address once every packet arrived, None if the
+            session failed.
+    """
+    client_address = None
+    # traffic is added up here and counted once when the stage ends
+    bytes_in = 0
+    bytes_out = 0
+    try:
+        while session.getState() == STAGE_B:
+            # listen for client response
+            response, client_address = udp_socket.recvfrom(server.getReadSize())
+            if deadline.expired():
+                server.getLogger().info(
+                    "stage_timeout", "B", acked=session.getAck(), num=session.getNum()
+                )
+                session.timeout()
+                return None
+            deadline.touch()
+            bytes_in = bytes_in + len(response)
+
+            for kind, value in session.feed(response):
+                if kind == SEND:
+                    bytes_out = bytes_out + udp_socket.sendto(value, client_address)
+                elif kind == FAIL:
+                    return None
+        return client_address
+    finally:
+        server.addStat("bytes_in", bytes_in)
+        server.addStat("bytes_out", bytes_out)
+
+
+def bindStageC(server, session, send):
+    """Listen on a TCP port for Stage C and announce it with the Stage B response.
 
-    # send client message
-    udp_socket.sendto(message, client_address)
-    udp_socket.close()
-    stageC(server, tcp_socket, secretC)
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session state machine, waiting for its TCP port.
+        send (callable): Sends bytes to the client's datagram address.
 
+    Returns:
+        (int, socket.socket) | None: Port and listening socket, released by the caller,
+            or None if no port was free.
+    """
+    try:
+        tcp_port, tcp_socket = server.getPortAllocator().acquireTcp()
+    except OSError as e:
+        server.getLogger().error("no_port", "C", error=e)
+        session.fail("stage_c_no_port")
+        return None
+    perform(server, session.bound(tcp_port), send)
+    return tcp_port, tcp_socket
 
-def stageC(server, tcp_socket: socket.socket, secretC: int) -> None:
+
+def stageC(server, session, tcp_socket: socket.socket) -> None:
     """Server logic for Stage C.
 
     Args:
         server (Server): Server object.
-        tcp_socket (Socket.socket): TCP socket created in stage B. Socket is binded to the TCP port given to client.
-        secretC (int): Secret created in Stage B.
+        session (ServerSession): Session state machine, in Stage C.
+        tcp_socket (Socket.socket): TCP socket bound to the TCP port given to client.
+            It was already listening before the port was sent.
     """
-    # listen for incoming connections
-    print("Server listening for client in Stage C...")
-    tcp_socket.listen()
+    # connections made before we got here are waiting in the listen backlog
+    started = time.monotonic()
+    log = server.getLogger()
 
     # try to connect
+    deadline = watch(server, tcp_socket)
     try:
         client_socket, client_address = tcp_socket.accept()
-    except socket.timeout:
-        print("Server timed out waiting for client in Stage C...")
+    except OSError:
+        if not deadline.expired():
+            raise
+        log.info("stage_timeout", "C")
+        session.timeout()
         return
+    finally:
+        if deadline.cancel():
+            # a shut down socket is no use to the next session
+            tcp_socket.close()
 
-    print("Successfully connected to client in StageC.")
-    print("Sending server response.\n")
-
-    # build header and payload for stage D
-    header = Header(13, secretC, step=2, student_id=server.getId())
-    num2 = random.randint(8, 32)
-    length2 = random.randint(32, 128)
-    secret = random.randint(1, 10000)
-    random_char = chr(random.randint(ord("a"), ord("z")))
-    payload = struct.pack(">III", num2, length2, secret) + random_char.encode()
-    message = header.getBytes() + payload
-
-    client_socket.sendto(message, client_address)
-    stageD(server, tcp_socket, client_socket, client_address, payload)
-
-
-def stageD(
-    server,
-    tcp_socket: socket.socket,
-    client_socket: socket.socket,
-    client_address,
-    payload,
-) -> None:
+    log.debug("connected", "C", client=client_address)
+    try:
+        perform(server, session.connected(), client_socket.sendall)
+        server.observeStage("C", time.monotonic() - started)
+        stageD(server, session, client_socket, client_address)
+    finally:
+        client_socket.close()
+
+
+def stageD(server, session, client_socket: socket.socket, client_address) -> None:
     """Server logic for Stage D.
 
     Args:
         server (Server): Server object.
-        tcp_socket (socket.socket): TCP socket created in Stage B.
-        client_socket (socket.socket): Client socket that made a connection to TCP socket in Stage C.
+        session (ServerSession): Session state machine, in Stage D.
+        client_socket (socket.socket): Client socket that made a connection to TCP socket
+            in Stage C. Closed by Stage C.
         client_address (_RetAddress): Client return address.
-        payload (bytes): Payload byte message sent to client in Stage C.
     """
+    # need to receive num valid messages from client
+    started = time.monotonic()
+    deadline = watch(server, client_socket)
+    try:
+        completed = receiveStageD(server, session, client_socket, deadline)
+    finally:
+        deadline.cancel()
+    if not completed:
+        return
 
-    # unpack message sent to client in stage D.
-    num2, length2, secretC, char = struct.unpack(">IIIc", payload)
+    server.getLogger().debug("completed", "D", client=client_address)
+    server.observeStage("D", time.monotonic() - started)
 
-    # setup expected data
-    ack = 0
-    header_length = 12
-    expected_length = calculateAligndLength(server.getByteAlign(), length2)
-    expected_payload = char * length2
-    read_size = header_length + expected_length
 
-    # need to receive num valid messages from client
-    print(f"Listening for {num2} messages from client in Stage D...")
-    while ack < num2:
-        # have a chance to read stacked data from client.
-        # only read what is expected at one time
-        # leave the rest in the buffer to read later.
-        try:
-            response = client_socket.recv(read_size)
-        except socket.timeout:
-            print(f"Socket timed out waiting for {num2} messages from client...")
-            client_socket.close()
-            tcp_socket.close()
-            return
-        # unpack client response
-        payload_len, p_secret, step, student_id = struct.unpack(
-            ">IIHH", response[:header_length]
-        )
-        client_payload = response[header_length : header_length + payload_len]
+def receiveStageD(server, session, client_socket, deadline) -> bool:
+    """Feed the Stage D stream to the session until it completes or fails.
 
-        # validate client message
-        if not validateHeader(server, student_id, step):
-            print("Invalid header in Stage D.")
-            return
-        elif p_secret != secretC:
-            print("Secret mismatch in Stage D.")
-            return
-        elif payload_len != length2:
-            print("Payload length mismatch in Stage D.")
-            return
-        elif expected_payload != client_payload:
-            print(
-                f"Payload mismatch, expected \n{expected_payload}\n but got \n{client_payload}\n..."
-            )
-            return
-        elif len(response) != header_length + expected_length:
-            print(
-                f"Message length mismatch, expected {header_length + expected_length} got {len(response)}"
-            )
-            return
+    Args:
+        server (Server): Server object.
+        session (ServerSession): Session state machine, in Stage D.
+        client_socket (socket.socket): Client socket connected in Stage C.
+        deadline (Deadline): Stage D idle deadline.
 
-        # successful validation
-        # increment ack number
-        ack = ack + 1
-    print(f"Successfully validated {num2} messages.")
-    print("Sending response message.\n")
+    Returns:
+        bool: True if every message arrived and the final secret was sent.
+    """
+    log = server.getLogger()
+    # TCP may split a message or coalesce several, the session validates whatever
+    # arrives so one fixed buffer is enough however long the messages are
+    buffer = bytearray(server.getStageDBufferSize())
+    view = memoryview(buffer)
+    bytes_in = 0
+    try:
+        while session.getState() == STAGE_D:
+            received = client_socket.recv_into(view)
+            if deadline.expired():
+                log.info("stage_timeout", "D", acked=session.getReceived())
+                session.timeout()
+                return False
+            if received == 0:
+                log.info("closed_early", "D", acked=session.getReceived())
+                session.fail("stage_d_closed")
+                return False
+            deadline.touch()
+            bytes_in = bytes_in + received
+
+            if not perform(server, session.feed(view[:received]), client_socket.sendall):
+                return False
+        return True
+    finally:
+        view.release()
+        server.addStat("bytes_in", bytes_in)
+
+
+def main() -> None:
+    """Parse command line options and start the chosen server backend."""
+    parser = argparse.ArgumentParser(description="CSE 461 Project 1 server.")
+    parser.add_argument("--address", default="localhost", help="Server address.")
+    parser.add_argument("--port", type=int, default=12235, help="Stage A port.")
+    parser.add_argument(
+        "--mode",
+        choices=("thread", "async"),
+        default="thread",
+        help="thread spawns one thread per client, async drives every client from one event loop.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Fork this many worker processes sharing the Stage A port with SO_REUSEPORT.",
+    )
+    parser.add_argument(
+        "--stage-b-sockets",
+        type=int,
+        default=0,
+        help="Serve Stage B for every session from this many shared UDP sockets (thread mode).",
+    )
+    parser.add_argument(
+        "--port-pool",
+        type=int,
+        default=0,
+        help="Keep this many pre-bound UDP and TCP sockets warm for Stages B and C.",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=1,
+        help="Accept Stage B packets up to this many ahead of the next expected one.",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=0,
+        help="Serve at most this many sessions at once, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--session-queue",
+        type=int,
+        default=0,
+        help="Stage A requests that may wait for a free session before new ones are dropped (thread mode).",
+    )
+    parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        default=1.0,
+        help="Drop Stage A requests that waited longer than this many seconds (thread mode).",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0,
+        help="Stage A requests per second allowed from each client host, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--rate-burst",
+        type=int,
+        default=10,
+        help="Stage A requests a client host may send back to back.",
+    )
+    parser.add_argument(
+        "--resume-ttl",
+        type=float,
+        default=0,
+        help="Seconds a client may resume a session at Stage C after it failed, 0 to disable.",
+    )
+    parser.add_argument(
+        "--max-length",
+        type=int,
+        default=128,
+        help="Largest Stage B and D payload length, Stage B is capped to fit in a datagram.",
+    )
+    parser.add_argument(
+        "--log-level", choices=tuple(LEVELS), default="info", help="Lowest level logged."
+    )
+    parser.add_argument(
+        "--stage-log-level",
+        type=parseStageLevels,
+        default={},
+        help="Per stage levels overriding --log-level, like B=debug,D=warning.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="Serve metrics as text on this localhost port, worker N uses port + N.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write a JSON metrics snapshot to this file every 5 seconds, worker N adds .N.",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        default=None,
+        help="Profile every stage and write the profiles to DIR on shutdown, worker N uses DIR/N.",
+    )
+    parser.add_argument(
+        "--profile-allocations",
+        action="store_true",
+        help="With --profile, also report the lines allocating the most in each stage.",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Record every datagram and segment to FILE for replay.py, worker N uses FILE.N.",
+    )
+    args = parser.parse_args()
+    if args.trace and args.mode == "async":
+        parser.error("--trace records the sockets of the threaded server, use --mode thread")
+
+    options = serverOptions(args)
+    if args.workers > 0:
+        import workers
+
+        workers.start(options, args.workers, args.mode)
+    elif args.mode == "async":
+        import async_server
+
+        async_server.start(server=Server(**options))
+    else:
+        start(server=Server(**options))
 
-    # generate final secret message
-    header = Header(4, secretC, step=3, student_id=server.getId())
-    secret = random.randint(1, 10000)
-    message = header.getBytes() + struct.pack(">I", secret)
 
-    client_socket.sendto(message, client_address)
+def serverOptions(args) -> dict:
+    """Server keyword arguments from the parsed command line options.
 
-    # TODO: should we wait for client to receive message before closing socket?
-    # print("Final secret ", secret)
-    client_socket.close()
-    tcp_socket.close()
+    Args:
+        args (argparse.Namespace): Parsed options.
+
+    Returns:
+        dict: Keyword arguments for Server.
+    """
+    return {
+        "server_address": args.address,
+        "port": args.port,
+        "stage_b_sockets": args.stage_b_sockets,
+        "port_pool_size": args.port_pool,
+        "stage_b_window": args.window,
+        "max_sessions": args.max_sessions,
+        "session_queue": args.session_queue,
+        "queue_timeout": args.queue_timeout,
+        "rate_limit": args.rate_limit,
+        "rate_burst": args.rate_burst,
+        "resume_ttl": args.resume_ttl,
+        "max_length": args.max_length,
+        "log_level": args.log_level,
+        "stage_log_levels": args.stage_log_level,
+        "metrics_port": args.metrics_port,
+        "metrics_file": args.metrics_file,
+        "profile_dir": args.profile,
+        "profile_allocations": args.profile_allocations,
+        "trace_file": args.trace,
+    }
 
 
 if __name__ == "__main__":
-    start()
+    main()
@@ -1,19 +1,186 @@
+import collections
+import os
+import random
+import socket
+import sys
+import threading
+from logger import Logger
+from metrics import Metrics
+from rate_limiter import RateLimiter
+from session_cache import SessionCache
+from timer_wheel import TimerWheel
+from session_trace import TraceWriter, TracingTransport
+from transport import KernelTransport
+
+# the stage profiler is shared with the clients of both parts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from protocol.profiler import Profiler  # noqa: E402
+
+# largest UDP payload, Stage B packets have to fit in one datagram
+MAX_DATAGRAM = 65507
+
+
 class Server:
-    def __init__(self, server_address="localhost", port=12235, byte_align=4) -> None:
+    # every session reads its options through getters, and CPython stops specializing
+    # attribute lookups on instances with 30 or more attributes in a plain __dict__
+    __slots__ = (
+        "_server_address",
+        "_default_port",
+        "_byte_align",
+        "_max_length",
+        "_max_stage_b_length",
+        "_read_size",
+        "_stage_d_buffer_size",
+        "_stage_timeout",
+        "_transport",
+        "_trace",
+        "_logger",
+        "_timer_wheel",
+        "_lower_port",
+        "_upper_port",
+        "_student_id",
+        "_reuse_port",
+        "_stage_b_sockets",
+        "_stage_b_mux",
+        "_stage_b_window",
+        "_max_sessions",
+        "_session_queue",
+        "_queue_timeout",
+        "_rate_limiter",
+        "_session_cache",
+        "_port_allocator",
+        "_metrics",
+        "_metrics_port",
+        "_metrics_file",
+        "_profiler",
+        "main_socket",
+    )
+
+    def __init__(
+        self,
+        server_address="localhost",
+        port=12235,
+        byte_align=4,
+        reuse_port=False,
+        stage_b_sockets=0,
+        port_pool_size=0,
+        stage_b_window=1,
+        max_sessions=0,
+        session_queue=0,
+        queue_timeout=1.0,
+        rate_limit=0,
+        rate_burst=10,
+        resume_ttl=0,
+        max_length=128,
+        log_level="info",
+        stage_log_levels=None,
+        log_stream=None,
+        metrics_port=0,
+        metrics_file=None,
+        profile_dir=None,
+        profile_allocations=False,
+        transport=None,
+        trace_file=None,
+    ) -> None:
         """Server constructor
 
         Args:
             server_address (str, optional): Server address that this server object should bind to. Defaults to 'localhost'.
             port (int, optional): Port that this server should listen on. Defaults to 12235.
             byte_align (int, optional): Byte alignment for system. Defaults to 4.
+            reuse_port (bool, optional): Bind the listening port with SO_REUSEPORT so
+                several worker processes can share it. Defaults to False.
+            stage_b_sockets (int, optional): Number of shared UDP sockets serving Stage B
+                for every session. Each session binds its own socket when 0. Defaults to 0.
+            port_pool_size (int, optional): Number of pre-bound UDP and TCP sockets kept
+                warm for Stages B and C. Defaults to 0.
+            stage_b_window (int, optional): How many Stage B packets past the next expected
+                one a client may have in flight. 1 is strict stop-and-wait. Defaults to 1.
+            max_sessions (int, optional): Most sessions served at once. Unbounded, with a
+                thread per session, when 0. Defaults to 0.
+            session_queue (int, optional): Stage A requests allowed to wait for a free
+                session slot before new ones are dropped. Defaults to 0.
+            queue_timeout (float, optional): Seconds a Stage A request may wait for a slot.
+                The client has resent it by then, so older requests are dropped. Defaults to 1.0.
+            rate_limit (float, optional): Stage A requests per second allowed from each
+                client host. No limit when 0. Defaults to 0.
+            rate_burst (int, optional): Stage A requests a client host may send back to
+                back before rate_limit applies. Defaults to 10.
+            resume_ttl (float, optional): Seconds a client may resume a session at Stage C
+                after a Stage C or D failure. Tokens are not issued when 0. Defaults to 0.
+            max_length (int, optional): Largest Stage B and D payload length sent to
+                clients. Stage B lengths are also capped so a packet fits in one
+                datagram. Defaults to 128.
+            log_level (str, optional): Lowest level logged, "debug", "info", "warning"
+                or "error". Defaults to "info".
+            stage_log_levels (dict, optional): Stage name ("A" to "D") to the lowest
+                level logged for that stage, overriding log_level. Defaults to None.
+            log_stream (file, optional): Where the log is written. Defaults to the
+                sys.stdout of when the server is created.
+            metrics_port (int, optional): Local port serving metrics as text over HTTP,
+                not served when 0. Defaults to 0.
+            metrics_file (str, optional): File a JSON metrics snapshot is written to every
+                few seconds, not written when None. Defaults to None.
+            profile_dir (str, optional): Directory per stage profiles are written to when
+                the server stops. Stages are not profiled when None. Defaults to None.
+            profile_allocations (bool, optional): Also report the lines allocating the
+                most in each stage, only used with profile_dir. Defaults to False.
+            transport (KernelTransport | LoopbackTransport, optional): Creates every
+                socket the server uses. Real sockets when None. Defaults to None.
+            trace_file (str, optional): File every datagram and segment the server
+                sends or receives is recorded to, for replay.py. Not recorded when
+                None. Defaults to None.
         """
         self._server_address = server_address
         self._default_port = port
-        self._read_size = 1024
+        self._byte_align = byte_align
+        self._max_length = max(max_length, 32)
+        # Stage B packets carry a header and an ack number before the aligned payload
+        self._max_stage_b_length = min(
+            self._max_length, (MAX_DATAGRAM - 16) // byte_align * byte_align
+        )
+        self._read_size = max(1024, 16 + self._max_stage_b_length + byte_align)
+        self._stage_d_buffer_size = 65536
+        # a session stage ends once the client is silent this many seconds
+        self._stage_timeout = 3
+        self._transport = transport or KernelTransport()
+        self._trace = None
+        if trace_file:
+            self._trace = TraceWriter(trace_file, "server")
+            self._transport = TracingTransport(self._transport, self._trace)
+        self._logger = Logger(log_level, stage_log_levels, stream=log_stream)
+        self._timer_wheel = TimerWheel(self._logger)
         self._lower_port = 49152
         self._upper_port = 65535
-        self._byte_align = byte_align
         self._student_id = 246
+        self._reuse_port = reuse_port
+        self._stage_b_sockets = stage_b_sockets
+        self._stage_b_mux = None
+        self._stage_b_window = stage_b_window
+        self._max_sessions = max_sessions
+        self._session_queue = session_queue
+        self._queue_timeout = queue_timeout
+        self._rate_limiter = None
+        if rate_limit > 0:
+            self._rate_limiter = RateLimiter(rate_limit, rate_burst)
+        self._session_cache = None
+        if resume_ttl > 0:
+            self._session_cache = SessionCache(resume_ttl)
+        self._port_allocator = PortAllocator(
+            server_address,
+            self._lower_port,
+            self._upper_port,
+            port_pool_size,
+            self._transport,
+        )
+        # counters, including the session stats, and per stage latency histograms
+        self._metrics = Metrics()
+        self._metrics_port = metrics_port
+        self._metrics_file = metrics_file
+        self._profiler = None
+        if profile_dir:
+            self._profiler = Profiler(profile_dir, profile_allocations)
         self.main_socket = None
 
     def getId(self) -> int:
@@ -31,8 +198,254 @@ class Server:
     def getReadSize(self) -> int:
         return self._read_size
 
+    def getMaxLength(self) -> int:
+        return self._max_length
+
+    def getMaxStageBLength(self) -> int:
+        return self._max_stage_b_length
+
+    def getStageDBufferSize(self) -> int:
+        return self._stage_d_buffer_size
+
+    def getStageTimeout(self) -> float:
+        return self._stage_timeout
+
+    def getTimerWheel(self):
+        return self._timer_wheel
+
+    def getTransport(self):
+        return self._transport
+
+    def getTrace(self):
+        return self._trace
+
+    def getLogger(self):
+        return self._logger
+
+    def getMetrics(self):
+        return self._metrics
+
+    def getMetricsPort(self) -> int:
+        return self._metrics_port
+
+    def getMetricsFile(self):
+        return self._metrics_file
+
+    def getProfiler(self):
+        return self._profiler
+
     def getLowerPort(self) -> int:
         return self._lower_port
 
     def getUpperPort(self) -> int:
         return self._upper_port
+
+    def getReusePort(self) -> bool:
+        return self._reuse_port
+
+    def getPortAllocator(self):
+        return self._port_allocator
+
+    def getStageBWindow(self) -> int:
+        return self._stage_b_window
+
+    def getMaxSessions(self) -> int:
+        return self._max_sessions
+
+    def getSessionQueue(self) -> int:
+        return self._session_queue
+
+    def getQueueTimeout(self) -> float:
+        return self._queue_timeout
+
+    def getRateLimiter(self):
+        return self._rate_limiter
+
+    def getSessionCache(self):
+        return self._session_cache
+
+    def getStageBSockets(self) -> int:
+        return self._stage_b_sockets
+
+    def getStageBMux(self):
+        return self._stage_b_mux
+
+    def setStageBMux(self, mux) -> None:
+        self._stage_b_mux = mux
+
+    def addStat(self, name: str, amount=1) -> None:
+        """Increment a session counter, safe to call from any session thread.
+
+        Args:
+            name (str): Counter name.
+            amount (int, optional): Amount to add. Defaults to 1.
+        """
+        self._metrics.count(name, amount)
+
+    def addFailure(self, reason: str) -> None:
+        """Count a session that failed, by reason like stage_b_timeout.
+
+        Args:
+            reason (str): Why the session failed.
+        """
+        self._metrics.count(f"failures_{reason}")
+
+    def observeStage(self, stage: str, seconds: float) -> None:
+        """Record how long a session spent in a stage.
+
+        Args:
+            stage (str): Stage name, "A" to "D".
+            seconds (float): Time from the start of the stage to the server's response.
+        """
+        self._metrics.observe(f"stage_{stage.lower()}_seconds", seconds)
+
+    def getStats(self) -> dict:
+        """Returns a snapshot copy of the session counters.
+
+        Returns:
+            dict: Counter name to value.
+        """
+        stats = {"sessions_started": 0, "sessions_completed": 0}
+        stats.update(self._metrics.snapshot()["counters"])
+        return stats
+
+
+class PortAllocator:
+    def __init__(
+        self,
+        server_address: str,
+        lower_port: int,
+        upper_port: int,
+        pool_size=0,
+        transport=None,
+    ) -> None:
+        """Hands out bound UDP and listening TCP sockets for Stages B and C.
+
+        Ports held by this allocator are tracked so two sessions never pick the same
+        port, and binds that still collide with other processes are retried. Released
+        sockets are kept in a warm pool of up to pool_size sockets per protocol and
+        handed out again without another bind.
+
+        Args:
+            server_address (str): Address to bind sockets to.
+            lower_port (int): Lowest port to hand out.
+            upper_port (int): Highest port to hand out.
+            pool_size (int, optional): Sockets per protocol kept bound and ready. Defaults to 0.
+            transport (KernelTransport | LoopbackTransport, optional): Creates the
+                sockets. Real sockets when None. Defaults to None.
+        """
+        self._server_address = server_address
+        self._lower_port = lower_port
+        self._upper_port = upper_port
+        self._pool_size = pool_size
+        self._transport = transport or KernelTransport()
+        self._in_use = set()
+        self._pools = {
+            socket.SOCK_DGRAM: collections.deque(),
+            socket.SOCK_STREAM: collections.deque(),
+        }
+        self._lock = threading.Lock()
+
+    def warm(self) -> None:
+        """Pre-bind pool_size UDP and TCP sockets."""
+        for kind, pool in self._pools.items():
+            for _ in range(self._pool_size - len(pool)):
+                entry = self.bind(kind)
+                with self._lock:
+                    pool.append(entry)
+
+    def acquireUdp(self):
+        """Returns a bound UDP socket.
+
+        Returns:
+            (int, socket.socket): Port and socket bound to it.
+        """
+        return self.acquire(socket.SOCK_DGRAM)
+
+    def acquireTcp(self):
+        """Returns a bound TCP socket that is already listening.
+
+        Returns:
+            (int, socket.socket): Port and socket bound to it.
+        """
+        return self.acquire(socket.SOCK_STREAM)
+
+    def acquire(self, kind: int):
+        with self._lock:
+            pool = self._pools[kind]
+            if pool:
+                return pool.popleft()
+        return self.bind(kind)
+
+    def release(self, port: int, sock: socket.socket) -> None:
+        """Return a socket once its session is done with it.
+
+        Args:
+            port (int): Port the socket is bound to.
+            sock (socket.socket): Socket from acquireUdp or acquireTcp.
+        """
+        if sock.fileno() != -1:
+            # throw away anything a late client left on the socket
+            drain(sock)
+        with self._lock:
+            pool = self._pools[sock.type]
+            if sock.fileno() != -1 and len(pool) < self._pool_size:
+                pool.append((port, sock))
+                return
+            self._in_use.discard(port)
+        sock.close()
+
+    def bind(self, kind: int):
+        """Bind a new socket on a random port not held by this allocator.
+
+        Args:
+            kind (int): socket.SOCK_DGRAM or socket.SOCK_STREAM.
+
+        Raises:
+            OSError: Could not find a free port.
+
+        Returns:
+            (int, socket.socket): Port and socket bound to it.
+        """
+        for _ in range(self._upper_port - self._lower_port + 1):
+            with self._lock:
+                port = random.randint(self._lower_port, self._upper_port)
+                if port in self._in_use:
+                    continue
+                self._in_use.add(port)
+
+            if kind == socket.SOCK_DGRAM:
+                sock = self._transport.udp()
+            else:
+                sock = self._transport.tcp()
+            try:
+                sock.bind((self._server_address, port))
+                if kind == socket.SOCK_STREAM:
+                    sock.listen()
+            except OSError:
+                # port is taken by another process, try another one
+                sock.close()
+                with self._lock:
+                    self._in_use.discard(port)
+                continue
+            return port, sock
+        raise OSError("No free port left in range.")
+
+
+def drain(sock: socket.socket) -> None:
+    """Discard queued datagrams or pending connections without blocking.
+
+    Args:
+        sock (socket.socket): Socket to drain.
+    """
+    sock.setblocking(False)
+    try:
+        while True:
+            if sock.type == socket.SOCK_STREAM:
+                sock.accept()[0].close()
+            else:
+                sock.recv(65535)
+    except OSError:
+        pass
+    # stages block on pooled sockets until their deadline shuts them down
+    sock.setblocking(True)
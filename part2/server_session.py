@@ -0,0 +1,753 @@
+import random
+from header import (
+    ACK,
+    HEADER,
+    HEADER_SIZE,
+    STAGE_B_HEADER,
+    ErrorReply,
+    Header,
+    ResumeToken,
+    StageAResponse,
+    StageBAck,
+    StageBResponse,
+    StageCResponse,
+    StageDFinal,
+    calculateAligndLength,
+)
+from logger import dump
+
+# actions returned by ServerSession, each one is a (kind, value) tuple
+# reply to the peer of the last input with value
+SEND = "send"
+# bind a UDP port for Stage B and report it with bound()
+BIND_UDP = "bind_udp"
+# start listening on a TCP port for Stage C and report it with bound()
+BIND_TCP = "bind_tcp"
+# the session finished, value is None
+DONE = "done"
+# the session failed, value is the reason
+FAIL = "fail"
+
+# session states
+STAGE_A = "A"
+BINDING_UDP = "binding_udp"
+STAGE_B = "B"
+BINDING_TCP = "binding_tcp"
+STAGE_C = "C"
+STAGE_D = "D"
+CLOSED = "closed"
+
+# methods replaced by profiled wrappers in --profile mode, to their stage
+STAGES = {
+    "feedStageA": "A",
+    "resume": "resume",
+    "feedStageB": "B",
+    "connected": "C",
+    "feedStageD": "D",
+}
+
+
+def checkHeader(server, id: int, step: int, stage=None) -> int:
+    """Function to check student id and step in client header.
+
+    The stage checks compare id and step inline and only call this for a header
+    that failed, so the per-packet success path makes no extra call.
+
+    Args:
+        server (Server): server object to check id and step on
+        id (int): client student to validate
+        step (int): client step to validate
+        stage (str, optional): Stage the header was sent in, for the log. Defaults to None.
+
+    Returns:
+        int: 0 if stduent id and step match expected values, otherwise an ErrorReply code
+    """
+
+    if server.getId() != id:
+        server.getLogger().warning("wrong_id", stage, got=id, expected=server.getId())
+        return ErrorReply.WRONG_ID
+    # client always sends a header with step == 1
+    elif step != 1:
+        server.getLogger().warning("wrong_step", stage, got=step, expected=1)
+        return ErrorReply.WRONG_STEP
+    return 0
+
+
+def validateHeader(server, id: int, step: int) -> bool:
+    """Function to validate student id and step in client header.
+
+    Args:
+        server (Server): server object to check id and step on
+        id (int): client student to validate
+        step (int): client step to validate
+
+    Returns:
+        bool: returns True if stduent id and step match expected values
+    """
+    # client always sends a header with step == 1
+    if server.getId() == id and step == 1:
+        return True
+    # only a failing header is handed to checkHeader to be logged
+    return checkHeader(server, id, step) == 0
+
+
+# payloads are compared against one cached block per fill byte, a block at a time
+PAYLOAD_BLOCK_SIZE = 65536
+_payload_blocks = {}
+
+
+def payloadBlock(char: bytes) -> bytes:
+    """Returns the cached block of char repeated PAYLOAD_BLOCK_SIZE times.
+
+    Args:
+        char (bytes): Single fill byte.
+
+    Returns:
+        bytes: Block to compare payloads against.
+    """
+    block = _payload_blocks.get(char)
+    if block is None:
+        block = _payload_blocks.setdefault(char, char * PAYLOAD_BLOCK_SIZE)
+    return block
+
+
+def matchesPayload(payload, char: bytes) -> bool:
+    """Function to check that every byte of a payload is char, without building an
+    expected payload of the same size to compare against.
+
+    Args:
+        payload (bytes | memoryview): Payload to check, of any length.
+        char (bytes): Single byte the payload should be filled with.
+
+    Returns:
+        bool: True if every byte of payload is char.
+    """
+    block = payloadBlock(char)
+    if len(payload) <= PAYLOAD_BLOCK_SIZE:
+        # every Stage B packet and most Stage D chunks fit in one block
+        return block.startswith(payload)
+    view = memoryview(payload)
+    for offset in range(0, len(view), PAYLOAD_BLOCK_SIZE):
+        # startswith compares with memcmp and takes the chunk without copying it
+        if not block.startswith(view[offset : offset + PAYLOAD_BLOCK_SIZE]):
+            return False
+    return True
+
+
+def errorReply(server, code: int, stage: int) -> bytearray:
+    """Build the message telling a client which check its message failed.
+
+    Args:
+        server (Server): Server object.
+        code (int): ErrorReply code.
+        stage (int): Stage the check failed in, 0 for A through 3 for D.
+
+    Returns:
+        bytearray: Message ready to send.
+    """
+    header = Header(ErrorReply.getSize(), 0, ErrorReply.STEP, server.getId())
+    return ErrorReply(code, stage).encode(header)
+
+
+HELLO_WORLD = b"hello world\0"
+
+
+def checkStageA(server, message: bytes) -> int:
+    """Function to check the client inital Stage A message.
+
+    Args:
+        server (Server): Server object.
+        message (bytes): Inital byte message from client.
+
+    Returns:
+        int: 0 if message passed all Stage A validations, otherwise an ErrorReply code
+    """
+    if len(message) < HEADER_SIZE:
+        server.getLogger().warning("short_message", "A", length=len(message))
+        return ErrorReply.WRONG_LENGTH
+
+    payload_len, p_secret, step, student_id = HEADER.unpack_from(message)
+    # compare through a view so the payload is never copied
+    client_payload = memoryview(message)[HEADER_SIZE : HEADER_SIZE + payload_len]
+    aligned_payload_len = calculateAligndLength(server.getByteAlign(), len(HELLO_WORLD))
+
+    if student_id != server.getId() or step != 1:
+        return checkHeader(server, student_id, step, "A")
+    elif client_payload != HELLO_WORLD:
+        server.getLogger().warning("wrong_payload", "A", payload=dump(client_payload))
+        return ErrorReply.WRONG_PAYLOAD
+    elif len(message) != HEADER_SIZE + aligned_payload_len:
+        server.getLogger().warning(
+            "wrong_length", "A", got=len(message), expected=HEADER_SIZE + aligned_payload_len
+        )
+        return ErrorReply.WRONG_LENGTH
+    # stage A secret is always 0
+    elif p_secret != 0:
+        server.getLogger().warning("wrong_secret", "A", got=p_secret, expected=0)
+        return ErrorReply.WRONG_SECRET
+    return 0
+
+
+def validateStageA(server, message: bytes) -> bool:
+    """Function to validate the client inital Stage A message.
+
+    Args:
+        server (Server): Server object.
+        message (bytes): Inital byte message from client.
+
+    Returns:
+        bool: returns True if message passed all Stage A validations
+    """
+    return checkStageA(server, message) == 0
+
+
+def checkStageB(server, response: bytes, length: int, secretB: int):
+    """Function to check a single client Stage B packet.
+
+    Ack ordering is left to the caller since it depends on session state.
+
+    Args:
+        server (Server): Server object.
+        response (bytes): Client Stage B packet.
+        length (int): Payload length sent to client in Stage A.
+        secretB (int): Secret sent to client in Stage A.
+
+    Returns:
+        (int, int | None): 0 and the client ack number if packet is valid, otherwise
+            an ErrorReply code and None.
+    """
+    header_length = STAGE_B_HEADER.size
+    expected_length = header_length + calculateAligndLength(
+        server.getByteAlign(), length
+    )
+    if len(response) < header_length:
+        server.getLogger().warning("short_message", "B", length=len(response))
+        return ErrorReply.WRONG_LENGTH, None
+
+    # get header info plus client ack number
+    payload_length, p_secret, step, student_id, ack_num = STAGE_B_HEADER.unpack_from(
+        response
+    )
+    # get payload of zeros of length payload_length
+    payload = memoryview(response)[header_length : header_length + payload_length - 4]
+
+    if student_id != server.getId() or step != 1:
+        return checkHeader(server, student_id, step, "B"), None
+    elif p_secret != secretB:
+        server.getLogger().warning("wrong_secret", "B", got=p_secret, expected=secretB)
+        return ErrorReply.WRONG_SECRET, None
+    elif len(response) != expected_length:
+        server.getLogger().warning(
+            "wrong_length", "B", got=len(response), expected=expected_length
+        )
+        return ErrorReply.WRONG_LENGTH, None
+    elif length + 4 != payload_length:
+        server.getLogger().warning(
+            "wrong_payload_length", "B", got=payload_length, expected=length + 4
+        )
+        return ErrorReply.WRONG_LENGTH, None
+    elif not matchesPayload(payload, b"\0"):
+        server.getLogger().warning("wrong_payload", "B", expected="zeros", payload=dump(payload))
+        return ErrorReply.WRONG_PAYLOAD, None
+    return 0, ack_num
+
+
+def validateStageB(server, response: bytes, length: int, secretB: int):
+    """Function to validate a single client Stage B packet.
+
+    Ack ordering is left to the caller since it depends on session state.
+
+    Args:
+        server (Server): Server object.
+        response (bytes): Client Stage B packet.
+        length (int): Payload length sent to client in Stage A.
+        secretB (int): Secret sent to client in Stage A.
+
+    Returns:
+        int | None: Client ack number if packet is valid, None otherwise.
+    """
+    return checkStageB(server, response, length, secretB)[1]
+
+
+def checkStageDHeader(server, header, secretC: int, length2: int) -> int:
+    """Function to check the header of a single client Stage D message.
+
+    Args:
+        server (Server): Server object.
+        header (bytes | memoryview): At least the first HEADER_SIZE bytes of the message.
+        secretC (int): Secret sent to client in Stage B.
+        length2 (int): Payload length sent to client in Stage C.
+
+    Returns:
+        int: 0 if the header passed all Stage D validations, otherwise an ErrorReply code
+    """
+    payload_len, p_secret, step, student_id = HEADER.unpack_from(header)
+
+    if student_id != server.getId() or step != 1:
+        return checkHeader(server, student_id, step, "D")
+    elif p_secret != secretC:
+        server.getLogger().warning("wrong_secret", "D", got=p_secret, expected=secretC)
+        return ErrorReply.WRONG_SECRET
+    elif payload_len != length2:
+        server.getLogger().warning("wrong_payload_length", "D", got=payload_len, expected=length2)
+        return ErrorReply.WRONG_LENGTH
+    return 0
+
+
+def checkStageD(
+    server, response: bytes, secretC: int, length2: int, char: bytes
+) -> int:
+    """Function to check a single client Stage D message.
+
+    Args:
+        server (Server): Server object.
+        response (bytes): Client Stage D message.
+        secretC (int): Secret sent to client in Stage B.
+        length2 (int): Payload length sent to client in Stage C.
+        char (bytes): Payload character sent to client in Stage C.
+
+    Returns:
+        int: 0 if message passed all Stage D validations, otherwise an ErrorReply code
+    """
+    expected_length = calculateAligndLength(server.getByteAlign(), length2)
+    if len(response) < HEADER_SIZE:
+        server.getLogger().warning("short_message", "D", length=len(response))
+        return ErrorReply.WRONG_LENGTH
+
+    payload = memoryview(response)[HEADER_SIZE : HEADER_SIZE + length2]
+    code = checkStageDHeader(server, response, secretC, length2)
+    if code:
+        return code
+    elif not matchesPayload(payload, char):
+        server.getLogger().warning("wrong_payload", "D", expected=char, payload=dump(payload))
+        return ErrorReply.WRONG_PAYLOAD
+    elif len(response) != HEADER_SIZE + expected_length:
+        server.getLogger().warning(
+            "wrong_length", "D", got=len(response), expected=HEADER_SIZE + expected_length
+        )
+        return ErrorReply.WRONG_LENGTH
+    return 0
+
+
+def validateStageD(
+    server, response: bytes, secretC: int, length2: int, char: bytes
+) -> bool:
+    """Function to validate a single client Stage D message.
+
+    Args:
+        server (Server): Server object.
+        response (bytes): Client Stage D message.
+        secretC (int): Secret sent to client in Stage B.
+        length2 (int): Payload length sent to client in Stage C.
+        char (bytes): Payload character sent to client in Stage C.
+
+    Returns:
+        bool: returns True if message passed all Stage D validations
+    """
+    return checkStageD(server, response, secretC, length2, char) == 0
+
+
+class StageDStream:
+    __slots__ = ("_server", "_stageC_response", "_aligned", "_header", "_remaining", "_acked")
+
+    def __init__(self, server, stageC_response) -> None:
+        """Validates the Stage D stream as it arrives, however TCP splits or coalesces it.
+
+        Headers are gathered in a small buffer and checked once complete. Payload bytes
+        are checked against the cached payload block as they arrive, so a message is
+        never held whole and length2 can be megabytes.
+
+        Args:
+            server (Server): Server object.
+            stageC_response (StageCResponse): Payload sent to client in Stage C.
+        """
+        self._server = server
+        self._stageC_response = stageC_response
+        self._aligned = calculateAligndLength(server.getByteAlign(), stageC_response.length2)
+        self._header = bytearray()
+        # bytes of the current message still to come, its payload then any padding
+        self._remaining = 0
+        self._acked = 0
+
+    def getAcked(self) -> int:
+        """Returns the number of complete, valid messages received so far."""
+        return self._acked
+
+    def feed(self, data) -> int:
+        """Validate the next bytes of the stream.
+
+        Args:
+            data (bytes | memoryview): Bytes received from the client.
+
+        Returns:
+            int: 0 while the stream is valid, otherwise an ErrorReply code.
+        """
+        num2, length2, secretC, char = self._stageC_response.fields()
+        view = memoryview(data)
+        position = 0
+        while position < len(view) and self._acked < num2:
+            if self._remaining == 0:
+                taken = min(HEADER_SIZE - len(self._header), len(view) - position)
+                self._header.extend(view[position : position + taken])
+                position = position + taken
+                if len(self._header) < HEADER_SIZE:
+                    break
+                code = checkStageDHeader(self._server, self._header, secretC, length2)
+                if code:
+                    return code
+                self._header.clear()
+                self._remaining = self._aligned
+                continue
+
+            taken = min(self._remaining, len(view) - position)
+            # alignment padding after the payload is not checked
+            payload_left = max(length2 - (self._aligned - self._remaining), 0)
+            checked = min(taken, payload_left)
+            payload = view[position : position + checked]
+            if checked and not matchesPayload(payload, char):
+                self._server.getLogger().warning(
+                    "wrong_payload", "D", expected=char, payload=dump(payload)
+                )
+                return ErrorReply.WRONG_PAYLOAD
+            position = position + taken
+            self._remaining = self._remaining - taken
+            if self._remaining == 0:
+                self._acked = self._acked + 1
+        return 0
+
+
+def stageBResponse(server, secretB: int, secretC: int, tcp_port: int, client_host: str):
+    """Build the Stage B response, followed by a resumption token when they are enabled.
+
+    Args:
+        server (Server): Server object.
+        secretB (int): Secret sent to client in Stage A.
+        secretC (int): Secret for Stage C.
+        tcp_port (int): TCP port the client connects to in Stage C.
+        client_host (str): Client host, only that host may resume the session.
+
+    Returns:
+        bytearray: Message ready to send.
+    """
+    header = Header(8, secretB, step=1, student_id=server.getId())
+    message = StageBResponse(tcp_port, secretC).encode(header)
+    cache = server.getSessionCache()
+    if cache is not None:
+        # the header does not count the token, clients that do not expect one skip it
+        token = cache.issue(client_host, (secretB, secretC))
+        message.extend(ResumeToken(token, 2).getBytes())
+    return message
+
+
+def checkResume(server, message: bytes, client_host: str):
+    """Function to check a client request to resume a session at Stage C.
+
+    Args:
+        server (Server): Server object.
+        message (bytes): Resume request from client.
+        client_host (str): Client host the request came from.
+
+    Returns:
+        (int, tuple | None, bytes | None): 0, the cached (secretB, secretC) and None if
+            the session may be resumed, or the reply already sent if the request was
+            resent. Otherwise an ErrorReply code, None and None.
+    """
+    log = server.getLogger()
+    if len(message) != HEADER_SIZE + ResumeToken.getSize():
+        log.warning("wrong_length", "C", got=len(message), request="resume")
+        return ErrorReply.WRONG_LENGTH, None, None
+    _, p_secret, _, student_id = HEADER.unpack_from(message)
+    if server.getId() != student_id:
+        log.warning("wrong_id", "C", got=student_id, expected=server.getId())
+        return ErrorReply.WRONG_ID, None, None
+
+    cache = server.getSessionCache()
+    token = ResumeToken.unpackFrom(message).token
+    state = cache.get(token, client_host) if cache is not None else None
+    if state is None:
+        log.warning("wrong_token", "C", token=token)
+        return ErrorReply.WRONG_TOKEN, None, None
+    # the client proves it finished Stage B with the secret it got for Stage C, the
+    # token is only claimed once it did
+    elif p_secret != state[1]:
+        log.warning("wrong_secret", "C", got=p_secret, request="resume")
+        return ErrorReply.WRONG_SECRET, None, None
+    entry = cache.take(token, client_host)
+    if entry is None:
+        # expired since it was looked up
+        log.warning("wrong_token", "C", token=token)
+        return ErrorReply.WRONG_TOKEN, None, None
+    state, reply = entry
+    return 0, state, reply
+
+
+def perform(server, actions: list, send) -> bool:
+    """Send every reply in a list of session actions.
+
+    Args:
+        server (Server): Server object, counts the bytes sent.
+        actions (list): Actions returned by ServerSession.
+        send (callable): Sends bytes to the peer the session last heard from.
+
+    Returns:
+        bool: False if the session failed.
+    """
+    for kind, value in actions:
+        if kind == SEND:
+            send(value)
+            server.addStat("bytes_out", len(value))
+        elif kind == FAIL:
+            return False
+    return True
+
+
+class ServerSession:
+    __slots__ = (
+        "_server",
+        "_host",
+        "_state",
+        "_num",
+        "_length",
+        "_secret",
+        "_next_secret",
+        "_token",
+        "_ack",
+        "_received",
+        "_seen",
+        "_retransmits",
+        "_duplicates",
+        "_ack_message",
+        "_stage_c",
+        "_stream",
+    )
+
+    def __init__(self, server, host=None) -> None:
+        """Server side of one client session, with no sockets, threads or timers.
+
+        The backend reports what happened to the session, bytes it received, a port
+        it bound, the client connecting or a timeout, and gets back a list of actions
+        to carry out. Replies always go to the peer the last input came from.
+
+        Args:
+            server (Server): Server object holding protocol settings and stats.
+            host (str, optional): Client host, only needed for resumption tokens.
+                Defaults to None.
+        """
+        self._server = server
+        self._host = host
+        self._state = STAGE_A
+        self._num = 0
+        self._length = 0
+        self._secret = 0
+        # Stage C secret of a resumed session, random otherwise
+        self._next_secret = None
+        # token this session was resumed with
+        self._token = None
+        self._ack = 0
+        # packets ahead of ack that were already acknowledged, only used with a window
+        self._received = set()
+        # packets that arrived at least once, a repeat is a client retransmit
+        self._seen = None
+        # counted into the server stats once, when the session closes
+        self._retransmits = 0
+        self._duplicates = 0
+        self._ack_message = None
+        self._stage_c = None
+        # validates Stage D however the stream splits or coalesces messages
+        self._stream = None
+
+    def getState(self) -> str:
+        return self._state
+
+    def getNum(self) -> int:
+        return self._num
+
+    def getLength(self) -> int:
+        return self._length
+
+    def getSecret(self) -> int:
+        return self._secret
+
+    def getAck(self) -> int:
+        """Returns the number of Stage B packets acknowledged so far."""
+        return self._ack
+
+    def getReceived(self) -> int:
+        """Returns the number of valid Stage D messages received so far."""
+        return self._stream.getAcked() if self._stream is not None else 0
+
+    def feed(self, data: bytes) -> list:
+        """Handle bytes from the client, a datagram in Stages A and B or a chunk of the
+        stream in Stage D.
+
+        Args:
+            data (bytes): Received bytes.
+
+        Returns:
+            list: Actions to carry out, in order.
+        """
+        if self._state == STAGE_B:
+            return self.feedStageB(data)
+        elif self._state == STAGE_D:
+            return self.feedStageD(data)
+        elif self._state == STAGE_A:
+            return self.feedStageA(data)
+        # nothing is expected while waiting on the backend
+        return []
+
+    def feedStageA(self, data: bytes) -> list:
+        if ResumeToken.isResume(data):
+            return self.resume(data)
+        code = checkStageA(self._server, data)
+        if code:
+            return self.reject(code, 0)
+        self._server.addStat("sessions_started")
+        self._num = random.randint(8, 32)
+        self._length = random.randint(32, self._server.getMaxStageBLength())
+        self._seen = bytearray(self._num)
+        self._state = BINDING_UDP
+        return [(BIND_UDP, None)]
+
+    def resume(self, data: bytes) -> list:
+        """Pick a session up again at Stage C, the next action binds its TCP port."""
+        code, state, reply = checkResume(self._server, data, self._host)
+        if code:
+            return self.reject(code, 2)
+        elif reply is not None:
+            # the client lost our reply and asked again, the session it resumed is
+            # already waiting at Stage C
+            self._server.addStat("resume_replies_resent")
+            self.close()
+            return ([(SEND, reply)] if reply else []) + [(DONE, None)]
+        self._token = ResumeToken.unpackFrom(data).token
+        self._secret, self._next_secret = state
+        self._server.addStat("sessions_resumed")
+        self._state = BINDING_TCP
+        return [(BIND_TCP, None)]
+
+    def feedStageB(self, data: bytes) -> list:
+        code, ack_num = checkStageB(self._server, data, self._length, self._secret)
+        if code:
+            return self.reject(code, 1)
+        elif ack_num >= self._ack + self._server.getStageBWindow() or ack_num >= self._num:
+            self._server.getLogger().warning("wrong_ack", "B", got=ack_num, expected=self._ack)
+            return self.reject(ErrorReply.WRONG_ACK, 1)
+        if self._seen[ack_num]:
+            self._retransmits = self._retransmits + 1
+        self._seen[ack_num] = 1
+        if self._ack > ack_num or ack_num in self._received:
+            # received an old message, keep listening for a new one
+            self._duplicates = self._duplicates + 1
+            return []
+
+        # server randomly decides to send an ack packet
+        if not random.randint(0, 1):
+            return []
+        ACK.pack_into(self._ack_message, HEADER_SIZE, ack_num)
+        actions = [(SEND, bytes(self._ack_message))]
+        self._received.add(ack_num)
+        while self._ack in self._received:
+            self._received.remove(self._ack)
+            self._ack = self._ack + 1
+        if self._ack == self._num:
+            self._state = BINDING_TCP
+            actions.append((BIND_TCP, None))
+        return actions
+
+    def feedStageD(self, data: bytes) -> list:
+        code = self._stream.feed(data)
+        if code:
+            return self.reject(code, 3)
+        if self._stream.getAcked() < self._stage_c.num2:
+            return []
+        header = Header(4, self._stage_c.secret, step=3, student_id=self._server.getId())
+        self.close()
+        self._server.addStat("sessions_completed")
+        return [(SEND, StageDFinal(random.randint(1, 10000)).encode(header)), (DONE, None)]
+
+    def bound(self, port: int, secret=None) -> list:
+        """Handle the backend binding the port asked for by BIND_UDP or BIND_TCP.
+
+        Args:
+            port (int): Bound port.
+            secret (int, optional): Stage A secret to use, for backends that tell
+                sessions on a shared socket apart by secret. Random when None.
+                Defaults to None.
+
+        Returns:
+            list: Actions to carry out, the response announcing the port.
+        """
+        if self._state == BINDING_UDP:
+            self._secret = secret if secret is not None else random.randint(1, 10000)
+            self._ack_message = StageBAck(0).encode(
+                Header(4, self._secret, 1, self._server.getId())
+            )
+            self._state = STAGE_B
+            header = Header(16, 0, step=0, student_id=self._server.getId())
+            response = StageAResponse(self._num, self._length, port, self._secret)
+            return [(SEND, response.encode(header))]
+        elif self._state == BINDING_TCP:
+            secretB = self._secret
+            # the Stage C response carries this secret in its header
+            self._secret = self._next_secret or random.randint(1, 10000)
+            self._state = STAGE_C
+            reply = stageBResponse(self._server, secretB, self._secret, port, self._host)
+            if self._token is not None:
+                # resent resume requests get this reply again
+                self._server.getSessionCache().answer(self._token, bytes(reply))
+            return [(SEND, reply)]
+        return []
+
+    def connected(self) -> list:
+        """Handle the client connecting to the Stage C port.
+
+        Returns:
+            list: Actions to carry out, the Stage C response.
+        """
+        if self._state != STAGE_C:
+            return []
+        num2 = random.randint(8, 32)
+        length2 = random.randint(32, self._server.getMaxLength())
+        secret = random.randint(1, 10000)
+        char = chr(random.randint(ord("a"), ord("z"))).encode()
+        self._stage_c = StageCResponse(num2, length2, secret, char)
+        self._stream = StageDStream(self._server, self._stage_c)
+        self._state = STAGE_D
+        header = Header(13, self._secret, step=2, student_id=self._server.getId())
+        return [(SEND, self._stage_c.encode(header))]
+
+    def timeout(self) -> list:
+        """Handle the client staying silent for longer than the stage timeout.
+
+        Returns:
+            list: Actions to carry out.
+        """
+        if self._state == CLOSED:
+            return []
+        return self.fail(f"stage_{self._state.lower()}_timeout")
+
+    def reject(self, code: int, stage: int) -> list:
+        """Fail the session and tell the client which check its message failed.
+
+        Args:
+            code (int): ErrorReply code.
+            stage (int): Stage the check failed in, 0 for A through 3 for D.
+
+        Returns:
+            list: Actions to carry out.
+        """
+        reply = ErrorReply(code, stage)
+        return [(SEND, errorReply(self._server, code, stage))] + self.fail(reply.getReason())
+
+    def fail(self, reason: str) -> list:
+        self.close()
+        self._server.addFailure(reason)
+        return [(FAIL, reason)]
+
+    def close(self) -> None:
+        self._state = CLOSED
+        if self._retransmits or self._duplicates:
+            self._server.addStat("stage_b_retransmits", self._retransmits)
+            self._server.addStat("stage_b_duplicates", self._duplicates)
+            self._retransmits = 0
+            self._duplicates = 0
@@ -0,0 +1,131 @@
+import collections
+import random
+import threading
+import time
+
+
+class SessionCache:
+    def __init__(self, ttl: float, max_entries=65536) -> None:
+        """Sessions a client may resume, looked up by resumption token.
+
+        Every entry lives for the same ttl, so the table kept in insertion order is
+        also in expiry order, and expired entries are popped off the front whenever a
+        token is issued or taken. Once max_entries are cached the oldest is evicted.
+        A token resumes one session, only for the host it was issued to, and a resumed
+        session is issued a new one. A claimed token stays cached until it expires so
+        a client whose reply was lost can ask again and get the same reply.
+
+        Args:
+            ttl (float): Seconds a token stays valid.
+            max_entries (int, optional): Most sessions cached at once. Defaults to 65536.
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        # token to [expiry time, host, session state, reply to the first claim]
+        self._entries = collections.OrderedDict()
+        # sessions in several threads issue and take tokens
+        self._lock = threading.Lock()
+
+    def getTtl(self) -> float:
+        return self._ttl
+
+    def getSize(self) -> int:
+        return len(self._entries)
+
+    def issue(self, host: str, state, now=None) -> int:
+        """Cache a session and return the token that resumes it.
+
+        Args:
+            host (str): Client host, the only one that may resume the session.
+            state (any): Whatever the server needs to pick the session up again.
+            now (float, optional): Current time.monotonic(), read when None. Defaults to None.
+
+        Returns:
+            int: Resumption token, never 0.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self.expire(now)
+            if len(self._entries) >= self._max_entries:
+                self._entries.popitem(last=False)
+            token = random.getrandbits(32)
+            while token == 0 or token in self._entries:
+                token = random.getrandbits(32)
+            self._entries[token] = [now + self._ttl, host, state, None]
+        return token
+
+    def get(self, token: int, host: str, now=None):
+        """Look a session up without claiming it, so a request that fails a later
+        check does not use the token up.
+
+        Args:
+            token (int): Token sent by the client.
+            host (str): Host the request came from.
+            now (float, optional): Current time.monotonic(), read when None. Defaults to None.
+
+        Returns:
+            any | None: Session state given to issue, None if the token is unknown,
+                expired or was issued to another host.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self.expire(now)
+            entry = self._entries.get(token)
+            if entry is None or entry[1] != host:
+                return None
+            return entry[2]
+
+    def take(self, token: int, host: str, now=None):
+        """Claim a session to resume it.
+
+        Repeated claims, from a client that resent its request because the reply was
+        lost, get back the reply recorded with answer instead of a second session.
+
+        Args:
+            token (int): Token sent by the client.
+            host (str): Host the request came from.
+            now (float, optional): Current time.monotonic(), read when None. Defaults to None.
+
+        Returns:
+            (any, bytes | None) | None: Session state given to issue and None on the
+                first claim, the state and the recorded reply on repeated claims, an
+                empty reply until the first claim answered. None if the token is
+                unknown, expired or was issued to another host.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self.expire(now)
+            entry = self._entries.get(token)
+            if entry is None or entry[1] != host:
+                return None
+            reply = entry[3]
+            if reply is None:
+                entry[3] = b""
+            return entry[2], reply
+
+    def answer(self, token: int, reply: bytes) -> None:
+        """Record the reply to the first claim of a token, to resend on repeated claims.
+
+        Args:
+            token (int): Claimed token.
+            reply (bytes): Reply sent to the client.
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                entry[3] = reply
+
+    def expire(self, now: float) -> None:
+        """Drop entries whose ttl ran out. Callers hold the lock.
+
+        Args:
+            now (float): Current time.monotonic().
+        """
+        while self._entries:
+            token, entry = next(iter(self._entries.items()))
+            if now < entry[0]:
+                return
+            del self._entries[token]
@@ -0,0 +1,318 @@
+import mmap
+import socket
+import struct
+import threading
+import time
+
+# file header: magic, version, role, wall clock time the trace started at
+MAGIC = b"P1TRACE\0"
+VERSION = 1
+TRACE_HEADER = struct.Struct(">8sHBd")
+# record header, followed by the stored payload bytes: seconds since the trace
+# started, socket id, event, protocol, local host and port, remote host and port,
+# bytes sent or received, and bytes of them stored
+RECORD = struct.Struct(">dIBB4sH4sHII")
+
+ROLES = {"client": 0, "server": 1}
+ROLE_NAMES = {value: name for name, value in ROLES.items()}
+
+# events
+SEND = 0
+RECV = 1
+CONNECT = 2
+ACCEPT = 3
+CLOSE = 4
+
+UDP = 0
+TCP = 1
+
+# payload bytes stored per record, enough for every control message while bulk
+# Stage D data is only counted
+PAYLOAD_LIMIT = 256
+
+NO_ADDRESS = ("0.0.0.0", 0)
+
+
+class TraceWriter:
+    def __init__(self, path: str, role: str, payload_limit=PAYLOAD_LIMIT) -> None:
+        """Appends timestamped socket events to a binary trace file.
+
+        Each record is a fixed size header followed by its payload, so a reader
+        walks the file by offsets without parsing anything else, mmap included.
+        Records are written under a lock through a large buffer, sessions only pay
+        for packing the header and copying at most payload_limit bytes.
+
+        Args:
+            path (str): Trace file, overwritten.
+            role (str): "client" or "server", which side recorded the trace.
+            payload_limit (int, optional): Payload bytes stored per record, the full
+                size is always recorded. 0 stores every byte. Defaults to PAYLOAD_LIMIT.
+        """
+        self._path = path
+        self._payload_limit = payload_limit
+        self._file = open(path, "wb", buffering=1 << 20)
+        self._file.write(TRACE_HEADER.pack(MAGIC, VERSION, ROLES[role], time.time()))
+        self._started = time.monotonic()
+        self._next_id = 0
+        self._records = 0
+        # hosts that are names, like localhost, packed once
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def getPath(self) -> str:
+        return self._path
+
+    def getPayloadLimit(self) -> int:
+        return self._payload_limit
+
+    def getRecords(self) -> int:
+        return self._records
+
+    def nextId(self) -> int:
+        with self._lock:
+            self._next_id = self._next_id + 1
+            return self._next_id
+
+    def record(self, socket_id: int, event: int, kind: int, local, remote, payload, size=None):
+        """Append one record.
+
+        Args:
+            socket_id (int): Id of the traced socket.
+            event (int): SEND, RECV, CONNECT, ACCEPT or CLOSE.
+            kind (int): UDP or TCP.
+            local (tuple): Local (host, port).
+            remote (tuple | None): Remote (host, port), None when unknown.
+            payload (bytes | memoryview): Bytes sent or received, or their start.
+            size (int, optional): Bytes sent or received when payload is only their
+                start. Defaults to len(payload).
+        """
+        if size is None:
+            size = len(payload)
+        if self._payload_limit:
+            payload = payload[: self._payload_limit]
+        remote = remote or NO_ADDRESS
+        header = RECORD.pack(
+            time.monotonic() - self._started,
+            socket_id,
+            event,
+            kind,
+            self.packHost(local[0]),
+            local[1],
+            self.packHost(remote[0]),
+            remote[1],
+            size,
+            len(payload),
+        )
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(header)
+            self._file.write(payload)
+            self._records = self._records + 1
+
+    def packHost(self, host: str) -> bytes:
+        packed = self._hosts.get(host)
+        if packed is None:
+            try:
+                packed = socket.inet_aton(host)
+            except OSError:
+                packed = socket.inet_aton(socket.gethostbyname(host))
+            self._hosts[host] = packed
+        return packed
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class TraceRecord:
+    __slots__ = ("time", "socket_id", "event", "kind", "local", "remote", "size", "payload")
+
+    def __init__(self, time, socket_id, event, kind, local, remote, size, payload) -> None:
+        """One socket event read back from a trace.
+
+        Args:
+            time (float): Seconds since the trace started.
+            socket_id (int): Id of the traced socket, unique within the trace.
+            event (int): SEND, RECV, CONNECT, ACCEPT or CLOSE.
+            kind (int): UDP or TCP.
+            local (tuple): Local (host, port).
+            remote (tuple): Remote (host, port), NO_ADDRESS when unknown.
+            size (int): Bytes sent or received.
+            payload (bytes): Stored payload, the first bytes of size.
+        """
+        self.time = time
+        self.socket_id = socket_id
+        self.event = event
+        self.kind = kind
+        self.local = local
+        self.remote = remote
+        self.size = size
+        self.payload = payload
+
+
+def readTrace(path: str):
+    """Read every record of a trace file.
+
+    Args:
+        path (str): Trace file written by TraceWriter.
+
+    Raises:
+        ValueError: The file is not a trace.
+
+    Returns:
+        (str, float, list): Role that recorded the trace, wall clock time it started
+            at, and its records in time order.
+    """
+    records = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if len(data) < TRACE_HEADER.size:
+            raise ValueError(f"{path} is not a trace file")
+        magic, version, role, started = TRACE_HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} trace file")
+        offset = TRACE_HEADER.size
+        # a writer that was killed may leave half a record at the end
+        while offset + RECORD.size <= len(data):
+            fields = RECORD.unpack_from(data, offset)
+            offset = offset + RECORD.size
+            stored = fields[9]
+            if offset + stored > len(data):
+                break
+            records.append(
+                TraceRecord(
+                    fields[0],
+                    fields[1],
+                    fields[2],
+                    fields[3],
+                    (socket.inet_ntoa(fields[4]), fields[5]),
+                    (socket.inet_ntoa(fields[6]), fields[7]),
+                    fields[8],
+                    data[offset : offset + stored],
+                )
+            )
+            offset = offset + stored
+    # sessions in several threads record concurrently, so the file is only mostly sorted
+    records.sort(key=lambda record: record.time)
+    return ROLE_NAMES[role], started, records
+
+
+class TracingTransport:
+    def __init__(self, transport, writer: TraceWriter) -> None:
+        """Wraps another transport so every socket it creates records its traffic.
+
+        Args:
+            transport (KernelTransport | LoopbackTransport): Transport creating the
+                actual sockets.
+            writer (TraceWriter): Trace the sockets record to.
+        """
+        self._transport = transport
+        self._writer = writer
+
+    def getWriter(self) -> TraceWriter:
+        return self._writer
+
+    def udp(self):
+        return TracedSocket(self._transport.udp(), self._writer)
+
+    def tcp(self):
+        return TracedSocket(self._transport.tcp(), self._writer)
+
+
+class TracedSocket:
+    def __init__(self, sock, writer: TraceWriter) -> None:
+        """Socket that records every datagram, segment and connection to a trace.
+
+        Calls that move no data, like settimeout or shutdown, go straight to the
+        wrapped socket.
+
+        Args:
+            sock (socket.socket | LoopbackSocket): Socket to wrap.
+            writer (TraceWriter): Trace to record to.
+        """
+        self._socket = sock
+        self._writer = writer
+        self._id = writer.nextId()
+        self._kind = UDP if sock.type == socket.SOCK_DGRAM else TCP
+        self._local = None
+        self._peer = None
+        self._closed = False
+
+    def __getattr__(self, name: str):
+        return getattr(self._socket, name)
+
+    def local(self) -> tuple:
+        """Returns the local address, looked up once the socket has a port."""
+        if self._local is not None:
+            return self._local
+        try:
+            address = self._socket.getsockname()
+        except OSError:
+            return NO_ADDRESS
+        if address[1]:
+            self._local = address
+        return address
+
+    def record(self, event: int, remote, payload, size=None) -> None:
+        self._writer.record(self._id, event, self._kind, self.local(), remote, payload, size)
+
+    def sendto(self, data, address) -> int:
+        sent = self._socket.sendto(data, address)
+        self.record(SEND, address, data, sent)
+        return sent
+
+    def recvfrom(self, bufsize: int):
+        data, address = self._socket.recvfrom(bufsize)
+        self.record(RECV, address, data)
+        return data, address
+
+    def recv(self, bufsize: int) -> bytes:
+        data = self._socket.recv(bufsize)
+        self.record(RECV, self._peer, data)
+        return data
+
+    def recv_into(self, buffer, nbytes=0) -> int:
+        received = self._socket.recv_into(buffer, nbytes)
+        self.record(RECV, self._peer, memoryview(buffer)[:received])
+        return received
+
+    def send(self, data) -> int:
+        sent = self._socket.send(data)
+        self.record(SEND, self._peer, data, sent)
+        return sent
+
+    def sendall(self, data) -> None:
+        self._socket.sendall(data)
+        self.record(SEND, self._peer, data)
+
+    def sendmsg(self, buffers, *args) -> int:
+        sent = self._socket.sendmsg(buffers, *args)
+        # store the start of what was sent without joining every buffer
+        wanted = min(sent, self._writer.getPayloadLimit() or sent)
+        head = bytearray()
+        for buffer in buffers:
+            if len(head) >= wanted:
+                break
+            head.extend(buffer[: wanted - len(head)])
+        self.record(SEND, self._peer, head, sent)
+        return sent
+
+    def connect(self, address) -> None:
+        self._socket.connect(address)
+        self._peer = address
+        self.record(CONNECT, address, b"")
+
+    def accept(self):
+        connection, address = self._socket.accept()
+        traced = TracedSocket(connection, self._writer)
+        traced._local = self.local()
+        traced._peer = address
+        traced.record(ACCEPT, address, b"")
+        return traced, address
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.record(CLOSE, self._peer, b"")
+        self._socket.close()
@@ -0,0 +1,206 @@
+import queue
+import random
+import socket
+import threading
+from header import HEADER
+from transport import KernelTransport
+
+
+class StageBSession:
+    def __init__(self, mux, udp_socket: socket.socket, port: int, secret: int) -> None:
+        """One client session sharing a Stage B socket with other sessions.
+
+        Exposes the subset of the socket interface used by Stage B so the stage logic
+        does not care whether it owns the socket or not.
+
+        Args:
+            mux (StageBMux): Multiplexer that routes packets to this session.
+            udp_socket (socket.socket): Shared socket the session sends from.
+            port (int): Port of the shared socket, announced to the client.
+            secret (int): Stage A secret, unique among sessions on this port.
+        """
+        self._mux = mux
+        self._socket = udp_socket
+        self._port = port
+        self._secret = secret
+        self._timeout = None
+        self.client_address = None
+        self.queue = queue.Queue()
+
+    def getPort(self) -> int:
+        return self._port
+
+    def getSecret(self) -> int:
+        return self._secret
+
+    def settimeout(self, timeout) -> None:
+        self._timeout = timeout
+
+    def recvfrom(self, bufsize: int):
+        """Wait for the next packet routed to this session.
+
+        Args:
+            bufsize (int): Unused, packets are already read by the multiplexer.
+
+        Raises:
+            socket.timeout: No packet arrived within the session timeout.
+
+        Returns:
+            (bytes, _RetAddress): Packet and client address.
+        """
+        try:
+            return self.queue.get(timeout=self._timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+
+    def shutdown(self, how: int) -> None:
+        """Wake a recvfrom waiting on this session with an empty packet, like a shut
+        down socket would.
+
+        Args:
+            how (int): Unused, the shared socket stays open for other sessions.
+        """
+        self.queue.put((b"", None))
+
+    def sendto(self, data: bytes, address) -> int:
+        return self._socket.sendto(data, address)
+
+    def close(self) -> None:
+        self._mux.unregister(self)
+
+
+class StageBMux:
+    # random secrets tried on each shared socket before moving to the next one
+    SECRET_ATTEMPTS = 32
+
+    def __init__(
+        self,
+        server_address: str,
+        num_sockets: int,
+        read_size=1024,
+        transport=None,
+        server=None,
+    ) -> None:
+        """Fixed pool of Stage B sockets shared by every session.
+
+        Packets are routed by (port, client address, secret). A session's client address is
+        unknown until its first packet arrives, so new sessions wait in a second index
+        keyed by (port, secret) and move over on their first packet. Packets that
+        match no session never reach a session that could reply with an error, so
+        they are counted as stage_b_mux_dropped and logged at debug instead.
+
+        Args:
+            server_address (str): Address to bind the shared sockets to.
+            num_sockets (int): Number of shared Stage B sockets.
+            read_size (int, optional): Max datagram size read from the sockets. Defaults to 1024.
+            transport (KernelTransport | LoopbackTransport, optional): Creates the
+                shared sockets. Real sockets when None. Defaults to None.
+            server (Server, optional): Server counting and logging dropped packets.
+                Defaults to None.
+        """
+        self._read_size = read_size
+        self._server = server
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pending = {}
+        self._in_use = set()
+        self._sockets = []
+        self._next = 0
+        transport = transport or KernelTransport()
+
+        for _ in range(num_sockets):
+            udp_socket = transport.udp()
+            # let the kernel pick a free port for each shared socket
+            udp_socket.bind((server_address, 0))
+            port = udp_socket.getsockname()[1]
+            self._sockets.append((udp_socket, port))
+            threading.Thread(
+                target=self.route, args=(udp_socket, port), daemon=True
+            ).start()
+
+    def getPorts(self) -> list:
+        return [port for _, port in self._sockets]
+
+    def register(self) -> StageBSession:
+        """Create a session on the next shared socket with a secret unique to that port.
+
+        A socket whose secrets are nearly all taken is skipped after SECRET_ATTEMPTS
+        random picks, so a full pool fails the registration instead of spinning while
+        holding the lock.
+
+        Raises:
+            OSError: No free secret was found on any shared socket.
+
+        Returns:
+            StageBSession: New session waiting for its first packet.
+        """
+        with self._lock:
+            for _ in range(len(self._sockets)):
+                udp_socket, port = self._sockets[self._next]
+                self._next = (self._next + 1) % len(self._sockets)
+
+                for _ in range(self.SECRET_ATTEMPTS):
+                    secret = random.randint(1, 10000)
+                    if (port, secret) not in self._in_use:
+                        session = StageBSession(self, udp_socket, port, secret)
+                        self._in_use.add((port, secret))
+                        self._pending[(port, secret)] = session
+                        return session
+        raise OSError("no free secret on any shared Stage B socket")
+
+    def unregister(self, session: StageBSession) -> None:
+        port = session.getPort()
+        secret = session.getSecret()
+        with self._lock:
+            self._in_use.discard((port, secret))
+            self._pending.pop((port, secret), None)
+            if session.client_address is not None:
+                self._sessions.pop((port, session.client_address, secret), None)
+
+    def route(self, udp_socket: socket.socket, port: int) -> None:
+        """Receive loop for one shared socket, hands packets to their session queue.
+
+        Args:
+            udp_socket (socket.socket): Shared socket.
+            port (int): Port the shared socket is bound to.
+        """
+        while True:
+            try:
+                response, client_address = udp_socket.recvfrom(self._read_size)
+            except OSError:
+                return
+            # secret is the second header field
+            if len(response) < HEADER.size:
+                self.drop("short_message", port, client_address, length=len(response))
+                continue
+            _, secret, _, _ = HEADER.unpack_from(response)
+
+            with self._lock:
+                # secrets are only unique per port, one client may hold the same
+                # secret on two shared sockets
+                session = self._sessions.get((port, client_address, secret))
+                if session is None:
+                    session = self._pending.pop((port, secret), None)
+                    if session is not None:
+                        session.client_address = client_address
+                        self._sessions[(port, client_address, secret)] = session
+            if session is None:
+                self.drop("unknown_secret", port, client_address, secret=secret)
+                continue
+            session.queue.put((response, client_address))
+
+    def drop(self, reason: str, port: int, client_address, **fields) -> None:
+        """Count and log a packet no session was waiting for.
+
+        Args:
+            reason (str): Why the packet was dropped, short_message or unknown_secret.
+            port (int): Shared socket port the packet arrived on.
+            client_address (_RetAddress): Client the packet came from.
+            **fields: More values for the log record.
+        """
+        if self._server is None:
+            return
+        self._server.addStat("stage_b_mux_dropped")
+        self._server.getLogger().debug(
+            "mux_dropped", "B", reason=reason, port=port, client=client_address, **fields
+        )
@@ -0,0 +1,170 @@
+import threading
+import time
+
+
+class Timer:
+    __slots__ = ("callback", "rounds", "cancelled")
+
+    def __init__(self, callback, rounds: int) -> None:
+        self.callback = callback
+        self.rounds = rounds
+        self.cancelled = False
+
+
+class TimerWheel:
+    def __init__(self, log, tick=0.1, slots=64) -> None:
+        """Hashed timer wheel shared by every session.
+
+        A timer goes in the slot its deadline falls in, counting how many full turns of
+        the wheel are left, so scheduling and cancelling are O(1) whatever the number of
+        sessions. Cancelled timers are only marked and get dropped when their slot comes
+        up. Deadlines are rounded up to the next tick.
+
+        Args:
+            log (Logger): Log callback failures are written to.
+            tick (float, optional): Seconds per slot. Defaults to 0.1.
+            slots (int, optional): Number of slots in the wheel. Defaults to 64.
+        """
+        self._log = log
+        self._tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current = 0
+        self._last_tick = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def getTick(self) -> float:
+        return self._tick
+
+    def schedule(self, delay: float, callback) -> Timer:
+        """Call callback from the wheel thread once delay seconds have passed.
+
+        Args:
+            delay (float): Seconds until the callback runs.
+            callback (callable): Called with no arguments.
+
+        Returns:
+            Timer: Handle for cancel.
+        """
+        ticks = max(int(-(-delay // self._tick)), 1)
+        with self._lock:
+            timer = Timer(callback, (ticks - 1) // len(self._slots))
+            self._slots[(self._current + ticks) % len(self._slots)].append(timer)
+        return timer
+
+    def cancel(self, timer: Timer) -> None:
+        timer.cancelled = True
+
+    def advance(self, now=None) -> int:
+        """Move the wheel up to now and run every timer that came due, in bulk.
+
+        Args:
+            now (float, optional): Current time.monotonic(), read when None. Defaults to None.
+
+        Returns:
+            int: Number of callbacks run.
+        """
+        if now is None:
+            now = time.monotonic()
+        due = []
+        with self._lock:
+            while now - self._last_tick >= self._tick:
+                self._last_tick = self._last_tick + self._tick
+                self._current = (self._current + 1) % len(self._slots)
+                slot = self._slots[self._current]
+                waiting = []
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    if timer.rounds > 0:
+                        timer.rounds = timer.rounds - 1
+                        waiting.append(timer)
+                    else:
+                        due.append(timer)
+                self._slots[self._current] = waiting
+
+        # callbacks may schedule new timers, so run them without the lock
+        for timer in due:
+            try:
+                timer.callback()
+            except Exception as e:
+                # one failing callback must not keep the others from running
+                self._log.error("timer_callback_failed", error=type(e).__name__, reason=str(e))
+        return len(due)
+
+    def start(self) -> None:
+        """Drive the wheel from a daemon thread, once per tick."""
+        if self._thread is not None:
+            return
+        self._last_tick = time.monotonic()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self._tick)
+            self.advance()
+
+    def watch(self, timeout: float, on_expire):
+        """Start an idle deadline for one session stage.
+
+        Args:
+            timeout (float): Seconds without activity before the stage expires.
+            on_expire (callable): Called once from the wheel thread when it expires.
+
+        Returns:
+            Deadline: Deadline to touch on activity and cancel when the stage ends.
+        """
+        return Deadline(self, timeout, on_expire)
+
+
+class Deadline:
+    __slots__ = ("_wheel", "_timeout", "_on_expire", "_last", "_timer", "_expired", "_lock")
+
+    def __init__(self, wheel: TimerWheel, timeout: float, on_expire) -> None:
+        """Idle deadline that expires once touch has not been called for timeout seconds.
+
+        Touching only records the time. The wheel timer is not moved, when it goes off
+        for a session that was active since, it is scheduled again for the rest of the
+        timeout, so a busy session costs at most one reschedule per timeout.
+
+        Args:
+            wheel (TimerWheel): Wheel that runs the timer.
+            timeout (float): Seconds without activity before expiring.
+            on_expire (callable): Called once from the wheel thread on expiry.
+        """
+        self._wheel = wheel
+        self._timeout = timeout
+        self._on_expire = on_expire
+        self._last = time.monotonic()
+        self._expired = False
+        self._lock = threading.Lock()
+        self._timer = wheel.schedule(timeout, self.check)
+
+    def touch(self) -> None:
+        self._last = time.monotonic()
+
+    def expired(self) -> bool:
+        return self._expired
+
+    def check(self) -> None:
+        idle = time.monotonic() - self._last
+        with self._lock:
+            if self._timer.cancelled:
+                return
+            if idle < self._timeout:
+                self._timer = self._wheel.schedule(self._timeout - idle, self.check)
+                return
+            self._expired = True
+        self._on_expire()
+
+    def cancel(self) -> bool:
+        """Stop watching the stage.
+
+        Returns:
+            bool: True if the deadline had already expired, in which case on_expire ran
+                or is running.
+        """
+        with self._lock:
+            self._wheel.cancel(self._timer)
+            return self._expired
@@ -0,0 +1,380 @@
+import collections
+import errno
+import random
+import socket
+import threading
+
+# ports handed out to sockets bound to port 0, the kernel's ephemeral range
+EPHEMERAL_PORTS = (32768, 60999)
+# largest datagram sendto accepts, like UDP over IPv4
+MAX_DATAGRAM = 65507
+# datagrams queued on a socket before new ones are dropped, like a full receive buffer
+DATAGRAM_QUEUE = 1024
+# stream bytes queued on the receiving end before senders block
+STREAM_BUFFER = 1 << 20
+
+
+class KernelTransport:
+    """Creates real sockets that go through the kernel network stack."""
+
+    def udp(self) -> socket.socket:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tcp(self) -> socket.socket:
+        return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+class LoopbackTransport:
+    def __init__(self, loss=0.0, seed=None) -> None:
+        """In-process network of simulated UDP and TCP sockets.
+
+        Sockets support the subset of the socket interface the stages use, so a
+        server and clients running in one process talk to each other with no
+        syscalls and no real ports. Datagrams keep their boundaries and may be
+        dropped, streams deliver bytes in order and block senders once the receiving
+        end has STREAM_BUFFER bytes queued.
+
+        The server never acks a Stage B packet twice, so with loss a lost ack stalls
+        the session until the client gives up. Loss is for exercising those failure
+        paths, not for throughput numbers.
+
+        Args:
+            loss (float, optional): Chance that a datagram is dropped. Defaults to 0.0.
+            seed (int, optional): Seed for choosing the dropped datagrams. Defaults to None.
+        """
+        self._loss = loss
+        self._random = random.Random(seed)
+        # (socket type, address) to the socket bound to it
+        self._bound = {}
+        self._next_port = EPHEMERAL_PORTS[0]
+        self._next_fd = 1000
+        self._lock = threading.Lock()
+
+    def getLoss(self) -> float:
+        return self._loss
+
+    def udp(self):
+        return LoopbackSocket(self, socket.SOCK_DGRAM)
+
+    def tcp(self):
+        return LoopbackSocket(self, socket.SOCK_STREAM)
+
+    def nextFd(self) -> int:
+        """Returns a made up file descriptor, sockets only need fileno to not be -1."""
+        with self._lock:
+            self._next_fd = self._next_fd + 1
+            return self._next_fd
+
+    def bind(self, sock, address: tuple) -> tuple:
+        """Bind a socket to an address, a free ephemeral port when the port is 0.
+
+        Args:
+            sock (LoopbackSocket): Socket to bind.
+            address (tuple): (host, port) to bind to.
+
+        Raises:
+            OSError: The address is already bound by a socket of the same type.
+
+        Returns:
+            tuple: Bound (host, port).
+        """
+        host, port = resolve(address)
+        with self._lock:
+            if port == 0:
+                for _ in range(EPHEMERAL_PORTS[1] - EPHEMERAL_PORTS[0] + 1):
+                    port = self._next_port
+                    self._next_port = self._next_port + 1
+                    if self._next_port > EPHEMERAL_PORTS[1]:
+                        self._next_port = EPHEMERAL_PORTS[0]
+                    if (sock.type, (host, port)) not in self._bound:
+                        break
+                else:
+                    raise OSError(errno.EADDRINUSE, "Address already in use")
+            if (sock.type, (host, port)) in self._bound:
+                raise OSError(errno.EADDRINUSE, "Address already in use")
+            self._bound[(sock.type, (host, port))] = sock
+        return host, port
+
+    def unbind(self, sock, address: tuple) -> None:
+        with self._lock:
+            if self._bound.get((sock.type, address)) is sock:
+                del self._bound[(sock.type, address)]
+
+    def lookup(self, kind: int, address: tuple):
+        """Find the socket of type kind bound to address, or to the wildcard address
+        on the same port.
+
+        Returns:
+            LoopbackSocket | None: Bound socket, None if nothing is bound there.
+        """
+        host, port = resolve(address)
+        with self._lock:
+            sock = self._bound.get((kind, (host, port)))
+            if sock is None:
+                sock = self._bound.get((kind, ("0.0.0.0", port)))
+        return sock
+
+    def drops(self) -> bool:
+        """Decide whether the next datagram is lost."""
+        if self._loss <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self._loss
+
+
+def resolve(address: tuple) -> tuple:
+    """Normalize a (host, port) address so every name for the loopback host matches."""
+    host, port = address
+    if host in ("localhost", ""):
+        host = "127.0.0.1" if host else "0.0.0.0"
+    return host, port
+
+
+class LoopbackSocket:
+    def __init__(self, network: LoopbackTransport, kind: int) -> None:
+        """One end of a simulated UDP socket, TCP listener or TCP connection.
+
+        Blocking calls wait on a condition with the socket timeout, and raise
+        socket.timeout or BlockingIOError like a real socket would. Shutting a socket
+        down wakes every blocked read with an empty result, which is how stage
+        deadlines wake blocked sessions.
+
+        Args:
+            network (LoopbackTransport): Network the socket belongs to.
+            kind (int): socket.SOCK_DGRAM or socket.SOCK_STREAM.
+        """
+        self.family = socket.AF_INET
+        self.type = kind
+        self._network = network
+        self._fd = network.nextFd()
+        self._address = None
+        # other end of a connected stream
+        self._peer = None
+        self._timeout = None
+        self._closed = False
+        # shut down for reading, and for a stream, the peer will not send any more
+        self._shut = False
+        self._eof = False
+        self._listening = False
+        self._datagrams = collections.deque()
+        self._stream = bytearray()
+        self._backlog = collections.deque()
+        # guards the queues above, readers and blocked writers wait on it
+        self._ready = threading.Condition()
+
+    def fileno(self) -> int:
+        return -1 if self._closed else self._fd
+
+    def getsockname(self) -> tuple:
+        return self._address or ("0.0.0.0", 0)
+
+    def getpeername(self) -> tuple:
+        if self._peer is None:
+            raise OSError(errno.ENOTCONN, "Transport endpoint is not connected")
+        return self._peer.getsockname()
+
+    def gettimeout(self):
+        return self._timeout
+
+    def settimeout(self, timeout) -> None:
+        self._timeout = timeout
+
+    def setblocking(self, flag: bool) -> None:
+        self._timeout = None if flag else 0.0
+
+    def setsockopt(self, *args) -> None:
+        # no options change how the simulated network behaves
+        pass
+
+    def bind(self, address: tuple) -> None:
+        self._address = self._network.bind(self, address)
+
+    def listen(self, backlog=None) -> None:
+        self._listening = True
+
+    def wait(self, ready) -> None:
+        """Block until ready() is true, honoring the timeout. Callers hold self._ready."""
+        if self._timeout == 0:
+            if not ready():
+                raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+        elif not self._ready.wait_for(ready, self._timeout):
+            raise socket.timeout("timed out")
+        if self._closed:
+            raise OSError(errno.EBADF, "Bad file descriptor")
+
+    def sendto(self, data, address: tuple) -> int:
+        if self._closed:
+            raise OSError(errno.EBADF, "Bad file descriptor")
+        if len(data) > MAX_DATAGRAM:
+            raise OSError(errno.EMSGSIZE, "Message too long")
+        if self._address is None:
+            self.bind(("127.0.0.1", 0))
+        if not self._network.drops():
+            destination = self._network.lookup(socket.SOCK_DGRAM, address)
+            if destination is not None:
+                destination.deliver(bytes(data), self._address)
+        return len(data)
+
+    def deliver(self, data: bytes, address: tuple) -> None:
+        """Queue a datagram sent to this socket, dropped when the queue is full."""
+        with self._ready:
+            if self._closed or self._shut or len(self._datagrams) >= DATAGRAM_QUEUE:
+                return
+            self._datagrams.append((data, address))
+            self._ready.notify()
+
+    def recvfrom(self, bufsize: int):
+        if self.type == socket.SOCK_STREAM:
+            return self.recv(bufsize), self._peer.getsockname()
+        with self._ready:
+            self.wait(lambda: self._datagrams or self._shut or self._closed)
+            if not self._datagrams:
+                return b"", None
+            data, address = self._datagrams.popleft()
+        # like UDP, the rest of a datagram longer than bufsize is lost
+        return data[:bufsize], address
+
+    def recv(self, bufsize: int) -> bytes:
+        if self.type == socket.SOCK_DGRAM:
+            return self.recvfrom(bufsize)[0]
+        with self._ready:
+            self.wait(lambda: self._stream or self._eof or self._shut or self._closed)
+            data = bytes(self._stream[:bufsize])
+            del self._stream[:bufsize]
+            # senders waiting for room in the buffer can go on
+            self._ready.notify_all()
+        return data
+
+    def recv_into(self, buffer, nbytes=0) -> int:
+        data = self.recv(nbytes or len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def connect(self, address: tuple) -> None:
+        listener = self._network.lookup(socket.SOCK_STREAM, address)
+        if listener is None or not listener.accepts():
+            raise ConnectionRefusedError(errno.ECONNREFUSED, "Connection refused")
+        if self._address is None:
+            self.bind(("127.0.0.1", 0))
+        # the accepted end shares the listener's address, like a real connection
+        accepted = LoopbackSocket(self._network, socket.SOCK_STREAM)
+        accepted._address = listener.getsockname()
+        accepted._peer = self
+        self._peer = accepted
+        if not listener.enqueue(accepted, self._address):
+            raise ConnectionRefusedError(errno.ECONNREFUSED, "Connection refused")
+
+    def accepts(self) -> bool:
+        return self._listening and not self._closed and not self._shut
+
+    def enqueue(self, accepted, address: tuple) -> bool:
+        """Add a new connection to the listen backlog.
+
+        Returns:
+            bool: False if the listener closed in the meantime.
+        """
+        with self._ready:
+            if not self.accepts():
+                return False
+            self._backlog.append((accepted, address))
+            self._ready.notify()
+        return True
+
+    def accept(self):
+        with self._ready:
+            self.wait(lambda: self._backlog or self._shut or self._closed)
+            if not self._backlog:
+                raise OSError(errno.EINVAL, "Invalid argument")
+            return self._backlog.popleft()
+
+    def send(self, data) -> int:
+        """Queue as much of data as the peer has room for, waiting for some room.
+
+        Returns:
+            int: Bytes sent, fewer than len(data) on a short write.
+        """
+        if self._closed:
+            raise OSError(errno.EBADF, "Bad file descriptor")
+        if self._peer is None:
+            raise OSError(errno.ENOTCONN, "Transport endpoint is not connected")
+        return self._peer.receive(data, self._timeout, True)
+
+    def sendall(self, data) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[self.send(view) :]
+
+    def sendmsg(self, buffers) -> int:
+        sent = 0
+        for buffer in buffers:
+            if self._peer is None:
+                raise OSError(errno.ENOTCONN, "Transport endpoint is not connected")
+            # only the first buffer may wait for room, like one short write
+            written = self._peer.receive(buffer, self._timeout, sent == 0)
+            sent = sent + written
+            if written < len(buffer):
+                break
+        return sent
+
+    def receive(self, data, timeout, block: bool) -> int:
+        """Append stream bytes sent by the peer, as many as fit in the buffer.
+
+        Args:
+            data (bytes | memoryview): Bytes sent.
+            timeout (float | None): Sender's timeout.
+            block (bool): Wait until there is room for at least one byte.
+
+        Raises:
+            BrokenPipeError: This end is closed.
+
+        Returns:
+            int: Bytes taken.
+        """
+        with self._ready:
+
+            def room() -> bool:
+                return len(self._stream) < STREAM_BUFFER or self._closed or self._shut
+
+            if block and timeout != 0:
+                if not self._ready.wait_for(room, timeout):
+                    raise socket.timeout("timed out")
+            if self._closed or self._shut:
+                raise BrokenPipeError(errno.EPIPE, "Broken pipe")
+            taken = min(len(data), STREAM_BUFFER - len(self._stream))
+            if taken <= 0:
+                if block:
+                    raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+                return 0
+            self._stream.extend(data[:taken])
+            self._ready.notify_all()
+        return taken
+
+    def hangup(self) -> None:
+        """The peer closed or shut down, reads return what is left and then b""."""
+        with self._ready:
+            self._eof = True
+            self._ready.notify_all()
+
+    def shutdown(self, how: int) -> None:
+        with self._ready:
+            if how != socket.SHUT_WR:
+                self._shut = True
+            self._ready.notify_all()
+        if how != socket.SHUT_RD and self._peer is not None:
+            self._peer.hangup()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        with self._ready:
+            self._closed = True
+            backlog = list(self._backlog)
+            self._backlog.clear()
+            self._ready.notify_all()
+        if self._address is not None:
+            self._network.unbind(self, self._address)
+        if self._peer is not None:
+            self._peer.hangup()
+        # connections nobody accepted are reset
+        for accepted, _ in backlog:
+            accepted.close()
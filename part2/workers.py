@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from server import Server
+
+
+def runWorker(worker_id: int, mode: str, options: dict, stats_queue) -> None:
+    """Worker process entry point. Serves clients on a SO_REUSEPORT bound Stage A port.
+
+    Args:
+        worker_id (int): Index of this worker in the supervisor.
+        mode (str): Backend used by the worker, "thread" or "async".
+        options (dict): Server keyword arguments for this worker, from workerOptions.
+        stats_queue (multiprocessing.Queue): Queue for reporting stats to the supervisor.
+    """
+    server = Server(**options)
+
+    def report() -> None:
+        while True:
+            time.sleep(1)
+            stats_queue.put((worker_id, server.getStats()))
+
+    threading.Thread(target=report, daemon=True).start()
+
+    try:
+        if mode == "async":
+            import async_server
+
+            async_server.start(server=server)
+        else:
+            import run_server
+
+            run_server.start(server=server)
+    finally:
+        stats_queue.put((worker_id, server.getStats()))
+
+
+def workerOptions(options: dict, worker_id: int) -> dict:
+    """Server keyword arguments for one worker.
+
+    Every worker binds the Stage A port with SO_REUSEPORT. Worker N serves its metrics
+    on metrics_port + N, writes metrics snapshots to metrics_file.N, its profiles to
+    profile_dir/N and its trace to trace_file.N, so workers never share a port or file.
+
+    Args:
+        options (dict): Server keyword arguments shared by every worker.
+        worker_id (int): Index of the worker.
+
+    Returns:
+        dict: Copy of options for this worker.
+    """
+    options = dict(options, reuse_port=True)
+    if options.get("metrics_port"):
+        options["metrics_port"] = options["metrics_port"] + worker_id
+    if options.get("metrics_file"):
+        options["metrics_file"] = f"{options['metrics_file']}.{worker_id}"
+    if options.get("profile_dir"):
+        options["profile_dir"] = os.path.join(options["profile_dir"], str(worker_id))
+    if options.get("trace_file"):
+        options["trace_file"] = f"{options['trace_file']}.{worker_id}"
+    return options
+
+
+def start(options=None, workers=2, mode="thread") -> None:
+    """Supervisor that forks worker processes sharing the Stage A port.
+
+    Crashed workers are restarted, workers that shut down after going idle are not.
+    The supervisor exits once every worker has shut down.
+
+    Limits like max_sessions and rate_limit apply to each worker on its own. A client
+    has to resume a session on the worker that issued its token, it starts over
+    otherwise. trace_file only works with the thread backend.
+
+    Args:
+        options (dict, optional): Server keyword arguments shared by every worker, like
+            {"server_address": "localhost", "port": 12235}. Ports and files are made
+            per worker by workerOptions. Defaults to None.
+        workers (int, optional): Number of worker processes. Defaults to 2.
+        mode (str, optional): Backend used by each worker, "thread" or "async". Defaults to "thread".
+    """
+    options = options or {}
+    context = multiprocessing.get_context("fork")
+    stats_queue = context.Queue()
+
+    def spawn(worker_id: int):
+        process = context.Process(
+            target=runWorker,
+            args=(worker_id, mode, workerOptions(options, worker_id), stats_queue),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    print(f"Starting {workers} workers...")
+    processes = {worker_id: spawn(worker_id) for worker_id in range(workers)}
+
+    # stats from the current process of each worker, and totals
+    # carried over from processes that crashed and were replaced
+    current = {worker_id: {} for worker_id in range(workers)}
+    retired = {}
+
+    try:
+        while processes:
+            drainStats(stats_queue, current)
+
+            for worker_id, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                if process.exitcode == 0:
+                    del processes[worker_id]
+                    continue
+
+                print(f"Worker {worker_id} crashed with exit code {process.exitcode}, restarting...")
+                mergeStats(retired, current[worker_id])
+                mergeStats(retired, {"worker_restarts": 1})
+                current[worker_id] = {}
+                processes[worker_id] = spawn(worker_id)
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("Stopping workers...")
+        for process in processes.values():
+            process.terminate()
+            process.join()
+
+    drainStats(stats_queue, current)
+    totals = dict(retired)
+    for stats in current.values():
+        mergeStats(totals, stats)
+    print(f"Aggregated worker stats: {totals}")
+
+
+def drainStats(stats_queue, current: dict) -> None:
+    """Keep the latest stats snapshot reported by each worker.
+
+    Args:
+        stats_queue (multiprocessing.Queue): Queue workers report stats on.
+        current (dict): Worker id to latest stats snapshot, updated in place.
+    """
+    while True:
+        try:
+            worker_id, stats = stats_queue.get_nowait()
+        except queue.Empty:
+            return
+        current[worker_id] = stats
+
+
+def mergeStats(totals: dict, stats: dict) -> None:
+    """Add stats counters into totals.
+
+    Args:
+        totals (dict): Counter name to value, updated in place.
+        stats (dict): Counter name to value.
+    """
+    for name, value in stats.items():
+        totals[name] = totals.get(name, 0) + value
@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import socket
+import time
+from protocol.client_session import (
+    CONNECT_TCP,
+    CONNECT_UDP,
+    DONE,
+    FAIL,
+    SEND,
+    ClientSession,
+)
+
+
+class SessionProtocol(asyncio.Protocol, asyncio.DatagramProtocol):
+    def __init__(self, queue: asyncio.Queue, connection: int) -> None:
+        """Protocol for the datagram and stream connections of one session, queues
+        whatever the server sends.
+
+        Args:
+            queue (asyncio.Queue): Queue shared by every connection of the session.
+            connection (int): Number of this connection within the session, so data
+                still queued from a connection the session moved on from is skipped.
+        """
+        self._queue = queue
+        self._connection = connection
+
+    def datagram_received(self, data, addr) -> None:
+        self._queue.put_nowait((self._connection, data))
+
+    def data_received(self, data) -> None:
+        self._queue.put_nowait((self._connection, data))
+
+    def error_received(self, exc) -> None:
+        # ICMP port unreachable, the retransmit timer covers it
+        pass
+
+    def connection_lost(self, exc) -> None:
+        pass
+
+
+async def run_session(
+    host: str,
+    port: int,
+    window=1,
+    byte_align=4,
+    rtt=None,
+) -> ClientSession:
+    """Run one session on the running event loop, without a thread of its own.
+
+    Args:
+        host (str): Server address.
+        port (int): Stage A port.
+        window (int, optional): Stage B packets kept in flight at once. Defaults to 1.
+        byte_align (int, optional): Byte alignment. Defaults to 4.
+        rtt (RttEstimator, optional): Retransmit timer, a new one when None. Sessions
+            to the same server may share one. Defaults to None.
+
+    Returns:
+        ClientSession: Finished session, with its secrets or the reason it failed.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    session = ClientSession(rtt, byte_align=byte_align, window=window)
+    # resolve once, every datagram is sent to an address and not a name
+    infos = await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    host = infos[0][4][0]
+
+    # datagram endpoints are not connected, the server may answer Stage A from
+    # another port than the one the request went to
+    connection = 0
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: SessionProtocol(queue, connection), family=socket.AF_INET
+    )
+    address = (host, port)
+
+    def send(data: bytes) -> None:
+        transport.sendto(data, address)
+
+    try:
+        actions = session.start(time.monotonic())
+        while True:
+            for kind, value in actions:
+                if kind == SEND:
+                    send(value)
+                elif kind == CONNECT_UDP:
+                    transport.close()
+                    connection = connection + 1
+                    transport, _ = await loop.create_datagram_endpoint(
+                        lambda: SessionProtocol(queue, connection), family=socket.AF_INET
+                    )
+                    address = (host, value)
+                elif kind == CONNECT_TCP:
+                    transport.close()
+                    connection = connection + 1
+                    try:
+                        transport, _ = await loop.create_connection(
+                            lambda: SessionProtocol(queue, connection), host, value
+                        )
+                    except OSError:
+                        session.fail("stage_c_connect")
+                        return session
+                    send = transport.write
+                    actions.extend(session.connected(time.monotonic()))
+                elif kind in (DONE, FAIL):
+                    return session
+
+            # wait for the server until the next retransmit is due
+            timeout = max(session.getDeadline() - time.monotonic(), 0)
+            try:
+                source, data = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                actions = session.poll(time.monotonic())
+                continue
+            if source != connection:
+                actions = []
+                continue
+            actions = session.feed(data, time.monotonic())
+    finally:
+        transport.close()
+
+
+async def run_sessions(host: str, port: int, sessions: int, **opts) -> list:
+    """Run many sessions at once on the running event loop.
+
+    Args:
+        host (str): Server address.
+        port (int): Stage A port.
+        sessions (int): Number of concurrent sessions.
+        **opts: Passed on to run_session.
+
+    Returns:
+        list: Every finished ClientSession.
+    """
+    return await asyncio.gather(*(run_session(host, port, **opts) for _ in range(sessions)))
+
+
+def main(default_address: str) -> None:
+    """Command line entry point of each part's async_client.py.
+
+    Args:
+        default_address (str): Server address used when --address is not given.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run many concurrent CSE 461 Project 1 sessions from one event loop."
+    )
+    parser.add_argument("--address", default=default_address, help="Server address.")
+    parser.add_argument("--port", type=int, default=12235, help="Stage A port.")
+    parser.add_argument("--sessions", type=int, default=1, help="Concurrent sessions.")
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=1,
+        help="Stage B packets kept in flight at once, the server must accept the same window.",
+    )
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    results = asyncio.run(
+        run_sessions(args.address, args.port, args.sessions, window=args.window)
+    )
+    elapsed = time.monotonic() - started
+
+    failures = {}
+    for session in results:
+        if session.getFailure() is not None:
+            failures[session.getFailure()] = failures.get(session.getFailure(), 0) + 1
+    completed = len(results) - sum(failures.values())
+    if args.sessions == 1 and completed:
+        print(f"Secrets: {results[0].getSecrets()}")
+    print(f"{completed} / {len(results)} sessions completed in {elapsed:.2f}s")
+    if failures:
+        print(f"Failures: {failures}")
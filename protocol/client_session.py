@@ -0,0 +1,326 @@
+from protocol.codec import (
+    ACK,
+    HEADER,
+    HEADER_SIZE,
+    ErrorReply,
+    Header,
+    StageAResponse,
+    StageBResponse,
+    StageCResponse,
+    StageDFinal,
+    alignedLength,
+)
+from protocol.rtt import RttEstimator
+
+# actions returned by ClientSession, each one is a (kind, value) tuple
+# send value on the current datagram or stream connection
+SEND = "send"
+# send datagrams to port value from now on
+CONNECT_UDP = "connect_udp"
+# open a TCP connection to port value and report it with connected()
+CONNECT_TCP = "connect_tcp"
+# the session finished, value is the list of the four stage secrets
+DONE = "done"
+# the session failed, value is the reason
+FAIL = "fail"
+
+# session states
+IDLE = "idle"
+STAGE_A = "A"
+STAGE_B = "B"
+STAGE_C = "C"
+STAGE_D = "D"
+CLOSED = "closed"
+
+STUDENT_ID = 246
+HELLO_WORLD = b"hello world\0"
+
+
+class ClientSession:
+    __slots__ = (
+        "_rtt",
+        "_byte_align",
+        "_window",
+        "_state",
+        "_secrets",
+        "_stage_times",
+        "_failure",
+        "_message",
+        "_retransmits",
+        "_deadline",
+        "_num",
+        "_base",
+        "_next",
+        "_in_flight",
+        "_resent",
+        "_acked",
+        "_buffer",
+    )
+
+    # most Stage A retransmits and Stage B timeouts before giving up, like run_client.py
+    MAX_RETRANSMITS = 4
+    MAX_TIMEOUTS = 100
+    # seconds to wait for a response that is never retransmitted for
+    RESPONSE_TIMEOUT = 5
+
+    def __init__(self, rtt=None, byte_align=4, window=1) -> None:
+        """Client side of one session, with no sockets, threads or clocks.
+
+        The driver passes in the current time with every call, and gets back a list of
+        actions to carry out. getDeadline tells it when to call poll so lost packets are
+        retransmitted.
+
+        Args:
+            rtt (RttEstimator, optional): Retransmit timer for Stages A and B, a new one
+                when None. Defaults to None.
+            byte_align (int, optional): Byte alignment. Defaults to 4.
+            window (int, optional): Stage B packets kept in flight at once. Defaults to 1.
+        """
+        self._rtt = rtt if rtt is not None else RttEstimator()
+        self._byte_align = byte_align
+        self._window = window
+        self._state = IDLE
+        self._secrets = []
+        self._stage_times = {}
+        self._failure = None
+        # packet sent repeatedly in the current stage
+        self._message = None
+        self._retransmits = 0
+        self._deadline = None
+        self._num = 0
+        # lowest packet not acknowledged yet and next packet never sent
+        self._base = 0
+        self._next = 0
+        # send time of every packet waiting for an ack
+        self._in_flight = {}
+        # packets that were resent, their acks are not used as round trip samples
+        self._resent = set()
+        self._acked = set()
+        # unread bytes of the stream in Stages C and D
+        self._buffer = bytearray()
+
+    def getState(self) -> str:
+        return self._state
+
+    def getSecrets(self) -> list:
+        return self._secrets
+
+    def getStageTimes(self) -> dict:
+        return self._stage_times
+
+    def getFailure(self):
+        return self._failure
+
+    def getRttEstimator(self):
+        return self._rtt
+
+    def getDeadline(self):
+        """Returns the time poll should be called at, None while nothing is pending."""
+        return self._deadline
+
+    def start(self, now: float) -> list:
+        """Begin Stage A.
+
+        Args:
+            now (float): Current time.
+
+        Returns:
+            list: Actions to carry out, the Stage A request.
+        """
+        self._stage_times["start"] = now
+        padding = alignedLength(self._byte_align, len(HELLO_WORLD)) - len(HELLO_WORLD)
+        payload = HELLO_WORLD + bytes(padding)
+        self._message = Header(len(payload), 0, 1, STUDENT_ID).getBytes() + payload
+        self._state = STAGE_A
+        self._in_flight[0] = now
+        self._deadline = now + self._rtt.getRto()
+        return [(SEND, self._message)]
+
+    def feed(self, data: bytes, now: float) -> list:
+        """Handle bytes from the server, a datagram in Stages A and B or a chunk of the
+        stream in Stages C and D.
+
+        Args:
+            data (bytes): Received bytes.
+            now (float): Current time.
+
+        Returns:
+            list: Actions to carry out, in order.
+        """
+        if self._state in (STAGE_A, STAGE_B):
+            # the server answers a message that failed a check with an error reply
+            if ErrorReply.isError(data):
+                return self.fail(ErrorReply.unpackFrom(data).getReason())
+            if self._state == STAGE_A:
+                return self.feedStageA(data, now)
+            return self.feedStageB(data, now)
+        elif self._state in (STAGE_C, STAGE_D):
+            self._buffer.extend(data)
+            if ErrorReply.isError(self._buffer):
+                return self.fail(ErrorReply.unpackFrom(self._buffer).getReason())
+            if self._state == STAGE_C:
+                return self.feedStageC(now)
+            return self.feedStageD(now)
+        return []
+
+    def feedStageA(self, data: bytes, now: float) -> list:
+        if len(data) < HEADER_SIZE + StageAResponse.getSize():
+            return []
+        # only a reply to a packet sent once is a trustworthy round trip
+        if self._retransmits == 0:
+            self._rtt.sample(now - self._in_flight[0])
+        else:
+            self._rtt.clearBackoff()
+        num, length, udp_port, secret = StageAResponse.unpackFrom(data).fields()
+        self.finishStage(secret, now)
+
+        # build the Stage B packet once, only the ack number changes between packets
+        aligned = alignedLength(self._byte_align, length)
+        self._message = bytearray(HEADER_SIZE + ACK.size + aligned)
+        Header(length + 4, secret, 1, STUDENT_ID).packInto(self._message)
+        self._num = num
+        self._in_flight = {}
+        self._state = STAGE_B
+        self._retransmits = 0
+        return [(CONNECT_UDP, udp_port)] + self.fillWindow(now)
+
+    def feedStageB(self, data: bytes, now: float) -> list:
+        if len(data) < HEADER_SIZE:
+            return []
+        payload_len = HEADER.unpack_from(data)[0]
+        if payload_len == StageBResponse.getSize():
+            tcp_port, secret = StageBResponse.unpackFrom(data).fields()
+            self.finishStage(secret, now)
+            self._state = STAGE_C
+            self._deadline = now + self.RESPONSE_TIMEOUT
+            return [(CONNECT_TCP, tcp_port)]
+        if len(data) < HEADER_SIZE + ACK.size:
+            return []
+
+        (ack,) = ACK.unpack_from(data, HEADER_SIZE)
+        sent = self._in_flight.pop(ack, None)
+        if sent is None:
+            return []
+        if ack not in self._resent:
+            self._rtt.sample(now - sent)
+        else:
+            self._rtt.clearBackoff()
+        self._acked.add(ack)
+        while self._base in self._acked:
+            self._acked.remove(self._base)
+            self._base = self._base + 1
+        return self.fillWindow(now)
+
+    def fillWindow(self, now: float) -> list:
+        """Send packets never sent before until the window is full."""
+        actions = []
+        while self._next < self._num and self._next < self._base + self._window:
+            ACK.pack_into(self._message, HEADER_SIZE, self._next)
+            actions.append((SEND, bytes(self._message)))
+            self._in_flight[self._next] = now
+            self._next = self._next + 1
+        self.updateDeadline(now)
+        return actions
+
+    def feedStageC(self, now: float) -> list:
+        size = HEADER_SIZE + StageCResponse.getSize()
+        if len(self._buffer) < size:
+            return []
+        num2, length2, secret, char = StageCResponse.unpackFrom(self._buffer).fields()
+        # padding, if the server aligns its messages, came in the same send
+        self._buffer.clear()
+        self.finishStage(secret, now)
+
+        header = Header(length2, secret, 1, STUDENT_ID)
+        message = header.getBytes() + char * alignedLength(self._byte_align, length2)
+        self._state = STAGE_D
+        self._deadline = now + self.RESPONSE_TIMEOUT
+        return [(SEND, message * num2)]
+
+    def feedStageD(self, now: float) -> list:
+        if len(self._buffer) < HEADER_SIZE + StageDFinal.getSize():
+            return []
+        self.finishStage(StageDFinal.unpackFrom(self._buffer).secret, now)
+        self._state = CLOSED
+        self._deadline = None
+        return [(DONE, self._secrets)]
+
+    def connected(self, now: float) -> list:
+        """Handle the TCP connection asked for by CONNECT_TCP being established.
+
+        Args:
+            now (float): Current time.
+
+        Returns:
+            list: Actions to carry out.
+        """
+        self._deadline = now + self.RESPONSE_TIMEOUT
+        return []
+
+    def poll(self, now: float) -> list:
+        """Handle timers that went off, retransmitting lost packets.
+
+        Args:
+            now (float): Current time.
+
+        Returns:
+            list: Actions to carry out.
+        """
+        if self._deadline is None or now < self._deadline:
+            return []
+        if self._state == STAGE_A:
+            self._rtt.backoff()
+            self._retransmits = self._retransmits + 1
+            if self._retransmits > self.MAX_RETRANSMITS:
+                return self.fail("stage_a_timeout")
+            self._in_flight[0] = now
+            self._deadline = now + self._rtt.getRto()
+            return [(SEND, self._message)]
+        elif self._state == STAGE_B and self._in_flight:
+            self._retransmits = self._retransmits + 1
+            if self._retransmits >= self.MAX_TIMEOUTS:
+                return self.fail("stage_b_timeout")
+            # resend only the packets whose timer went off
+            rto = self._rtt.getRto()
+            self._rtt.backoff()
+            actions = []
+            for ack, sent in self._in_flight.items():
+                if now - sent >= rto:
+                    ACK.pack_into(self._message, HEADER_SIZE, ack)
+                    actions.append((SEND, bytes(self._message)))
+                    self._in_flight[ack] = now
+                    self._resent.add(ack)
+            self.updateDeadline(now)
+            return actions
+        elif self._state == STAGE_B:
+            return self.fail("stage_b_no_response")
+        elif self._state == STAGE_C:
+            return self.fail("stage_c_no_response")
+        elif self._state == STAGE_D:
+            return self.fail("stage_d_no_response")
+        return []
+
+    def updateDeadline(self, now: float) -> None:
+        if self._in_flight:
+            self._deadline = min(self._in_flight.values()) + self._rtt.getRto()
+        else:
+            # every packet was acknowledged, wait for the Stage B response
+            self._deadline = now + self.RESPONSE_TIMEOUT
+
+    def finishStage(self, secret: int, now: float) -> None:
+        self._secrets.append(secret)
+        self._stage_times[self._state] = now
+
+    def fail(self, reason: str) -> list:
+        """Stop the session, also used by the driver when a connection fails.
+
+        Args:
+            reason (str): Why the session stopped.
+
+        Returns:
+            list: Actions to carry out.
+        """
+        self._state = CLOSED
+        self._failure = reason
+        self._deadline = None
+        return [(FAIL, reason)]
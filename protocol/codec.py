@@ -0,0 +1,296 @@
+import struct
+
+# every message starts with payload_len, p_secret, step and student_id
+HEADER = struct.Struct(">IIHH")
+HEADER_SIZE = HEADER.size
+# client Stage B packets and server acks carry an ack number right after the header
+ACK = struct.Struct(">I")
+STAGE_B_HEADER = struct.Struct(">IIHHI")
+# bound once, getBytes runs for every message a client or server sends
+_pack_header = HEADER.pack
+
+
+class Header:
+    __slots__ = ("_payload_len", "_p_secret", "_step", "_student_id")
+
+    def __init__(self, payload_len, p_secret, step, student_id) -> None:
+        """Header object constructor.
+
+        Args:
+            payload_len (int): Payload length not including alignment.
+            p_secret (int): Previous Stage secret.
+            step (int): Current step.
+            student_id (int): Student id.
+        """
+        self._payload_len = payload_len
+        self._p_secret = p_secret
+        self._step = step
+        self._student_id = student_id
+
+    @classmethod
+    def unpackFrom(cls, buffer, offset=0):
+        """Reads a header out of a buffer without slicing it.
+
+        Args:
+            buffer (bytes | bytearray | memoryview): Buffer holding the message.
+            offset (int, optional): Where the header starts. Defaults to 0.
+
+        Returns:
+            Header: Header read from the buffer.
+        """
+        return cls(*HEADER.unpack_from(buffer, offset))
+
+    def packInto(self, buffer, offset=0) -> None:
+        """Writes the header into a writable buffer.
+
+        Args:
+            buffer (bytearray | memoryview): Buffer to write into.
+            offset (int, optional): Where the header starts. Defaults to 0.
+        """
+        HEADER.pack_into(
+            buffer, offset, self._payload_len, self._p_secret, self._step, self._student_id
+        )
+
+    def getBytes(self) -> bytes:
+        """Converts header fields into bytes. For project 1, header information is 12 bytes long.
+        Step and studnet_id get packed into 2 bytes each.
+
+        Returns:
+            bytes: Number of bytes for the header.
+        """
+        return _pack_header(self._payload_len, self._p_secret, self._step, self._student_id)
+
+    def getPayloadLen(self) -> int:
+        return self._payload_len
+
+    def getSecret(self) -> int:
+        return self._p_secret
+
+    def getStep(self) -> int:
+        return self._step
+
+    def getId(self) -> int:
+        return self._student_id
+
+    def getSize(self) -> int:
+        """Returns the size of header.
+
+        Returns:
+            int: Length of bytes in header.
+        """
+        return HEADER_SIZE
+
+
+class Message:
+    """Base class for the fixed size payloads the server sends.
+
+    Subclasses list their fields in __slots__ in wire order and set _struct.
+    """
+
+    __slots__ = ()
+    _struct = None
+
+    @classmethod
+    def getSize(cls) -> int:
+        return cls._struct.size
+
+    @classmethod
+    def unpackFrom(cls, buffer, offset=HEADER_SIZE):
+        """Reads the payload out of a buffer without slicing it.
+
+        Args:
+            buffer (bytes | bytearray | memoryview): Buffer holding the message.
+            offset (int, optional): Where the payload starts. Defaults to right after the header.
+
+        Returns:
+            Message: Payload read from the buffer.
+        """
+        return cls(*cls._struct.unpack_from(buffer, offset))
+
+    def fields(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def packInto(self, buffer, offset=HEADER_SIZE) -> None:
+        """Writes the payload into a writable buffer.
+
+        Args:
+            buffer (bytearray | memoryview): Buffer to write into.
+            offset (int, optional): Where the payload starts. Defaults to right after the header.
+        """
+        self._struct.pack_into(buffer, offset, *self.fields())
+
+    def getBytes(self) -> bytes:
+        return self._struct.pack(*self.fields())
+
+    def encode(self, header: Header) -> bytearray:
+        """Builds the full message, header and payload, in one buffer.
+
+        Args:
+            header (Header): Header to put in front of the payload.
+
+        Returns:
+            bytearray: Message ready to send.
+        """
+        buffer = bytearray(HEADER_SIZE + self._struct.size)
+        header.packInto(buffer)
+        self.packInto(buffer)
+        return buffer
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.fields() == other.fields()
+
+    def __repr__(self) -> str:
+        args = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({args})"
+
+
+class StageAResponse(Message):
+    __slots__ = ("num", "length", "udp_port", "secret")
+    _struct = struct.Struct(">IIII")
+
+    def __init__(self, num: int, length: int, udp_port: int, secret: int) -> None:
+        self.num = num
+        self.length = length
+        self.udp_port = udp_port
+        self.secret = secret
+
+
+class StageBAck(Message):
+    __slots__ = ("ack",)
+    _struct = ACK
+
+    def __init__(self, ack: int) -> None:
+        self.ack = ack
+
+
+class StageBResponse(Message):
+    __slots__ = ("tcp_port", "secret")
+    _struct = struct.Struct(">II")
+
+    def __init__(self, tcp_port: int, secret: int) -> None:
+        self.tcp_port = tcp_port
+        self.secret = secret
+
+
+class StageCResponse(Message):
+    __slots__ = ("num2", "length2", "secret", "char")
+    _struct = struct.Struct(">IIIc")
+
+    def __init__(self, num2: int, length2: int, secret: int, char: bytes) -> None:
+        self.num2 = num2
+        self.length2 = length2
+        self.secret = secret
+        self.char = char
+
+
+class StageDFinal(Message):
+    __slots__ = ("secret",)
+    _struct = struct.Struct(">I")
+
+    def __init__(self, secret: int) -> None:
+        self.secret = secret
+
+
+class ErrorReply(Message):
+    """Sent by the server instead of a response when a client message fails a check,
+    so the client can give up at once instead of waiting for a timeout.
+
+    Error replies carry STEP in the header, which no other server message uses.
+    """
+
+    __slots__ = ("code", "stage")
+    _struct = struct.Struct(">HH")
+
+    STEP = 0xFFFF
+
+    # error codes, one per server check
+    WRONG_ID = 1
+    WRONG_STEP = 2
+    WRONG_SECRET = 3
+    WRONG_LENGTH = 4
+    WRONG_PAYLOAD = 5
+    WRONG_ACK = 6
+    WRONG_TOKEN = 7
+
+    NAMES = {
+        WRONG_ID: "wrong_id",
+        WRONG_STEP: "wrong_step",
+        WRONG_SECRET: "wrong_secret",
+        WRONG_LENGTH: "wrong_length",
+        WRONG_PAYLOAD: "wrong_payload",
+        WRONG_ACK: "wrong_ack",
+        WRONG_TOKEN: "wrong_token",
+    }
+
+    def __init__(self, code: int, stage: int) -> None:
+        self.code = code
+        self.stage = stage
+
+    @classmethod
+    def isError(cls, buffer, offset=0) -> bool:
+        """Check whether a buffer holding a whole server message holds an error reply.
+
+        Args:
+            buffer (bytes | bytearray | memoryview): Buffer holding the message.
+            offset (int, optional): Where the message starts. Defaults to 0.
+
+        Returns:
+            bool: True if the message is an error reply.
+        """
+        if len(buffer) - offset < HEADER_SIZE + cls._struct.size:
+            return False
+        return HEADER.unpack_from(buffer, offset)[2] == cls.STEP
+
+    def getName(self) -> str:
+        return self.NAMES.get(self.code, f"error_{self.code}")
+
+    def getReason(self) -> str:
+        """Returns a failure reason like stage_b_wrong_secret."""
+        return f"stage_{'abcd'[self.stage] if self.stage < 4 else self.stage}_{self.getName()}"
+
+
+class ResumeToken(Message):
+    """Lets a client pick a session up again at a later stage after a failure.
+
+    The server appends one to the Stage B response, after the payload the header
+    counts, so clients that do not know about tokens never read it. To resume, the
+    client sends it back to the Stage A port with STEP in the header and the Stage B
+    secret as the previous secret, and gets a new Stage B response in return.
+    """
+
+    __slots__ = ("token", "stage")
+    _struct = struct.Struct(">IHxx")
+
+    STEP = 0xFFFE
+
+    def __init__(self, token: int, stage: int) -> None:
+        self.token = token
+        self.stage = stage
+
+    @classmethod
+    def isResume(cls, buffer, offset=0) -> bool:
+        """Check whether a client message is a resume request.
+
+        Args:
+            buffer (bytes | bytearray | memoryview): Buffer holding the message.
+            offset (int, optional): Where the message starts. Defaults to 0.
+
+        Returns:
+            bool: True if the message is a resume request.
+        """
+        if len(buffer) - offset < HEADER_SIZE:
+            return False
+        return HEADER.unpack_from(buffer, offset)[2] == cls.STEP
+
+
+def alignedLength(byte_align: int, length: int) -> int:
+    """Function that calucates the correct byte alignement needed.
+
+    Args:
+        byte_align (int): Byte alignment
+        length (int): Length to align
+
+    Returns:
+        int: The new length after alignment.
+    """
+    return (length + byte_align - 1) // byte_align * byte_align
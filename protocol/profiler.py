@@ -0,0 +1,271 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import tracemalloc
+
+# rows written to each text report
+TOP = 30
+
+# allocations made while taking snapshots and adding them up are left out
+OWN_ALLOCATIONS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+class Profiler:
+    def __init__(
+        self, directory: str, allocations=False, samples=20, top=TOP, max_shards=256
+    ) -> None:
+        """cProfile collection per session stage, with optional allocation tracking.
+
+        Stage functions are swapped for profiled wrappers by instrument, so a run
+        without a profiler executes exactly the code it did before. Every thread keeps
+        one profile per stage that is switched on for the calls of that stage, so a
+        call only enables and disables a profile. Stages call the next stage, so a
+        nested stage pauses the outer one's profile and each stage only counts its own
+        time. Profiles use wall clock time, socket waits show up as time spent in the
+        socket methods.
+
+        Args:
+            directory (str): Directory the reports are written to.
+            allocations (bool, optional): Also track allocations with tracemalloc and
+                report the lines that allocated the most in each stage. This slows
+                every allocation down. Defaults to False.
+            samples (int, optional): Calls of each stage whose allocations are added
+                up. Every sampled call takes two snapshots of the whole heap, so only
+                the first calls are sampled. Defaults to 20.
+            top (int, optional): Rows written to each text report. Defaults to TOP.
+            max_shards (int, optional): Threads kept before the profiles of exited
+                threads are folded into the totals. Defaults to 256.
+        """
+        self._directory = directory
+        self._allocations = allocations
+        self._samples = samples
+        self._top = top
+        self._max_shards = max_shards
+        # stage name to pstats.Stats, to calls, and to (file, line) -> [bytes, blocks]
+        self._stats = {}
+        self._calls = {}
+        self._allocated = {}
+        self._sampled = {}
+        # (stage, snapshot, snapshot at the start) pairs not compared yet
+        self._snapshots = []
+        self._local = threading.local()
+        # (thread, stack, profiles, calls) for every thread that ran a stage
+        self._shards = []
+        # taken to add a thread and to fold profiles, never around a stage call
+        self._lock = threading.Lock()
+
+    def getDirectory(self) -> str:
+        return self._directory
+
+    def start(self) -> None:
+        """Start allocation tracking, if enabled."""
+        if self._allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def instrument(self, owner, stages: dict) -> None:
+        """Replace stage functions on a module or class with profiled wrappers.
+
+        Functions look other stages up by name when they call them, so replacing the
+        attribute is enough to profile every call.
+
+        Args:
+            owner (module | type): Module or class holding the stage functions.
+            stages (dict): Attribute name to stage name, like {"stageA": "A"}.
+        """
+        for name, stage in stages.items():
+            setattr(owner, name, self.wrap(stage, getattr(owner, name)))
+
+    def wrap(self, stage: str, function):
+        """Profile every call of function as part of stage.
+
+        Args:
+            stage (str): Stage the calls are counted in.
+            function (callable): Function to profile.
+
+        Returns:
+            callable: Wrapper calling function.
+        """
+
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            self.push(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.pop()
+
+        return profiled
+
+    def shard(self) -> tuple:
+        """Returns the calling thread's (stack, profiles, calls)."""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # stack of [stage, snapshot] for the stages in progress
+            shard = ([], {}, {})
+            self._local.shard = shard
+            with self._lock:
+                if len(self._shards) >= self._max_shards:
+                    self.retire()
+                self._shards.append((threading.current_thread(),) + shard)
+        return shard
+
+    def push(self, stage: str) -> None:
+        stack, profiles, calls = self.shard()
+        if stack:
+            # the outer stage stops counting until this one returns
+            profiles[stack[-1][0]].disable()
+            # stages inside a call whose allocations are tracked are tracked too
+            sampled = stack[-1][1] is not None
+        else:
+            sampled = self._allocations and self._sampled.get(stage, 0) < self._samples
+        snapshot = None
+        if sampled:
+            snapshot = tracemalloc.take_snapshot()
+            # counted without the lock, a lost increment only samples one call more
+            self._sampled[stage] = self._sampled.get(stage, 0) + 1
+        if stack:
+            self.addAllocations(stack[-1][0], snapshot, stack[-1][1])
+        calls[stage] = calls.get(stage, 0) + 1
+        stack.append([stage, snapshot])
+        self.enable(profiles, stage)
+
+    def pop(self) -> None:
+        stack, profiles, _ = self._local.shard
+        stage, started = stack.pop()
+        profiles[stage].disable()
+        snapshot = None
+        if started is not None:
+            snapshot = tracemalloc.take_snapshot()
+            self.addAllocations(stage, snapshot, started)
+        if stack:
+            outer = stack[-1]
+            if outer[1] is not None:
+                outer[1] = snapshot
+            self.enable(profiles, outer[0])
+
+    def enable(self, profiles: dict, stage: str) -> None:
+        profile = profiles.get(stage)
+        if profile is None:
+            profile = profiles[stage] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # only one profiler may run at a time on newer Pythons, the call goes
+            # unprofiled while another thread's stage is being profiled
+            pass
+
+    def retire(self, everything=False) -> None:
+        """Fold the profiles of exited threads into the totals. Callers hold the lock.
+
+        Args:
+            everything (bool, optional): Also fold threads that are alive but between
+                stages, for the final reports. Defaults to False.
+        """
+        kept = []
+        for thread, stack, profiles, calls in self._shards:
+            if thread.is_alive() and (stack or not everything):
+                kept.append((thread, stack, profiles, calls))
+                continue
+            for stage, profile in profiles.items():
+                profile.create_stats()
+                if not profile.stats:
+                    continue
+                if stage in self._stats:
+                    self._stats[stage].add(profile)
+                else:
+                    self._stats[stage] = pstats.Stats(profile)
+            for stage, count in calls.items():
+                self._calls[stage] = self._calls.get(stage, 0) + count
+            # a thread still alive starts over with fresh profiles
+            profiles.clear()
+            calls.clear()
+        self._shards = kept
+
+    def addAllocations(self, stage: str, snapshot, started) -> None:
+        """Keep two snapshots to add what was allocated between them to a stage.
+
+        Comparing snapshots takes far longer than taking them, so it is left for
+        write. Allocations made by other threads in the meantime are counted too,
+        profile one session at a time for exact numbers.
+        """
+        if snapshot is None or started is None:
+            return
+        with self._lock:
+            self._snapshots.append((stage, snapshot, started))
+
+    def compareAllocations(self) -> None:
+        """Add the kept snapshot pairs up by stage and line. Callers hold the lock."""
+        for stage, snapshot, started in self._snapshots:
+            snapshot = snapshot.filter_traces(OWN_ALLOCATIONS)
+            started = started.filter_traces(OWN_ALLOCATIONS)
+            allocated = self._allocated.setdefault(stage, {})
+            for difference in snapshot.compare_to(started, "lineno"):
+                if difference.size_diff <= 0:
+                    continue
+                frame = difference.traceback[0]
+                totals = allocated.setdefault((frame.filename, frame.lineno), [0, 0])
+                totals[0] = totals[0] + difference.size_diff
+                totals[1] = totals[1] + difference.count_diff
+        self._snapshots = []
+
+    def write(self) -> list:
+        """Write the reports of every stage that ran.
+
+        For each stage, stage_X.prof holds the raw profile for pstats or snakeviz and
+        stage_X.txt the functions with the most cumulative time. With allocation
+        tracking, stage_X.allocations.txt lists the lines that allocated the most.
+
+        Returns:
+            list: Paths of the files written.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        written = []
+        with self._lock:
+            self.retire(everything=True)
+            self.compareAllocations()
+            for stage, stats in sorted(self._stats.items()):
+                path = os.path.join(self._directory, f"stage_{stage}.prof")
+                stats.dump_stats(path)
+                written.append(path)
+
+                report = io.StringIO()
+                report.write(f"stage {stage}, {self._calls[stage]} calls\n")
+                stats.stream = report
+                stats.sort_stats("cumulative").print_stats(self._top)
+                written.append(self.writeText(f"stage_{stage}.txt", report.getvalue()))
+
+            for stage, allocated in sorted(self._allocated.items()):
+                rows = sorted(allocated.items(), key=lambda row: row[1][0], reverse=True)
+                lines = [
+                    f"stage {stage}, allocations of {self._sampled.get(stage, 0)}"
+                    f" out of {self._calls.get(stage, 0)} calls"
+                ]
+                for (filename, lineno), (size, count) in rows[: self._top]:
+                    lines.append(f"{size:>12} B {count:>8} blocks  {filename}:{lineno}")
+                written.append(
+                    self.writeText(f"stage_{stage}.allocations.txt", "\n".join(lines) + "\n")
+                )
+        return written
+
+    def writeText(self, name: str, text: str) -> str:
+        path = os.path.join(self._directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def close(self) -> list:
+        """Write the reports and stop allocation tracking.
+
+        Returns:
+            list: Paths of the files written.
+        """
+        written = self.write()
+        if self._allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return written
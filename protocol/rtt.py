@@ -0,0 +1,63 @@
+class RttEstimator:
+    def __init__(self, initial_rto=1.0, min_rto=0.01, max_rto=1.0) -> None:
+        """Retransmit timer driven by measured round trips, in the style of TCP (RFC 6298).
+
+        The server drops a session after 3 seconds without a packet and withholds acks
+        on purpose, so backoff is capped well below that instead of at TCP's 60 seconds.
+
+        Args:
+            initial_rto (float, optional): Timeout in seconds before any round trip was measured. Defaults to 1.0.
+            min_rto (float, optional): Lower bound on the timeout in seconds. Defaults to 0.01.
+            max_rto (float, optional): Upper bound on the timeout in seconds. Defaults to 1.0.
+        """
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+        self._rto = initial_rto
+        # timeout from the estimate alone, without backoff
+        self._base_rto = initial_rto
+        self._srtt = None
+        self._rttvar = None
+        self._retransmits = 0
+        self._samples = 0
+
+    def getRto(self) -> float:
+        return self._rto
+
+    def getSrtt(self):
+        return self._srtt
+
+    def getRttvar(self):
+        return self._rttvar
+
+    def getRetransmits(self) -> int:
+        return self._retransmits
+
+    def getSamples(self) -> int:
+        return self._samples
+
+    def sample(self, rtt: float) -> None:
+        """Update the estimate with a round trip of a packet that was never resent.
+
+        Args:
+            rtt (float): Measured round trip in seconds.
+        """
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+        self._samples = self._samples + 1
+        self._base_rto = min(
+            max(self._srtt + 4 * self._rttvar, self._min_rto), self._max_rto
+        )
+        self._rto = self._base_rto
+
+    def clearBackoff(self) -> None:
+        """Drop any backoff once the server answers again, even for a resent packet."""
+        self._rto = self._base_rto
+
+    def backoff(self) -> None:
+        """Double the timeout after the timer went off, and count the retransmit."""
+        self._retransmits = self._retransmits + 1
+        self._rto = min(self._rto * 2, self._max_rto)
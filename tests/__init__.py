@@ -0,0 +1,9 @@
+import os
+import sys
+
+# modules in part2 import each other by bare name, and the protocol package lives at
+# the top of the repository, so both go on the path before any test module imports
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for path in (ROOT, os.path.join(ROOT, "part2")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
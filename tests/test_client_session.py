@@ -0,0 +1,153 @@
+import unittest
+from protocol.client_session import (
+    CLOSED,
+    CONNECT_TCP,
+    CONNECT_UDP,
+    DONE,
+    FAIL,
+    SEND,
+    STAGE_B,
+    STAGE_C,
+    STAGE_D,
+    ClientSession,
+)
+from protocol.codec import (
+    ACK,
+    HEADER_SIZE,
+    ErrorReply,
+    Header,
+    StageAResponse,
+    StageBAck,
+    StageBResponse,
+    StageCResponse,
+    StageDFinal,
+)
+from protocol.rtt import RttEstimator
+
+ID = 246
+
+
+def stageAResponse(num=3, length=10, port=40000, secret=11) -> bytes:
+    return bytes(StageAResponse(num, length, port, secret).encode(Header(16, 0, 0, ID)))
+
+
+def ack(ack_num: int, secret=11) -> bytes:
+    return bytes(StageBAck(ack_num).encode(Header(4, secret, 1, ID)))
+
+
+def stageBResponse(port=40001, secret=22) -> bytes:
+    return bytes(StageBResponse(port, secret).encode(Header(8, 11, 1, ID)))
+
+
+def ackNumbers(actions: list) -> list:
+    return [ACK.unpack_from(value, HEADER_SIZE)[0] for kind, value in actions if kind == SEND]
+
+
+class ClientSessionTest(unittest.TestCase):
+    def startStageB(self, window=1, num=3) -> tuple:
+        session = ClientSession(RttEstimator(initial_rto=0.5), window=window)
+        session.start(0.0)
+        actions = session.feed(stageAResponse(num=num), 0.1)
+        return session, actions
+
+    def testStageARequest(self):
+        session = ClientSession()
+        [(kind, message)] = session.start(10.0)
+        self.assertEqual(kind, SEND)
+        self.assertEqual(message, Header(12, 0, 1, ID).getBytes() + b"hello world\0")
+        self.assertEqual(session.getDeadline(), 10.0 + session.getRttEstimator().getRto())
+
+    def testStageAResponseStartsStageB(self):
+        session, actions = self.startStageB()
+        self.assertEqual(actions[0], (CONNECT_UDP, 40000))
+        self.assertEqual(ackNumbers(actions), [0])
+        self.assertEqual(session.getState(), STAGE_B)
+        self.assertEqual(session.getSecrets(), [11])
+        # the reply to a request sent once is a round trip sample
+        self.assertAlmostEqual(session.getRttEstimator().getSrtt(), 0.1)
+
+        [(_, packet)] = actions[1:]
+        self.assertEqual(len(packet), HEADER_SIZE + ACK.size + 12)
+        self.assertEqual(Header.unpackFrom(packet).getPayloadLen(), 14)
+        self.assertEqual(Header.unpackFrom(packet).getSecret(), 11)
+
+    def testStageARetransmitsThenGivesUp(self):
+        session = ClientSession(RttEstimator(initial_rto=0.5))
+        session.start(0.0)
+        self.assertEqual(session.poll(0.4), [])
+        now = 0.0
+        for _ in range(ClientSession.MAX_RETRANSMITS):
+            now = session.getDeadline()
+            [(kind, _)] = session.poll(now)
+            self.assertEqual(kind, SEND)
+        self.assertEqual(session.poll(session.getDeadline()), [(FAIL, "stage_a_timeout")])
+        self.assertEqual(session.getFailure(), "stage_a_timeout")
+
+    def testStageBStopAndWait(self):
+        session, _ = self.startStageB()
+        self.assertEqual(ackNumbers(session.feed(ack(0), 0.2)), [1])
+        # an ack for a packet not in flight changes nothing
+        self.assertEqual(session.feed(ack(0), 0.25), [])
+        self.assertEqual(ackNumbers(session.feed(ack(1), 0.3)), [2])
+
+    def testStageBWindow(self):
+        session, actions = self.startStageB(window=2, num=4)
+        self.assertEqual(ackNumbers(actions), [0, 1])
+        # packet 1 acked first, the window stays at packet 0
+        self.assertEqual(session.feed(ack(1), 0.2), [])
+        self.assertEqual(ackNumbers(session.feed(ack(0), 0.3)), [2, 3])
+
+    def testStageBResendsOnlyExpiredPackets(self):
+        session, _ = self.startStageB(window=2, num=4)
+        session.feed(ack(0), 0.15)
+        # packet 1 went out at 0.1 and packet 2 at 0.15
+        rto = session.getRttEstimator().getRto()
+        self.assertEqual(ackNumbers(session.poll(0.1 + rto)), [1])
+        self.assertEqual(session.getRttEstimator().getRetransmits(), 1)
+
+        samples = session.getRttEstimator().getSamples()
+        session.feed(ack(1), 0.1 + rto + 0.01)
+        # the ack of a resent packet is not a round trip sample
+        self.assertEqual(session.getRttEstimator().getSamples(), samples)
+
+    def testFullSession(self):
+        session, _ = self.startStageB(num=1)
+        session.feed(ack(0), 0.2)
+        self.assertEqual(session.feed(stageBResponse(), 0.3), [(CONNECT_TCP, 40001)])
+        self.assertEqual(session.getState(), STAGE_C)
+        self.assertEqual(session.connected(0.35), [])
+
+        stage_c = bytes(StageCResponse(2, 5, 33, b"k").encode(Header(13, 22, 2, ID)))
+        # the stream may deliver the Stage C response in pieces
+        self.assertEqual(session.feed(stage_c[:7], 0.4), [])
+        [(kind, data)] = session.feed(stage_c[7:], 0.4)
+        self.assertEqual(kind, SEND)
+        message = Header(5, 33, 1, ID).getBytes() + b"k" * 8
+        self.assertEqual(data, message * 2)
+        self.assertEqual(session.getState(), STAGE_D)
+
+        final = bytes(StageDFinal(44).encode(Header(4, 33, 3, ID)))
+        self.assertEqual(session.feed(final, 0.5), [(DONE, [11, 22, 33, 44])])
+        self.assertEqual(session.getState(), CLOSED)
+        self.assertIsNone(session.getDeadline())
+        self.assertEqual(set(session.getStageTimes()), {"start", "A", "B", "C", "D"})
+
+    def testErrorReply(self):
+        session, _ = self.startStageB()
+        reply = bytes(
+            ErrorReply(ErrorReply.WRONG_SECRET, 1).encode(
+                Header(ErrorReply.getSize(), 0, ErrorReply.STEP, ID)
+            )
+        )
+        self.assertEqual(session.feed(reply, 0.2), [(FAIL, "stage_b_wrong_secret")])
+        self.assertEqual(session.getState(), CLOSED)
+
+    def testNoResponseInStageC(self):
+        session, _ = self.startStageB(num=1)
+        session.feed(ack(0), 0.2)
+        session.feed(stageBResponse(), 0.3)
+        self.assertEqual(session.poll(session.getDeadline()), [(FAIL, "stage_c_no_response")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+from protocol.codec import (
+    ACK,
+    HEADER_SIZE,
+    ErrorReply,
+    Header,
+    ResumeToken,
+    StageAResponse,
+    StageBAck,
+    StageBResponse,
+    StageCResponse,
+    StageDFinal,
+    alignedLength,
+)
+
+
+class HeaderTest(unittest.TestCase):
+    def testRoundTrip(self):
+        header = Header(12, 0, 1, 246)
+        data = header.getBytes()
+        self.assertEqual(len(data), HEADER_SIZE)
+        self.assertEqual(data, bytes.fromhex("0000000c 00000000 0001 00f6"))
+        parsed = Header.unpackFrom(data)
+        self.assertEqual(
+            (parsed.getPayloadLen(), parsed.getSecret(), parsed.getStep(), parsed.getId()),
+            (12, 0, 1, 246),
+        )
+
+    def testPackIntoOffset(self):
+        buffer = bytearray(4 + HEADER_SIZE)
+        Header(8, 1234, 2, 246).packInto(buffer, 4)
+        self.assertEqual(buffer[:4], bytes(4))
+        self.assertEqual(Header.unpackFrom(buffer, 4).getSecret(), 1234)
+
+
+class MessageTest(unittest.TestCase):
+    MESSAGES = (
+        StageAResponse(12, 40, 50000, 77),
+        StageBAck(5),
+        StageBResponse(50001, 88),
+        StageCResponse(20, 64, 99, b"x"),
+        StageDFinal(4242),
+    )
+
+    def testRoundTrip(self):
+        for message in self.MESSAGES:
+            with self.subTest(message=message):
+                encoded = message.encode(Header(message.getSize(), 7, 2, 246))
+                self.assertEqual(len(encoded), HEADER_SIZE + message.getSize())
+                self.assertEqual(Header.unpackFrom(encoded).getPayloadLen(), message.getSize())
+                self.assertEqual(type(message).unpackFrom(encoded), message)
+                self.assertEqual(encoded[HEADER_SIZE:], message.getBytes())
+
+    def testWireSizes(self):
+        self.assertEqual(StageAResponse.getSize(), 16)
+        self.assertEqual(StageBAck.getSize(), ACK.size)
+        self.assertEqual(StageBResponse.getSize(), 8)
+        self.assertEqual(StageCResponse.getSize(), 13)
+        self.assertEqual(StageDFinal.getSize(), 4)
+
+    def testFieldsInWireOrder(self):
+        self.assertEqual(StageAResponse(1, 2, 3, 4).fields(), (1, 2, 3, 4))
+        self.assertEqual(
+            StageAResponse(1, 2, 3, 4).getBytes(),
+            bytes.fromhex("00000001 00000002 00000003 00000004"),
+        )
+
+    def testEquality(self):
+        self.assertEqual(StageDFinal(1), StageDFinal(1))
+        self.assertNotEqual(StageDFinal(1), StageDFinal(2))
+        self.assertNotEqual(StageDFinal(5), StageBAck(5))
+
+
+class ErrorReplyTest(unittest.TestCase):
+    def encode(self, code: int, stage: int) -> bytearray:
+        header = Header(ErrorReply.getSize(), 0, ErrorReply.STEP, 246)
+        return ErrorReply(code, stage).encode(header)
+
+    def testRoundTrip(self):
+        encoded = self.encode(ErrorReply.WRONG_ACK, 1)
+        self.assertEqual(encoded[HEADER_SIZE:], bytes.fromhex("0006 0001"))
+        reply = ErrorReply.unpackFrom(encoded)
+        self.assertEqual((reply.code, reply.stage), (ErrorReply.WRONG_ACK, 1))
+
+    def testIsError(self):
+        self.assertTrue(ErrorReply.isError(self.encode(ErrorReply.WRONG_ID, 0)))
+        self.assertTrue(ErrorReply.isError(bytes(2) + self.encode(ErrorReply.WRONG_ID, 0), 2))
+        self.assertFalse(ErrorReply.isError(StageDFinal(1).encode(Header(4, 1, 3, 246))))
+        # a header alone is too short to hold an error reply
+        self.assertFalse(ErrorReply.isError(self.encode(ErrorReply.WRONG_ID, 0)[:HEADER_SIZE]))
+
+    def testReason(self):
+        self.assertEqual(ErrorReply(ErrorReply.WRONG_SECRET, 1).getReason(), "stage_b_wrong_secret")
+        self.assertEqual(ErrorReply(ErrorReply.WRONG_TOKEN, 2).getReason(), "stage_c_wrong_token")
+        self.assertEqual(ErrorReply(ErrorReply.WRONG_PAYLOAD, 3).getReason(), "stage_d_wrong_payload")
+        # codes and stages from a newer server still give a usable reason
+        self.assertEqual(ErrorReply(99, 7).getReason(), "stage_7_error_99")
+
+    def testEveryCodeNamed(self):
+        for code in range(ErrorReply.WRONG_ID, ErrorReply.WRONG_TOKEN + 1):
+            self.assertIn(code, ErrorReply.NAMES)
+
+
+class ResumeTokenTest(unittest.TestCase):
+    def testRoundTrip(self):
+        token = ResumeToken(0xDEADBEEF, 2)
+        self.assertEqual(token.getBytes(), bytes.fromhex("deadbeef 0002 0000"))
+        encoded = token.encode(Header(ResumeToken.getSize(), 5, ResumeToken.STEP, 246))
+        self.assertEqual(ResumeToken.unpackFrom(encoded), token)
+
+    def testIsResume(self):
+        request = ResumeToken(1, 2).encode(Header(ResumeToken.getSize(), 5, ResumeToken.STEP, 246))
+        self.assertTrue(ResumeToken.isResume(request))
+        self.assertFalse(ResumeToken.isResume(Header(12, 0, 1, 246).getBytes() + b"hello world\0"))
+        self.assertFalse(ResumeToken.isResume(request[: HEADER_SIZE - 1]))
+
+    def testTokenAfterStageBResponse(self):
+        # the header only counts the Stage B response, the token follows it
+        message = StageBResponse(50001, 88).encode(Header(8, 7, 1, 246))
+        message.extend(ResumeToken(1234, 2).getBytes())
+        self.assertEqual(Header.unpackFrom(message).getPayloadLen(), StageBResponse.getSize())
+        offset = HEADER_SIZE + StageBResponse.getSize()
+        self.assertEqual(ResumeToken.unpackFrom(message, offset).token, 1234)
+
+
+class AlignedLengthTest(unittest.TestCase):
+    def testAlignsUpToMultiple(self):
+        self.assertEqual([alignedLength(4, n) for n in range(9)], [0, 4, 4, 4, 4, 8, 8, 8, 8])
+
+    def testOtherAlignments(self):
+        self.assertEqual(alignedLength(1, 13), 13)
+        self.assertEqual(alignedLength(8, 13), 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from rate_limiter import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    def testBurstThenDenied(self):
+        limiter = RateLimiter(rate=2, burst=3)
+        self.assertEqual([limiter.allow("h", now=0.0) for _ in range(4)], [True] * 3 + [False])
+
+    def testRefillsAtRate(self):
+        limiter = RateLimiter(rate=2, burst=3)
+        for _ in range(3):
+            limiter.allow("h", now=0.0)
+        # half a second at 2 per second refills one token
+        self.assertFalse(limiter.allow("h", now=0.25))
+        self.assertTrue(limiter.allow("h", now=0.5))
+        self.assertFalse(limiter.allow("h", now=0.5))
+
+    def testRefillCappedAtBurst(self):
+        limiter = RateLimiter(rate=100, burst=2)
+        limiter.allow("h", now=0.0)
+        # a long pause never gives more than burst tokens back
+        self.assertEqual(
+            [limiter.allow("h", now=0.01) for _ in range(3)], [True, True, False]
+        )
+
+    def testHostsHaveOwnBuckets(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertTrue(limiter.allow("a", now=0.0))
+        self.assertFalse(limiter.allow("a", now=0.0))
+        self.assertTrue(limiter.allow("b", now=0.0))
+
+    def testFullyRefilledBucketsExpire(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        limiter.allow("a", now=0.0)
+        limiter.allow("b", now=1.0)
+        self.assertEqual(limiter.getSources(), 2)
+        # a refills 2 seconds after its last request, b is still refilling
+        limiter.allow("c", now=2.5)
+        self.assertEqual(limiter.getSources(), 2)
+        limiter.allow("c", now=3.0)
+        self.assertEqual(limiter.getSources(), 1)
+
+    def testEvictsLeastRecentlySeen(self):
+        limiter = RateLimiter(rate=1, burst=5, max_sources=2)
+        limiter.allow("a", now=0.0)
+        limiter.allow("b", now=0.0)
+        limiter.allow("a", now=0.1)
+        limiter.allow("c", now=0.2)
+        self.assertEqual(limiter.getSources(), 2)
+        # b was evicted, so it starts over with a full bucket
+        self.assertEqual([limiter.allow("b", now=0.3) for _ in range(5)], [True] * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
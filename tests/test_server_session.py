@@ -0,0 +1,286 @@
+import unittest
+from unittest import mock
+from header import (
+    ACK,
+    HEADER_SIZE,
+    ErrorReply,
+    Header,
+    ResumeToken,
+    StageAResponse,
+    StageBAck,
+    StageBResponse,
+    StageCResponse,
+    StageDFinal,
+    alignedLength,
+)
+from server import Server
+from server_session import (
+    BIND_TCP,
+    BIND_UDP,
+    BINDING_TCP,
+    CLOSED,
+    DONE,
+    FAIL,
+    SEND,
+    STAGE_B,
+    STAGE_C,
+    STAGE_D,
+    ServerSession,
+)
+
+ID = 246
+HELLO = b"hello world\0"
+
+
+def highest(low: int, high: int) -> int:
+    # every random pick takes its upper bound, so the server always acks
+    return high
+
+
+def stageAMessage(student_id=ID) -> bytes:
+    return Header(len(HELLO), 0, 1, student_id).getBytes() + HELLO
+
+
+def stageBPacket(session, ack_num: int, secret=None) -> bytes:
+    length = session.getLength()
+    packet = bytearray(HEADER_SIZE + ACK.size + alignedLength(4, length))
+    secret = session.getSecret() if secret is None else secret
+    Header(length + 4, secret, 1, ID).packInto(packet)
+    ACK.pack_into(packet, HEADER_SIZE, ack_num)
+    return bytes(packet)
+
+
+def stageDMessage(stage_c: StageCResponse, char=None) -> bytes:
+    payload = (char or stage_c.char) * stage_c.length2
+    padding = bytes(alignedLength(4, stage_c.length2) - stage_c.length2)
+    return Header(stage_c.length2, stage_c.secret, 1, ID).getBytes() + payload + padding
+
+
+def errorCode(actions: list) -> int:
+    kind, message = actions[0]
+    assert kind == SEND and ErrorReply.isError(message)
+    return ErrorReply.unpackFrom(message).code
+
+
+@mock.patch("server_session.random.randint", highest)
+class ServerSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server("localhost", 0, stage_b_window=1)
+
+    def startStageB(self, session) -> StageAResponse:
+        self.assertEqual(session.feed(stageAMessage()), [(BIND_UDP, None)])
+        [(kind, message)] = session.bound(40000)
+        self.assertEqual(kind, SEND)
+        self.assertEqual(session.getState(), STAGE_B)
+        return StageAResponse.unpackFrom(message)
+
+    def finishStageB(self, session) -> list:
+        actions = []
+        for ack_num in range(session.getNum()):
+            actions = session.feed(stageBPacket(session, ack_num))
+        return actions
+
+    def startStageD(self, session) -> StageCResponse:
+        self.startStageB(session)
+        self.finishStageB(session)
+        session.bound(40001)
+        [(kind, message)] = session.connected()
+        self.assertEqual(kind, SEND)
+        self.assertEqual(session.getState(), STAGE_D)
+        return StageCResponse.unpackFrom(message)
+
+    def testStageA(self):
+        session = ServerSession(self.server)
+        response = self.startStageB(session)
+        self.assertEqual(response.fields(), (32, 128, 40000, 10000))
+        self.assertEqual((session.getNum(), session.getLength()), (32, 128))
+        self.assertEqual(self.server.getStats()["sessions_started"], 1)
+
+    def testStageASecretFromBackend(self):
+        session = ServerSession(self.server)
+        session.feed(stageAMessage())
+        [(_, message)] = session.bound(40000, secret=77)
+        self.assertEqual(StageAResponse.unpackFrom(message).secret, 77)
+        self.assertEqual(Header.unpackFrom(message).getSecret(), 0)
+
+    def testStageBAcksEveryPacket(self):
+        session = ServerSession(self.server)
+        self.startStageB(session)
+        actions = session.feed(stageBPacket(session, 0))
+        self.assertEqual(actions, [(SEND, bytes(StageBAck(0).encode(Header(4, 10000, 1, ID))))])
+        self.assertEqual(session.getAck(), 1)
+
+    def testStageBDoneAsksForTcpPort(self):
+        session = ServerSession(self.server)
+        self.startStageB(session)
+        actions = self.finishStageB(session)
+        self.assertEqual(actions[-1], (BIND_TCP, None))
+        self.assertEqual(session.getState(), BINDING_TCP)
+
+        [(kind, message)] = session.bound(40001)
+        self.assertEqual(kind, SEND)
+        self.assertEqual(StageBResponse.unpackFrom(message).tcp_port, 40001)
+        self.assertEqual(session.getState(), STAGE_C)
+
+    def testStageBDuplicateIgnored(self):
+        session = ServerSession(self.server)
+        self.startStageB(session)
+        session.feed(stageBPacket(session, 0))
+        session.feed(stageBPacket(session, 1))
+        # packet 0 again is a retransmit of an acked packet, not an error
+        self.assertEqual(session.feed(stageBPacket(session, 0)), [])
+        self.assertEqual(session.getAck(), 2)
+        self.assertEqual(session.getState(), STAGE_B)
+
+        session.close()
+        stats = self.server.getStats()
+        self.assertEqual(stats["stage_b_retransmits"], 1)
+        self.assertEqual(stats["stage_b_duplicates"], 1)
+
+    def testStageBOutOfWindowRejected(self):
+        session = ServerSession(self.server)
+        self.startStageB(session)
+        # with a window of 1 only the next packet may arrive
+        actions = session.feed(stageBPacket(session, 1))
+        self.assertEqual(errorCode(actions), ErrorReply.WRONG_ACK)
+        self.assertEqual(actions[-1], (FAIL, "stage_b_wrong_ack"))
+        self.assertEqual(session.getState(), CLOSED)
+
+    def testStageBWindowAcksOutOfOrder(self):
+        self.server = Server("localhost", 0, stage_b_window=4)
+        session = ServerSession(self.server)
+        self.startStageB(session)
+        session.feed(stageBPacket(session, 2))
+        session.feed(stageBPacket(session, 1))
+        self.assertEqual(session.getAck(), 0)
+        session.feed(stageBPacket(session, 0))
+        self.assertEqual(session.getAck(), 3)
+        # past the window
+        actions = session.feed(stageBPacket(session, 7))
+        self.assertEqual(errorCode(actions), ErrorReply.WRONG_ACK)
+
+    def testStageBAckPastNumRejected(self):
+        self.server = Server("localhost", 0, stage_b_window=64)
+        session = ServerSession(self.server)
+        self.startStageB(session)
+        actions = session.feed(stageBPacket(session, session.getNum()))
+        self.assertEqual(errorCode(actions), ErrorReply.WRONG_ACK)
+
+    def testStageCAndD(self):
+        session = ServerSession(self.server)
+        stage_c = self.startStageD(session)
+        self.assertEqual(stage_c.fields(), (32, 128, 10000, b"z"))
+
+        message = stageDMessage(stage_c)
+        for _ in range(stage_c.num2 - 1):
+            self.assertEqual(session.feed(message), [])
+        actions = session.feed(message)
+        self.assertEqual(actions[-1], (DONE, None))
+        self.assertEqual(StageDFinal.unpackFrom(actions[0][1]).secret, 10000)
+        self.assertEqual(session.getState(), CLOSED)
+        self.assertEqual(self.server.getStats()["sessions_completed"], 1)
+
+    def testStageDFragmentedAndCoalesced(self):
+        session = ServerSession(self.server)
+        stage_c = self.startStageD(session)
+        stream = stageDMessage(stage_c) * stage_c.num2
+        # odd sized chunks split headers and payloads and join messages together
+        actions = []
+        for start in range(0, len(stream), 7):
+            actions = session.feed(stream[start : start + 7])
+            if start + 7 < len(stream):
+                self.assertEqual(actions, [])
+        self.assertEqual(actions[-1], (DONE, None))
+
+    def testStageDWrongPayload(self):
+        session = ServerSession(self.server)
+        stage_c = self.startStageD(session)
+        actions = session.feed(stageDMessage(stage_c, char=b"a"))
+        self.assertEqual(errorCode(actions), ErrorReply.WRONG_PAYLOAD)
+        self.assertEqual(actions[-1], (FAIL, "stage_d_wrong_payload"))
+
+    def testBadStageA(self):
+        cases = {
+            "wrong id": (stageAMessage(student_id=1), ErrorReply.WRONG_ID),
+            "short": (b"\0" * 4, ErrorReply.WRONG_LENGTH),
+            "wrong payload": (
+                Header(len(HELLO), 0, 1, ID).getBytes() + b"hello there\0",
+                ErrorReply.WRONG_PAYLOAD,
+            ),
+            "wrong secret": (Header(len(HELLO), 5, 1, ID).getBytes() + HELLO, ErrorReply.WRONG_SECRET),
+            "wrong step": (Header(len(HELLO), 0, 2, ID).getBytes() + HELLO, ErrorReply.WRONG_STEP),
+        }
+        for name, (message, code) in cases.items():
+            with self.subTest(name):
+                session = ServerSession(self.server)
+                actions = session.feed(message)
+                self.assertEqual(errorCode(actions), code)
+                self.assertEqual(actions[-1][0], FAIL)
+                self.assertEqual(session.getState(), CLOSED)
+
+    def testBadStageB(self):
+        cases = {
+            "wrong secret": (lambda s: stageBPacket(s, 0, secret=1), ErrorReply.WRONG_SECRET),
+            "short": (lambda s: stageBPacket(s, 0)[:-4], ErrorReply.WRONG_LENGTH),
+            "nonzero payload": (lambda s: stageBPacket(s, 0)[:-1] + b"\1", ErrorReply.WRONG_PAYLOAD),
+        }
+        for name, (packet, code) in cases.items():
+            with self.subTest(name):
+                session = ServerSession(self.server)
+                self.startStageB(session)
+                self.assertEqual(errorCode(session.feed(packet(session))), code)
+
+    def testTimeout(self):
+        session = ServerSession(self.server)
+        self.startStageB(session)
+        self.assertEqual(session.timeout(), [(FAIL, "stage_b_timeout")])
+        self.assertEqual(session.feed(stageBPacket(session, 0)), [])
+        self.assertEqual(session.timeout(), [])
+
+    def testResume(self):
+        self.server = Server("localhost", 0, resume_ttl=10)
+        session = ServerSession(self.server, "10.0.0.1")
+        self.startStageB(session)
+        self.finishStageB(session)
+        [(_, message)] = session.bound(40001)
+        token = ResumeToken.unpackFrom(message, HEADER_SIZE + StageBResponse.getSize())
+        request = Header(ResumeToken.getSize(), 10000, ResumeToken.STEP, ID).getBytes()
+        request = request + ResumeToken(token.token, 2).getBytes()
+
+        # only the host the token was issued to may resume, others do not use it up
+        resumed = ServerSession(self.server, "10.0.0.2")
+        self.assertEqual(errorCode(resumed.feed(request)), ErrorReply.WRONG_TOKEN)
+
+        resumed = ServerSession(self.server, "10.0.0.1")
+        self.assertEqual(resumed.feed(request), [(BIND_TCP, None)])
+        [(_, message)] = resumed.bound(40002)
+        self.assertEqual(StageBResponse.unpackFrom(message).fields(), (40002, 10000))
+        self.assertEqual(resumed.getState(), STAGE_C)
+
+        # the reply was lost and the client sent the same request again
+        again = ServerSession(self.server, "10.0.0.1")
+        self.assertEqual(again.feed(request), [(SEND, bytes(message)), (DONE, None)])
+        self.assertEqual(again.getState(), CLOSED)
+        self.assertEqual(self.server.getStats()["resume_replies_resent"], 1)
+        self.assertEqual(self.server.getStats()["sessions_resumed"], 1)
+
+    def testResumeWrongSecret(self):
+        self.server = Server("localhost", 0, resume_ttl=10)
+        token = self.server.getSessionCache().issue("10.0.0.1", (10000, 10000))
+        request = Header(ResumeToken.getSize(), 1, ResumeToken.STEP, ID).getBytes()
+        request = request + ResumeToken(token, 2).getBytes()
+        session = ServerSession(self.server, "10.0.0.1")
+        self.assertEqual(errorCode(session.feed(request)), ErrorReply.WRONG_SECRET)
+
+        # a wrong secret does not use the token up for the client that has the right one
+        request = Header(ResumeToken.getSize(), 10000, ResumeToken.STEP, ID).getBytes()
+        request = request + ResumeToken(token, 2).getBytes()
+        session = ServerSession(self.server, "10.0.0.1")
+        self.assertEqual(session.feed(request), [(BIND_TCP, None)])
+        [(_, message)] = session.bound(40002)
+        self.assertEqual(StageBResponse.unpackFrom(message).fields(), (40002, 10000))
+        self.assertEqual(self.server.getStats()["sessions_resumed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from session_cache import SessionCache
+
+
+class SessionCacheTest(unittest.TestCase):
+    def testTakeReturnsIssuedState(self):
+        cache = SessionCache(ttl=10)
+        token = cache.issue("h", ("state",), now=0.0)
+        self.assertNotEqual(token, 0)
+        self.assertEqual(cache.take(token, "h", now=1.0), (("state",), None))
+
+    def testUnknownToken(self):
+        cache = SessionCache(ttl=10)
+        token = cache.issue("h", 1, now=0.0)
+        self.assertIsNone(cache.take(token + 1, "h", now=1.0))
+
+    def testOtherHostRefusedWithoutUsingToken(self):
+        cache = SessionCache(ttl=10)
+        token = cache.issue("h", 1, now=0.0)
+        self.assertIsNone(cache.take(token, "other", now=1.0))
+        self.assertEqual(cache.take(token, "h", now=1.0), (1, None))
+
+    def testGetDoesNotClaim(self):
+        cache = SessionCache(ttl=10)
+        token = cache.issue("h", 1, now=0.0)
+        self.assertEqual(cache.get(token, "h", now=1.0), 1)
+        self.assertIsNone(cache.get(token, "other", now=1.0))
+        self.assertIsNone(cache.get(token, "h", now=10.0))
+        token = cache.issue("h", 2, now=10.0)
+        cache.get(token, "h", now=11.0)
+        self.assertEqual(cache.take(token, "h", now=11.0), (2, None))
+
+    def testRepeatedClaimGetsRecordedReply(self):
+        cache = SessionCache(ttl=10)
+        token = cache.issue("h", 1, now=0.0)
+        cache.take(token, "h", now=1.0)
+        # nothing to resend until the first claim answered
+        self.assertEqual(cache.take(token, "h", now=1.1), (1, b""))
+        cache.answer(token, b"reply")
+        self.assertEqual(cache.take(token, "h", now=1.2), (1, b"reply"))
+        self.assertEqual(cache.take(token, "h", now=1.3), (1, b"reply"))
+
+    def testExpiresAfterTtl(self):
+        cache = SessionCache(ttl=10)
+        token = cache.issue("h", 1, now=0.0)
+        self.assertIsNone(cache.take(token, "h", now=10.0))
+        self.assertEqual(cache.getSize(), 0)
+
+    def testClaimedTokensExpireToo(self):
+        cache = SessionCache(ttl=10)
+        token = cache.issue("h", 1, now=0.0)
+        cache.take(token, "h", now=1.0)
+        cache.answer(token, b"reply")
+        self.assertIsNone(cache.take(token, "h", now=10.5))
+
+    def testEvictsExpiredInIssueOrder(self):
+        cache = SessionCache(ttl=10)
+        first = cache.issue("h", 1, now=0.0)
+        second = cache.issue("h", 2, now=5.0)
+        # issuing drops every entry whose ttl ran out, and only those
+        cache.issue("h", 3, now=12.0)
+        self.assertEqual(cache.getSize(), 2)
+        self.assertIsNone(cache.take(first, "h", now=12.0))
+        self.assertEqual(cache.take(second, "h", now=12.0), (2, None))
+
+    def testEvictsOldestWhenFull(self):
+        cache = SessionCache(ttl=10, max_entries=2)
+        first = cache.issue("h", 1, now=0.0)
+        second = cache.issue("h", 2, now=0.1)
+        third = cache.issue("h", 3, now=0.2)
+        self.assertEqual(cache.getSize(), 2)
+        self.assertIsNone(cache.take(first, "h", now=0.3))
+        self.assertEqual(cache.take(second, "h", now=0.3), (2, None))
+        self.assertEqual(cache.take(third, "h", now=0.3), (3, None))
+
+    def testAnswerUnknownTokenIgnored(self):
+        cache = SessionCache(ttl=10)
+        cache.answer(1234, b"reply")
+        self.assertEqual(cache.getSize(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
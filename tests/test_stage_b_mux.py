@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+from header import Header
+from stage_b_mux import StageBMux
+from transport import LoopbackTransport
+
+ID = 246
+
+
+def same(low: int, high: int) -> int:
+    # every session picks the same secret
+    return 7
+
+
+class StageBMuxTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = LoopbackTransport()
+
+    @mock.patch("stage_b_mux.random.randint", same)
+    def testRegisterFailsWhenNoSecretIsFree(self):
+        mux = StageBMux("localhost", 1, transport=self.transport)
+        session = mux.register()
+        self.assertEqual(session.getSecret(), 7)
+        with self.assertRaises(OSError):
+            mux.register()
+
+        # a closed session frees its secret again
+        session.close()
+        self.assertEqual(mux.register().getSecret(), 7)
+
+    @mock.patch("stage_b_mux.random.randint", same)
+    def testSameSecretOnTwoPortsFromOneClient(self):
+        mux = StageBMux("localhost", 2, transport=self.transport)
+        first = mux.register()
+        second = mux.register()
+        self.assertNotEqual(first.getPort(), second.getPort())
+        first.settimeout(1)
+        second.settimeout(1)
+
+        client = self.transport.udp()
+        client.bind(("localhost", 0))
+        to_first = Header(4, 7, 1, ID).getBytes() + b"\0\0\0\1"
+        to_second = Header(4, 7, 1, ID).getBytes() + b"\0\0\0\2"
+        client.sendto(to_first, ("localhost", first.getPort()))
+        self.assertEqual(first.recvfrom(1024)[0], to_first)
+        # the client is known on the first port now, its packet to the second port
+        # still reaches the second session
+        client.sendto(to_second, ("localhost", second.getPort()))
+        self.assertEqual(second.recvfrom(1024)[0], to_second)
+        client.sendto(to_first, ("localhost", first.getPort()))
+        self.assertEqual(first.recvfrom(1024)[0], to_first)
+
+
+if __name__ == "__main__":
+    unittest.main()
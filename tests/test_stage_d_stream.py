@@ -0,0 +1,108 @@
+import unittest
+from header import ErrorReply, Header, StageCResponse, alignedLength
+from server import Server
+from server_session import PAYLOAD_BLOCK_SIZE, StageDStream
+
+ID = 246
+
+
+def message(stage_c: StageCResponse, char=None, secret=None) -> bytes:
+    secret = stage_c.secret if secret is None else secret
+    payload = (char or stage_c.char) * stage_c.length2
+    padding = bytes(alignedLength(4, stage_c.length2) - stage_c.length2)
+    return Header(stage_c.length2, secret, 1, ID).getBytes() + payload + padding
+
+
+class StageDStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server("localhost", 0)
+        # 37 is not aligned, so every message ends in 3 bytes of padding
+        self.stage_c = StageCResponse(5, 37, 4321, b"q")
+        self.stream = StageDStream(self.server, self.stage_c)
+
+    def feedChunks(self, data: bytes, size: int) -> int:
+        for start in range(0, len(data), size):
+            code = self.stream.feed(data[start : start + size])
+            if code:
+                return code
+        return 0
+
+    def testWholeMessages(self):
+        for acked in range(1, 6):
+            self.assertEqual(self.stream.feed(message(self.stage_c)), 0)
+            self.assertEqual(self.stream.getAcked(), acked)
+
+    def testFragmented(self):
+        data = message(self.stage_c) * 5
+        for size in (1, 3, 5, 12, 13):
+            with self.subTest(size=size):
+                self.stream = StageDStream(self.server, self.stage_c)
+                self.assertEqual(self.feedChunks(data, size), 0)
+                self.assertEqual(self.stream.getAcked(), 5)
+
+    def testHeaderSplitAcrossChunks(self):
+        data = message(self.stage_c)
+        self.assertEqual(self.stream.feed(data[:5]), 0)
+        self.assertEqual(self.stream.feed(data[5:20]), 0)
+        self.assertEqual(self.stream.getAcked(), 0)
+        self.assertEqual(self.stream.feed(data[20:]), 0)
+        self.assertEqual(self.stream.getAcked(), 1)
+
+    def testCoalesced(self):
+        self.assertEqual(self.stream.feed(message(self.stage_c) * 5), 0)
+        self.assertEqual(self.stream.getAcked(), 5)
+
+    def testCoalescedAcrossChunkBoundaries(self):
+        # each chunk ends partway through the next message
+        data = message(self.stage_c) * 5
+        size = len(message(self.stage_c)) + 7
+        self.assertEqual(self.feedChunks(data, size), 0)
+        self.assertEqual(self.stream.getAcked(), 5)
+
+    def testBytesAfterLastMessageIgnored(self):
+        self.assertEqual(self.stream.feed(message(self.stage_c) * 6), 0)
+        self.assertEqual(self.stream.getAcked(), 5)
+
+    def testPaddingNotChecked(self):
+        data = bytearray(message(self.stage_c))
+        data[-1] = 0xFF
+        self.assertEqual(self.stream.feed(data), 0)
+        self.assertEqual(self.stream.getAcked(), 1)
+
+    def testWrongPayloadInLaterMessage(self):
+        data = message(self.stage_c) * 2 + message(self.stage_c, char=b"r")
+        self.assertEqual(self.feedChunks(data, 7), ErrorReply.WRONG_PAYLOAD)
+        self.assertEqual(self.stream.getAcked(), 2)
+
+    def testWrongHeader(self):
+        cases = {
+            "wrong secret": (message(self.stage_c, secret=1), ErrorReply.WRONG_SECRET),
+            "wrong length": (
+                Header(36, 4321, 1, ID).getBytes() + b"q" * 40,
+                ErrorReply.WRONG_LENGTH,
+            ),
+            "wrong id": (Header(37, 4321, 1, 1).getBytes() + b"q" * 40, ErrorReply.WRONG_ID),
+        }
+        for name, (data, code) in cases.items():
+            with self.subTest(name):
+                stream = StageDStream(self.server, self.stage_c)
+                # the header is only checked once all of it arrived
+                self.assertEqual(stream.feed(data[:11]), 0)
+                self.assertEqual(stream.feed(data[11:]), code)
+
+    def testMessagesLargerThanPayloadBlock(self):
+        stage_c = StageCResponse(2, PAYLOAD_BLOCK_SIZE * 2 + 5, 4321, b"q")
+        stream = StageDStream(self.server, stage_c)
+        data = message(stage_c) * 2
+        for start in range(0, len(data), 40000):
+            self.assertEqual(stream.feed(memoryview(data)[start : start + 40000]), 0)
+        self.assertEqual(stream.getAcked(), 2)
+
+        data = bytearray(message(stage_c))
+        data[PAYLOAD_BLOCK_SIZE + 100] = ord("r")
+        stream = StageDStream(self.server, stage_c)
+        self.assertEqual(stream.feed(data), ErrorReply.WRONG_PAYLOAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import io
+import threading
+import time
+import unittest
+from logger import Logger
+from timer_wheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.log = Logger(stream=self.stream)
+        # one second ticks, the clock is only moved by advance(now)
+        self.wheel = TimerWheel(self.log, tick=1.0, slots=4)
+        self.start = time.monotonic()
+        self.fired = []
+
+    def advanceTo(self, ticks: int) -> int:
+        return self.wheel.advance(self.start + ticks)
+
+    def testRoundsUpToNextTick(self):
+        self.wheel.schedule(2.5, lambda: self.fired.append("t"))
+        self.advanceTo(2)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.advanceTo(3), 1)
+        self.assertEqual(self.fired, ["t"])
+
+    def testWrapsAroundTheWheel(self):
+        # 10 ticks on a 4 slot wheel passes the timer's slot twice before it is due
+        self.wheel.schedule(10, lambda: self.fired.append("late"))
+        self.wheel.schedule(2, lambda: self.fired.append("early"))
+        for ticks in range(1, 10):
+            self.advanceTo(ticks)
+            self.assertNotIn("late", self.fired, f"fired after {ticks} ticks")
+        self.assertEqual(self.fired, ["early"])
+        self.advanceTo(10)
+        self.assertEqual(self.fired, ["early", "late"])
+
+    def testCatchesUpOnSeveralTicksAtOnce(self):
+        for delay in (1, 3, 6):
+            self.wheel.schedule(delay, lambda delay=delay: self.fired.append(delay))
+        self.assertEqual(self.advanceTo(6), 3)
+        self.assertEqual(self.fired, [1, 3, 6])
+
+    def testCancelledTimersNeverRun(self):
+        timer = self.wheel.schedule(1, lambda: self.fired.append("t"))
+        self.wheel.cancel(timer)
+        self.assertEqual(self.advanceTo(5), 0)
+        self.assertEqual(self.fired, [])
+
+    def testCallbackMayScheduleAnother(self):
+        def reschedule():
+            self.fired.append("first")
+            self.wheel.schedule(1, lambda: self.fired.append("second"))
+
+        self.wheel.schedule(1, reschedule)
+        self.advanceTo(1)
+        self.advanceTo(2)
+        self.assertEqual(self.fired, ["first", "second"])
+
+    def testFailingCallbackIsLoggedAndOthersRun(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        self.wheel.schedule(1, fail)
+        self.wheel.schedule(1, lambda: self.fired.append("t"))
+        self.log.start()
+        self.advanceTo(1)
+        self.log.close()
+        self.assertEqual(self.fired, ["t"])
+        self.assertIn(
+            "event=timer_callback_failed error=RuntimeError reason=boom",
+            self.stream.getvalue(),
+        )
+
+
+class DeadlineTest(unittest.TestCase):
+    def testExpiresOnlyAfterIdleTimeout(self):
+        wheel = TimerWheel(Logger(), tick=0.01, slots=16)
+        expired = threading.Event()
+        deadline = wheel.watch(0.1, expired.set)
+        wheel.start()
+        # activity keeps pushing the deadline back
+        for _ in range(5):
+            time.sleep(0.04)
+            deadline.touch()
+        self.assertFalse(expired.is_set())
+        self.assertTrue(expired.wait(2))
+        self.assertTrue(deadline.expired())
+        self.assertTrue(deadline.cancel())
+
+    def testCancelBeforeExpiry(self):
+        wheel = TimerWheel(Logger(), tick=0.01, slots=16)
+        expired = threading.Event()
+        deadline = wheel.watch(0.05, expired.set)
+        wheel.start()
+        self.assertFalse(deadline.cancel())
+        self.assertFalse(expired.wait(0.2))
+
+
+if __name__ == "__main__":
+    unittest.main()